@@ -97,7 +97,7 @@ def day2_nodes_flow(client,
                     with_static_network_config,
                     base_cluster_name):
     tf_network_name, total_num_nodes = get_network_num_nodes_from_tf(tf_folder)
-    with utils.file_lock_context():
+    with utils.terraform_lock(tf_folder):
         utils.run_command(
             f'make _apply_terraform CLUSTER_NAME={terraform_cluster_dir_prefix}'
         )
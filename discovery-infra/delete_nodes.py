@@ -77,7 +77,7 @@ def delete_nodes(cluster_name, namespace, tf_folder, tfvars):
 )
 def _try_to_delete_nodes(tf_folder):
     log.info('Start running terraform delete')
-    with utils.file_lock_context():
+    with utils.terraform_lock(tf_folder):
         utils.run_command_with_output(
             f'cd {tf_folder} && '
             'terraform destroy '
@@ -5,9 +5,11 @@ import json
 import os
 import shutil
 import tempfile
+import threading
 import time
 from argparse import ArgumentParser
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from contextlib import suppress
 from datetime import datetime
 
@@ -15,16 +17,14 @@ import assisted_service_client
 import requests
 import urllib3
 from dateutil.parser import isoparse
-from paramiko.ssh_exception import SSHException
-from scp import SCPException
 
 from test_infra import warn_deprecate
 from test_infra.tools.concurrently import run_concurrently
 from test_infra.assisted_service_api import InventoryClient, create_client
 from test_infra.consts import ClusterStatus, HostsProgressStages, env_defaults
-from test_infra.controllers.node_controllers.node import Node
 from test_infra.controllers.node_controllers.libvirt_controller import LibvirtController
 from test_infra.helper_classes import cluster as helper_cluster
+from test_infra.tools.node_logs import collect_sosreports
 from test_infra.utils import (are_host_progress_in_stage, config_etc_hosts,
                               recreate_folder, run_command, verify_logs_uploaded, fetch_url)
 
@@ -38,6 +38,9 @@ MAX_RETRIES = 3
 MUST_GATHER_MAX_RETRIES = 15
 RETRY_INTERVAL = 60 * 5
 CONNECTION_TIMEOUT = 30
+DEFAULT_JOBS = 4
+ARTIFACT_JOBS = 8
+CLUSTER_FILES = ("bootstrap.ign", "master.ign", "worker.ign", "install-config.yaml", "custom_manifests.yaml")
 SOSREPORT_SCRIPT = os.path.join(
     os.path.dirname(os.path.abspath(__file__)),
     "resources",
@@ -54,7 +57,9 @@ def main():
     if args.sosreport:
         gather_sosreport_data(output_dir=args.dest)
 
-    client = create_client(url=args.inventory_url, timeout=CONNECTION_TIMEOUT)
+    # Every concurrently downloaded artifact holds a connection of the shared pool
+    client = create_client(url=args.inventory_url, timeout=CONNECTION_TIMEOUT,
+                           connection_pool_maxsize=args.jobs * ARTIFACT_JOBS)
     if args.cluster_id:
         cluster = client.cluster_get(args.cluster_id)
         download_logs(client, json.loads(json.dumps(cluster.to_dict(), sort_keys=True, default=str)), args.dest,
@@ -66,15 +71,91 @@ def main():
             log.info('No clusters were found')
             return
 
-        for cluster in clusters:
-            if args.download_all or should_download_logs(cluster):
-                download_logs(client, cluster, args.dest, args.must_gather, args.update_by_events,
-                              pull_secret=args.pull_secret)
+        download_clusters_logs(client, [cluster for cluster in clusters
+                                        if args.download_all or should_download_logs(cluster)],
+                               args.dest, args.must_gather, args.update_by_events,
+                               pull_secret=args.pull_secret, jobs=args.jobs)
 
         log.info("Cluster installation statuses: %s",
                  dict(Counter(cluster["status"] for cluster in clusters).items()))
 
 
+class DownloadProgress:
+    """ Thread safe bookkeeping of downloaded clusters, used for progress and throughput reporting """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.downloaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+        self._started_at = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.downloaded + self.skipped + self.failed
+
+    def update(self, cluster: dict, output_folder: str, elapsed: float, downloaded: bool = False,
+               failed: bool = False):
+        size = get_folder_size(output_folder) if downloaded else 0
+        with self._lock:
+            if failed:
+                self.failed += 1
+            elif downloaded:
+                self.downloaded += 1
+                self.bytes += size
+            else:
+                self.skipped += 1
+
+            log.info("[%d/%d] %s logs of cluster %s in %.1fs (%.1f MiB)", self.done, self.total,
+                     "Failed downloading" if failed else "Downloaded" if downloaded else "Skipped",
+                     cluster['id'], elapsed, size / 1024 ** 2)
+
+    def summary(self):
+        elapsed = time.time() - self._started_at
+        log.info("Downloaded logs of %d clusters (%d skipped, %d failed) in %.1fs, "
+                 "%.1f MiB total at %.2f MiB/s", self.downloaded, self.skipped, self.failed, elapsed,
+                 self.bytes / 1024 ** 2, self.bytes / 1024 ** 2 / max(elapsed, 1))
+
+
+def get_folder_size(folder: str) -> int:
+    size = 0
+    for root, _, files in os.walk(folder):
+        for file_name in files:
+            with suppress(OSError):
+                size += os.path.getsize(os.path.join(root, file_name))
+    return size
+
+
+def download_clusters_logs(client: InventoryClient, clusters: list, dest: str, must_gather: bool,
+                           update_by_events: bool = False, pull_secret="", jobs: int = DEFAULT_JOBS):
+    progress = DownloadProgress(len(clusters))
+    errors = []
+
+    def _download_cluster_logs(cluster):
+        started_at = time.time()
+        output_folder = None
+        try:
+            output_folder = get_logs_output_folder(dest, cluster)
+            downloaded = download_logs(client, cluster, dest, must_gather, update_by_events, pull_secret=pull_secret)
+        except BaseException:
+            log.exception("Failed to download logs of cluster %s", cluster['id'])
+            progress.update(cluster, output_folder, time.time() - started_at, failed=True)
+            raise
+        progress.update(cluster, output_folder, time.time() - started_at, downloaded=downloaded)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_download_cluster_logs, cluster) for cluster in clusters]
+        for future in as_completed(futures):
+            if future.exception():
+                errors.append(future.exception())
+
+    progress.summary()
+    if errors:
+        raise errors[0]
+
+
 def get_clusters(client, all_cluster):
     if all_cluster:
         return client.get_all_clusters()
@@ -118,7 +199,9 @@ def is_update_needed(output_folder: str, update_on_events_update: bool, client:
 
 
 def download_logs(client: InventoryClient, cluster: dict, dest: str, must_gather: bool,
-                  update_by_events: bool = False, retry_interval: int = RETRY_INTERVAL, pull_secret=""):
+                  update_by_events: bool = False, retry_interval: int = RETRY_INTERVAL, pull_secret="",
+                  jobs: int = ARTIFACT_JOBS) -> bool:
+    """ Download all the artifacts of a cluster concurrently. Returns False if the logs were already up to date """
 
     if "hosts" not in cluster or len(cluster["hosts"]) == 0:
         cluster["hosts"] = client.get_cluster_hosts(cluster_id=cluster["id"])
@@ -126,72 +209,98 @@ def download_logs(client: InventoryClient, cluster: dict, dest: str, must_gather
     output_folder = get_logs_output_folder(dest, cluster)
     if not is_update_needed(output_folder, update_by_events, client, cluster):
         log.info(f"Skipping, no need to update {output_folder}.")
-        return
+        return False
 
     recreate_folder(output_folder)
     recreate_folder(os.path.join(output_folder, "cluster_files"))
 
     try:
-        write_metadata_file(client, cluster, os.path.join(output_folder, 'metadata.json'))
+        artifacts = [
+            (write_metadata_file, client, cluster, os.path.join(output_folder, 'metadata.json')),
+            (download_metrics, client, output_folder),
+            (download_cluster_events, client, cluster, output_folder),
+            (download_cluster_logs, client, cluster, output_folder, retry_interval),
+            (download_kubeconfig_and_must_gather, client, cluster, output_folder, must_gather, pull_secret),
+        ]
+        artifacts += [(download_cluster_file, client, cluster, output_folder, cluster_file)
+                      for cluster_file in CLUSTER_FILES]
+        artifacts += [(download_host_ignition, client, cluster, output_folder, host['id'])
+                      for host in cluster['hosts']]
+
+        run_concurrently(jobs=artifacts, max_workers=jobs, fail_fast=False)
 
-        with suppressAndLog(AssertionError, ConnectionError, requests.exceptions.ConnectionError):
-            client.download_metrics(os.path.join(output_folder, "metrics.txt"))
+    finally:
+        run_command(f"chmod -R ugo+rx '{output_folder}'")
 
-        for cluster_file in ("bootstrap.ign", "master.ign", "worker.ign", "install-config.yaml", "custom_manifests.yaml"):
-            with suppressAndLog(assisted_service_client.rest.ApiException):
-                client.download_and_save_file(cluster['id'], cluster_file,
-                                              os.path.join(output_folder, "cluster_files", cluster_file))
+    return True
 
-        for host_id in map(lambda host: host['id'], cluster['hosts']):
-            with suppressAndLog(assisted_service_client.rest.ApiException):
-                client.download_host_ignition(cluster['id'], host_id, os.path.join(output_folder, "cluster_files"))
 
-        with suppressAndLog(assisted_service_client.rest.ApiException):
-            client.download_cluster_events(cluster['id'], get_cluster_events_path(cluster, output_folder))
-            shutil.copy2(os.path.join(os.path.dirname(os.path.realpath(__file__)), "events.html"), output_folder)
+def download_metrics(client: InventoryClient, output_folder: str):
+    with suppressAndLog(AssertionError, ConnectionError, requests.exceptions.ConnectionError):
+        client.download_metrics(os.path.join(output_folder, "metrics.txt"))
 
-        with suppressAndLog(assisted_service_client.rest.ApiException):
-            are_masters_in_configuring_state = are_host_progress_in_stage(
-                cluster['hosts'], [HostsProgressStages.CONFIGURING], 2)
-            are_masters_in_join_state = are_host_progress_in_stage(
-                cluster['hosts'], [HostsProgressStages.JOINED], 2)
-            max_retries = MUST_GATHER_MAX_RETRIES if are_masters_in_join_state else MAX_RETRIES
-            is_controller_expected = cluster['status'] == ClusterStatus.INSTALLED or are_masters_in_configuring_state
-            min_number_of_logs = min_number_of_log_files(cluster, is_controller_expected)
-
-            for i in range(max_retries):
-                cluster_logs_tar = os.path.join(output_folder, f"cluster_{cluster['id']}_logs.tar")
-
-                with suppress(FileNotFoundError):
-                    os.remove(cluster_logs_tar)
-
-                client.download_cluster_logs(cluster['id'], cluster_logs_tar)
-                try:
-                    verify_logs_uploaded(cluster_logs_tar, min_number_of_logs,
-                                         installation_success=(cluster['status'] == ClusterStatus.INSTALLED),
-                                         check_oc=are_masters_in_join_state)
-                    break
-                except AssertionError as ex:
-                    log.warn(f"Cluster logs verification failed: {ex}")
-
-                    # Skip sleeping on last retry
-                    if i < MAX_RETRIES - 1:
-                        log.info(f"Going to retry in {retry_interval} seconds")
-                        time.sleep(retry_interval)
-
-        kubeconfig_path = os.path.join(output_folder, "kubeconfig-noingress")
 
-        with suppressAndLog(assisted_service_client.rest.ApiException):
-            client.download_kubeconfig_no_ingress(cluster['id'], kubeconfig_path)
+def download_cluster_file(client: InventoryClient, cluster: dict, output_folder: str, cluster_file: str):
+    with suppressAndLog(assisted_service_client.rest.ApiException):
+        client.download_and_save_file(cluster['id'], cluster_file,
+                                      os.path.join(output_folder, "cluster_files", cluster_file))
 
-            if must_gather:
-                recreate_folder(os.path.join(output_folder, "must-gather"))
-                config_etc_hosts(cluster['name'], cluster['base_dns_domain'],
-                                 helper_cluster.get_api_vip_from_cluster(client, cluster, pull_secret))
-                download_must_gather(kubeconfig_path, os.path.join(output_folder, "must-gather"))
 
-    finally:
-        run_command(f"chmod -R ugo+rx '{output_folder}'")
+def download_host_ignition(client: InventoryClient, cluster: dict, output_folder: str, host_id: str):
+    with suppressAndLog(assisted_service_client.rest.ApiException):
+        client.download_host_ignition(cluster['id'], host_id, os.path.join(output_folder, "cluster_files"))
+
+
+def download_cluster_events(client: InventoryClient, cluster: dict, output_folder: str):
+    with suppressAndLog(assisted_service_client.rest.ApiException):
+        client.download_cluster_events(cluster['id'], get_cluster_events_path(cluster, output_folder))
+        shutil.copy2(os.path.join(os.path.dirname(os.path.realpath(__file__)), "events.html"), output_folder)
+
+
+def download_cluster_logs(client: InventoryClient, cluster: dict, output_folder: str,
+                          retry_interval: int = RETRY_INTERVAL):
+    with suppressAndLog(assisted_service_client.rest.ApiException):
+        are_masters_in_configuring_state = are_host_progress_in_stage(
+            cluster['hosts'], [HostsProgressStages.CONFIGURING], 2)
+        are_masters_in_join_state = are_host_progress_in_stage(
+            cluster['hosts'], [HostsProgressStages.JOINED], 2)
+        max_retries = MUST_GATHER_MAX_RETRIES if are_masters_in_join_state else MAX_RETRIES
+        is_controller_expected = cluster['status'] == ClusterStatus.INSTALLED or are_masters_in_configuring_state
+        min_number_of_logs = min_number_of_log_files(cluster, is_controller_expected)
+
+        for i in range(max_retries):
+            cluster_logs_tar = os.path.join(output_folder, f"cluster_{cluster['id']}_logs.tar")
+
+            with suppress(FileNotFoundError):
+                os.remove(cluster_logs_tar)
+
+            client.download_cluster_logs(cluster['id'], cluster_logs_tar)
+            try:
+                verify_logs_uploaded(cluster_logs_tar, min_number_of_logs,
+                                     installation_success=(cluster['status'] == ClusterStatus.INSTALLED),
+                                     check_oc=are_masters_in_join_state)
+                break
+            except AssertionError as ex:
+                log.warn(f"Cluster logs verification failed: {ex}")
+
+                # Skip sleeping on last retry
+                if i < MAX_RETRIES - 1:
+                    log.info(f"Going to retry in {retry_interval} seconds")
+                    time.sleep(retry_interval)
+
+
+def download_kubeconfig_and_must_gather(client: InventoryClient, cluster: dict, output_folder: str,
+                                        must_gather: bool, pull_secret=""):
+    kubeconfig_path = os.path.join(output_folder, "kubeconfig-noingress")
+
+    with suppressAndLog(assisted_service_client.rest.ApiException):
+        client.download_kubeconfig_no_ingress(cluster['id'], kubeconfig_path)
+
+        if must_gather:
+            recreate_folder(os.path.join(output_folder, "must-gather"))
+            config_etc_hosts(cluster['name'], cluster['base_dns_domain'],
+                             helper_cluster.get_api_vip_from_cluster(client, cluster, pull_secret))
+            download_must_gather(kubeconfig_path, os.path.join(output_folder, "must-gather"))
 
 
 def get_cluster_events_path(cluster, output_folder):
@@ -249,23 +358,7 @@ def gather_sosreport_data(output_dir: str):
     recreate_folder(sosreport_output)
 
     controller = LibvirtController(config=TerraformConfig(), cluster_config=ClusterConfig())
-    run_concurrently(
-        jobs=[(gather_sosreport_from_node, node, sosreport_output)
-              for node in controller.list_nodes()],
-        timeout=60 * 20,
-    )
-
-
-def gather_sosreport_from_node(node: Node, destination_dir: str):
-    try:
-        node.upload_file(SOSREPORT_SCRIPT, "/tmp/man_sosreport.sh")
-        node.run_command("chmod a+x /tmp/man_sosreport.sh")
-        node.run_command("sudo /tmp/man_sosreport.sh")
-        node.download_file(f"/tmp/sosreport.tar.bz2",
-                           os.path.join(destination_dir, f"sosreport-{node.name}.tar.bz2"))
-
-    except (TimeoutError, RuntimeError, SSHException, SCPException):
-        log.exception("Failed accessing node %s for sosreport data gathering", node)
+    collect_sosreports(controller.list_nodes(), SOSREPORT_SCRIPT, sosreport_output)
 
 
 def collect_debug_info_from_cluster(cluster_deployment, agent_cluster_install):
@@ -305,6 +398,8 @@ def handle_arguments():
     parser.add_argument("--sosreport", help="gather sosreport from each node", action='store_true')
     parser.add_argument("--update-by-events", help="Update logs if cluster events were updated", action='store_true')
     parser.add_argument("-ps", "--pull-secret", help="Pull secret", type=str, default="")
+    parser.add_argument("-j", "--jobs", help="Number of clusters to download logs of concurrently", type=int,
+                        default=DEFAULT_JOBS)
 
     return parser.parse_args()
 
@@ -4,19 +4,25 @@ import re
 import os
 import time
 import json
+import queue
 import random
+import threading
 import urllib3
 import logging
 import hashlib
-import tempfile
 import contextlib
+import collections
 import elasticsearch
+import elasticsearch.helpers
 
 from logger import log
 from monitoring import process
-from contextlib import suppress
+from monitoring.rate_limiter import RateLimiter
+from monitoring.scrape_state import ScrapeState
+from types import MappingProxyType
 from argparse import ArgumentParser
 from test_infra.assisted_service_api import ClientFactory
+from test_infra.tools.concurrently import run_concurrently
 
 import assisted_service_client
 
@@ -26,6 +32,11 @@ warn_deprecate()
 
 RETRY_INTERVAL = 60 * 5
 MAX_EVENTS = 5000
+ES_CHUNK_SIZE = 100
+ES_CONFLICT_STATUS = 409
+STATE_FILE = "/tmp/log_scrap_state.db"
+WORKERS = 1
+MAX_REQUESTS_PER_SECOND = 0
 
 UUID_REGEX = r'[a-f0-9]{8}-?[a-f0-9]{4}-?4[a-f0-9]{3}-?[89ab][a-f0-9]{3}-?[a-f0-9]{12}'
 
@@ -34,20 +45,59 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 es_logger = logging.getLogger('elasticsearch')
 es_logger.setLevel(logging.WARNING)
 
+# base_doc is the read-only processed metadata every event document of the cluster is merged onto
+ProcessedCluster = collections.namedtuple("ProcessedCluster", ["base_doc", "anonymizer"])
+
 class ScrapeEvents:
-    def __init__(self, inventory_url: str, offline_token: str, index: str, es_server: str, es_user:str, es_pass:str, backup_destination: str):
+    def __init__(self, inventory_url: str, offline_token: str, index: str, es_server: str, es_user:str, es_pass:str, backup_destination: str,
+                 es_chunk_size: int = ES_CHUNK_SIZE, state_file: str = STATE_FILE, workers: int = WORKERS,
+                 max_requests_per_second: float = MAX_REQUESTS_PER_SECOND):
 
         self.inventory_url = inventory_url
-        self.client = ClientFactory.create_client(url=self.inventory_url, offline_token=offline_token)
+        self.offline_token = offline_token
+        self.main_client = ClientFactory.create_client(url=self.inventory_url, offline_token=offline_token)
+        # Client of the job running on the current thread, checked out of the idle clients for the job's duration
+        self._worker_clients = threading.local()
+        self._idle_clients = queue.SimpleQueue()
+        self.workers = max(1, workers)
+        # Shared by all workers, limits the overall load on assisted-service
+        self.rate_limiter = RateLimiter(max_requests_per_second)
+        self.versions = None
 
         self.index = index
         self.es = elasticsearch.Elasticsearch(es_server, http_auth=(es_user, es_pass))
+        self.es_chunk_size = es_chunk_size
 
         self.backup_destination = backup_destination
         if self.backup_destination and not os.path.exists(self.backup_destination):
             os.makedirs(self.backup_destination)
 
-        self.cache_event_count_per_cluster = dict()
+        self.state = ScrapeState(state_file)
+
+    @property
+    def client(self):
+        """ API client of the current worker, the underlying connection pools aren't shared between workers """
+        return getattr(self._worker_clients, "client", None) or self.main_client
+
+    @contextlib.contextmanager
+    def worker_client(self):
+        """ Use a client of its own in the block, reused across scrape cycles. A single worker uses the main client """
+        if self.workers == 1:
+            yield
+            return
+
+        try:
+            client = self._idle_clients.get_nowait()
+        except queue.Empty:
+            # At most one client per worker is created, as many as the jobs that run concurrently
+            client = ClientFactory.create_client(url=self.inventory_url, offline_token=self.offline_token,
+                                                 wait_for_api=False)
+        self._worker_clients.client = client
+        try:
+            yield
+        finally:
+            self._worker_clients.client = None
+            self._idle_clients.put(client)
 
     def run_service(self):
 
@@ -60,26 +110,45 @@ class ScrapeEvents:
                 time.sleep(RETRY_INTERVAL)
                 break
 
+            # Component versions don't change during a cycle, fetch them once for all clusters
+            self.rate_limiter.acquire()
+            self.versions = self.client.get_versions()
+
             cluster_count = len(clusters)
-            for i, cluster in enumerate(clusters):
-                cluster_id = cluster["id"]
-                log.info(f"{i}/{cluster_count}: Starting process of cluster {cluster_id}")
-                if "hosts" not in cluster or len(cluster["hosts"]) == 0:
-                    cluster["hosts"] = self.client.get_cluster_hosts(cluster_id=cluster["id"])
+            jobs = [(self.scrape_worker_cluster, i, cluster_count, cluster) for i, cluster in enumerate(clusters)]
+            run_concurrently(jobs, max_workers=self.workers, fail_fast=False)
+
+    def scrape_worker_cluster(self, i, cluster_count, cluster):
+        with self.worker_client():
+            self.scrape_cluster(i, cluster_count, cluster)
+
+    def scrape_cluster(self, i, cluster_count, cluster):
+        cluster_id = cluster["id"]
+        if not self.state.is_updated(cluster):
+            log.debug(f"{i}/{cluster_count}: Skipping cluster {cluster_id}, it wasn't updated since last scraped")
+            return
+
+        log.info(f"{i}/{cluster_count}: Starting process of cluster {cluster_id}")
+        if "hosts" not in cluster or len(cluster["hosts"]) == 0:
+            self.rate_limiter.acquire()
+            cluster["hosts"] = self.client.get_cluster_hosts(cluster_id=cluster["id"])
 
-                self.process_cluster(cluster)
+        self.process_cluster(cluster)
 
     def get_metadata_json(self, cluster: dict):
+        if self.versions is None:
+            self.rate_limiter.acquire()
+            self.versions = self.client.get_versions()
+
         d = {'cluster': cluster}
-        d.update(self.client.get_versions())
+        d.update(self.versions)
         return d
 
     def process_cluster(self, cluster):
-        with tempfile.NamedTemporaryFile() as temp_event_file:
-            self.write_events_file(cluster, temp_event_file.name)
-            with open(temp_event_file.name) as f:
-                event_list = json.load(f)
-
+        event_list = self.get_events(cluster)
+        if event_list is None:
+            # The scrape state isn't updated, so the cluster is scraped again in the next cycle
+            return
         self.elastefy_events(cluster, event_list)
 
     def elastefy_events(self, cluster, event_list):
@@ -96,26 +165,40 @@ class ScrapeEvents:
         if self.backup_destination:
             self.save_new_backup(cluster_id, event_list, metadata_json)
 
-        cluster_bash_data = process_metadata(metadata_json)
-        event_names = get_cluster_object_names(cluster_bash_data)
-
-        self.process_and_log_events(cluster_bash_data, event_list, event_names)
+        processed_cluster = self.get_processed_cluster(cluster, metadata_json)
 
+        new_events = self.state.get_new_events(cluster_id, event_list)
+        if self.process_and_log_events(processed_cluster, new_events):
+            # Makes the new events visible to the count below, once for the whole batch
+            self.es.indices.refresh(index=self.index)
 
         if self.does_cluster_needs_full_update(cluster_id, event_list):
             log.info(f"Cluster {cluster_id} logged events are not same as the event count, logging all clusters events")
-            self.process_and_log_events(cluster_bash_data, event_list, event_names, False)
+            self.process_and_log_events(processed_cluster, event_list, False)
+
+        if event_list:
+            self.state.update(cluster, last_event_time=event_list[-1]["event_time"], last_doc_id=get_doc_id(event_list[-1]))
+        else:
+            self.state.update(cluster)
+
+    def get_processed_cluster(self, cluster, metadata_json):
+        """ Processed metadata of the cluster, shared by all the event documents of a scrape """
+        cluster_bash_data = process_metadata(metadata_json)
+        cluster_bash_data["inventory_url"] = self.inventory_url
+        return ProcessedCluster(base_doc=MappingProxyType(cluster_bash_data),
+                                anonymizer=MessageAnonymizer(get_cluster_object_names(cluster_bash_data)))
 
     def does_cluster_needs_full_update(self, cluster_id, event_list):
         # check if cluster is missing past events
-        cluster_events_count = self.cache_event_count_per_cluster.get(cluster_id, None)
+        cursor = self.state.get(cluster_id)
+        cluster_events_count = cursor.event_count if cursor else None
         relevant_event_count = len([event for event in event_list if not process.is_event_skippable(event)])
 
         if cluster_events_count and cluster_events_count == relevant_event_count:
             return False
         else:
             cluster_events_count_from_db = self.get_cluster_event_count_on_es_db(cluster_id)
-            self.cache_event_count_per_cluster[cluster_id] = cluster_events_count_from_db
+            self.state.set_event_count(cluster_id, cluster_events_count_from_db)
         if cluster_events_count_from_db < relevant_event_count:
             missing_events = relevant_event_count - cluster_events_count_from_db
             logging.info(f"cluster {cluster_id} is missing {missing_events} events")
@@ -124,30 +207,37 @@ class ScrapeEvents:
             return False
 
     def get_cluster_event_count_on_es_db(self, cluster_id):
-        time.sleep(1)
-        return self.es.search(index=self.index,
-                              body={"query": {"match_phrase": {"cluster.id": cluster_id}}})["hits"]["total"]["value"]
-
-    def process_and_log_events(self, cluster_bash_data, event_list, event_names, only_new_events=True):
-        for event in event_list[::-1]:
-            if process.is_event_skippable(event):
+        return self.es.count(index=self.index,
+                             body={"query": {"match_phrase": {"cluster.id": cluster_id}}})["count"]
+
+    def process_and_log_events(self, processed_cluster, event_list, only_new_events=True):
+        """ :return: The number of events that were logged """
+        actions = self.get_event_actions(processed_cluster, event_list)
+        results = elasticsearch.helpers.streaming_bulk(self.es, actions, chunk_size=self.es_chunk_size,
+                                                       raise_on_error=False)
+        logged_count = 0
+        # Events are sent newest first, the first conflict is the newest event that was already logged
+        for ok, item in results:
+            if ok:
+                logged_count += 1
                 continue
 
-            doc_id = get_doc_id(event)
-            cluster_bash_data["no_name_message"] = get_no_name_message(event["message"], event_names)
-            cluster_bash_data["inventory_url"] = self.inventory_url
-
-            if "props" in event:
-                event["event.props"] = json.loads(event["props"])
+            result = item["create"]
+            if result.get("status") != ES_CONFLICT_STATUS:
+                raise elasticsearch.helpers.BulkIndexError(f"Failed to log event {result.get('_id')}", [item])
 
-            process_event_doc(event, cluster_bash_data)
-            ret = self.log_doc(cluster_bash_data, doc_id)
+            log.debug("Hit logged event")
+            if only_new_events:
+                break
+        return logged_count
 
-            for key in event:
-                _ = cluster_bash_data.pop(key,None)
+    def get_event_actions(self, processed_cluster, event_list):
+        for event in event_list[::-1]:
+            if process.is_event_skippable(event):
+                continue
 
-            if not ret and only_new_events:
-                break
+            doc = process_event_doc(event, processed_cluster)
+            yield {"_op_type": "create", "_index": self.index, "_id": get_doc_id(event), "_source": doc}
 
     def save_new_backup(self,cluster_id, event_list, metadata_json):
         cluster_backup_directory_path = os.path.join(self.backup_destination, f"cluster_{cluster_id}")
@@ -162,27 +252,38 @@ class ScrapeEvents:
         with open(metadata_dest, "w") as f:
             json.dump(metadata_json, f, indent=4)
 
-    def log_doc(self, doc, id_):
+    def get_events(self, cluster):
+        """ :return: The events of the cluster, or None if they couldn't be fetched """
+        self.rate_limiter.acquire()
         try:
-            res = self.es.create(index=self.index, body=doc, id=id_)
-        except elasticsearch.exceptions.ConflictError:
-            log.debug("Hit logged event")
+            return self.client.get_events(cluster['id'], categories=["user", "metrics"])
+        except assisted_service_client.rest.ApiException as e:
+            log.warning(f"Failed to get the events of cluster {cluster['id']}: {e}")
             return None
-        return res
-
-    def write_events_file(self, cluster, output_file):
-        with suppress(assisted_service_client.rest.ApiException):
-            self.client.download_cluster_events(cluster['id'], output_file, categories=["user", "metrics"])
 
     def get_clusters(self):
+        self.rate_limiter.acquire()
         return self.client.clusters_list()
 
+class MessageAnonymizer:
+    """ Strips the host prefix and replaces the given names and UUIDs of event messages in a single regex pass """
+
+    REPLACEMENTS = {"host": "", "uuid": "UUID", "name": "Name"}
+
+    def __init__(self, names: list):
+        patterns = [r"(?P<host>^Host \S+:)", f"(?P<uuid>{UUID_REGEX})"]
+        # Longest first, so that a name containing another name is replaced as a whole
+        names = sorted({name for name in names if name}, key=len, reverse=True)
+        if names:
+            patterns.append(f"(?P<name>{'|'.join(map(re.escape, names))})")
+        self._regex = re.compile("|".join(patterns))
+
+    def anonymize(self, message: str):
+        return self._regex.sub(lambda match: self.REPLACEMENTS[match.lastgroup], message)
+
+
 def get_no_name_message(event_message: str, event_names: list):
-    event_message = re.sub(r"^Host \S+:", "", event_message)
-    for name in event_names:
-        event_message = event_message.replace(name, "Name")
-    event_message = re.sub(UUID_REGEX, "UUID", event_message)
-    return event_message
+    return MessageAnonymizer(event_names).anonymize(event_message)
 
 def get_cluster_object_names(cluster_bash_data):
     strings_to_remove = list()
@@ -202,8 +303,14 @@ def get_doc_id(event_json):
     _id = int(hashlib.md5(id_str.encode('utf-8')).hexdigest(), 16)
     return str(_id)
 
-def process_event_doc(event_data, cluster_bash_data):
-    cluster_bash_data.update(event_data)
+def process_event_doc(event_data, processed_cluster):
+    # A shallow merge, documents are serialized a chunk at a time so each of them must be a separate object
+    doc = {**processed_cluster.base_doc,
+           "no_name_message": processed_cluster.anonymizer.anonymize(event_data["message"]),
+           **event_data}
+    if "props" in event_data:
+        doc["event.props"] = json.loads(event_data["props"])
+    return doc
 
 
 
@@ -216,6 +323,10 @@ def handle_arguments():
     parser.add_argument("-ep", "--es_pass", help="Elasticsearch password", type=str)
     parser.add_argument("--index", help="Index", type=str)
     parser.add_argument("--backup-destination", help="Path to save backup, if empty no back up saved", default=None, type=str)
+    parser.add_argument("--workers", help="Number of clusters processed concurrently", default=WORKERS, type=int)
+    parser.add_argument("--max-requests-per-second", help="Limit of assisted-service requests per second, 0 for no limit", default=MAX_REQUESTS_PER_SECOND, type=float)
+    parser.add_argument("--state-file", help="SQLite file that persists the scraping progress of each cluster", default=STATE_FILE, type=str)
+    parser.add_argument("--es-chunk-size", help="Number of events sent to Elasticsearch in a single bulk request", default=ES_CHUNK_SIZE, type=int)
 
     return parser.parse_args()
 
@@ -230,7 +341,11 @@ def main():
                                          es_server=args.es_server,
                                          es_user = args.es_user,
                                          es_pass = args.es_pass,
-                                         backup_destination=args.backup_destination)
+                                         backup_destination=args.backup_destination,
+                                         es_chunk_size=args.es_chunk_size,
+                                         state_file=args.state_file,
+                                         workers=args.workers,
+                                         max_requests_per_second=args.max_requests_per_second)
             scrape_events.run_service()
         except Exception as EX:
             log.warn(f"Elastefying logs failed with error {EX}, sleeping for {RETRY_INTERVAL} and retrying")
@@ -1,8 +1,11 @@
 import re
+import copy
 import json
 import logging
 import collections
 
+from test_infra.utils.inventory_cache import get_host_inventory
+
 REMOVED_FIELDS = [
     "cluster.image_info_ssh_public_key",
     "cluster.ssh_public_key",
@@ -20,6 +23,24 @@ REMOVED_FIELDS = [
     "link"
 ]
 
+
+def build_fields_trie(fields):
+    """ Nest dotted field paths into a trie, a leaf (None) means that the field is removed """
+    trie = {}
+    for field in fields:
+        node = trie
+        *parents, leaf = field.split(".")
+        for key in parents:
+            if key in node and node[key] is None:
+                break
+            node = node.setdefault(key, {})
+        else:
+            node[leaf] = None
+    return trie
+
+
+REMOVED_FIELDS_TRIE = build_fields_trie(REMOVED_FIELDS)
+
 SKIPPABLE_EVENTS = [
     "reached installation stage Writing image to disk"
 ]
@@ -43,10 +64,11 @@ class GetProcessedMetadataJson:
         for host in self.metadata_json["cluster"]["hosts"]:
             if "inventory" not in host:
                 return
-            inventory = json.loads(host["inventory"])
+            inventory = get_host_inventory(host)
             vendor = inventory.get("system_vendor", None)
             if vendor:
-                host["vendor"] = vendor
+                # The parsed inventory is shared through the cache, don't let the document alias it
+                host["vendor"] = copy.copy(vendor)
 
 
     def __convert_strings_to_dict(self):
@@ -62,26 +84,24 @@ class GetProcessedMetadataJson:
                 host["validations_info"] = convert_field_to_json(host["validations_info"])
 
     def __remove_fields_if_exists(self):
-        for remove_field in REMOVED_FIELDS:
-            try:
-                self.__pop_fields(self.metadata_json, remove_field)
-            except KeyError:
-                pass
-
-    # Delete a field in string path joind by "."
-    def __pop_fields(self, p_json, pop_str):
-        if type(p_json) == list:
-            for l in p_json:
-                self.__pop_fields(l, pop_str)
-            return
-        pop_list = pop_str.split(".", 1)
-        if len(pop_list) == 1:
-            del p_json[pop_list[0]]
-            return
-        if pop_list[0] not in p_json:
-            return
-        self.__pop_fields(p_json[pop_list[0]], pop_list[1])
+        remove_fields(self.metadata_json, REMOVED_FIELDS_TRIE)
+
+
+# Delete the fields of a trie built by build_fields_trie in a single walk, lists are applied element wise
+def remove_fields(p_json, fields_trie):
+    if type(p_json) == list:
+        for l in p_json:
+            remove_fields(l, fields_trie)
+        return
+    if type(p_json) != dict:
         return
+    for key, sub_trie in fields_trie.items():
+        if key not in p_json:
+            continue
+        if sub_trie is None:
+            del p_json[key]
+        else:
+            remove_fields(p_json[key], sub_trie)
 
 def is_event_skippable(event):
     for skippable_text in SKIPPABLE_EVENTS:
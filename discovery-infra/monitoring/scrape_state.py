@@ -0,0 +1,70 @@
+import sqlite3
+import threading
+from collections import namedtuple
+
+from dateutil.parser import isoparse
+
+ClusterCursor = namedtuple("ClusterCursor", ["updated_at", "last_event_time", "last_doc_id", "event_count"])
+
+
+class ScrapeState:
+    """ Per cluster scraping cursor persisted in SQLite, so it survives restarts of the scraper.
+
+        For each cluster it keeps the updated_at that was last scraped, the newest logged event
+        (time and doc id) and the number of events known to be logged. """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS clusters ("
+                "cluster_id TEXT PRIMARY KEY, updated_at TEXT, last_event_time TEXT, last_doc_id TEXT, "
+                "event_count INTEGER)"
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, cluster_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated_at, last_event_time, last_doc_id, event_count FROM clusters WHERE cluster_id = ?",
+                (cluster_id,),
+            ).fetchone()
+        return ClusterCursor(*row) if row else None
+
+    def is_updated(self, cluster):
+        cursor = self.get(cluster["id"])
+        return cursor is None or cursor.updated_at != str(cluster.get("updated_at"))
+
+    def get_new_events(self, cluster_id, event_list):
+        """ Events that are not older than the cursor. Events of the cursor's own timestamp are kept, since
+            several events may share it, logging them again is harmless """
+        cursor = self.get(cluster_id)
+        if cursor is None or cursor.last_event_time is None:
+            return event_list
+
+        last_event_time = isoparse(cursor.last_event_time)
+        return [event for event in event_list if isoparse(event["event_time"]) >= last_event_time]
+
+    def set_event_count(self, cluster_id, event_count):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO clusters (cluster_id) VALUES (?)", (cluster_id,))
+            self._conn.execute("UPDATE clusters SET event_count = ? WHERE cluster_id = ?", (event_count, cluster_id))
+
+    def update(self, cluster, last_event_time=None, last_doc_id=None):
+        """ Mark the cluster as scraped at its current updated_at, optionally advancing the events cursor """
+        cluster_id = cluster["id"]
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO clusters (cluster_id) VALUES (?)", (cluster_id,))
+            self._conn.execute(
+                "UPDATE clusters SET updated_at = ? WHERE cluster_id = ?", (str(cluster.get("updated_at")), cluster_id)
+            )
+            if last_event_time is not None:
+                self._conn.execute(
+                    "UPDATE clusters SET last_event_time = ?, last_doc_id = ? WHERE cluster_id = ?",
+                    (last_event_time, last_doc_id, cluster_id),
+                )
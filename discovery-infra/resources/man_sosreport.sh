@@ -1,6 +1,16 @@
 #!/bin/bash
 export LANG=C
 
+# Pass "-" to write the archive to stdout, progress messages are then written to stderr
+SOSREPORT_ARCHIVE=${1:-/tmp/sosreport.tar.bz2}
+if [[ "$SOSREPORT_ARCHIVE" == "-" ]]; then
+  exec 3>&1 1>&2
+  SOSREPORT_ARCHIVE=/dev/fd/3
+  TAR_COMPRESSION=-z
+else
+  TAR_COMPRESSION=-j
+fi
+
 # If this script hangs, un-comment the below two entries and note the command that the script hangs on.  Then comment out that command and re-run the script.
 # set -x
 # set -o verbose
@@ -127,6 +137,7 @@ oc describe clusterversion &> clusterversion
 oc describe nodes &> nodes
 
 echo -e "Compressing files..."
-tar -cjhf /tmp/sosreport.tar.bz2 ./
+tar -c $TAR_COMPRESSION -hf "$SOSREPORT_ARCHIVE" ./
+cd / && rm -rf /tmp/sosreport
 
 echo -e "Script complete."
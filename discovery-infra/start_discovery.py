@@ -191,8 +191,7 @@ def create_nodes(
         tf
 ):
     log.info('Start running terraform')
-    with utils.file_lock_context():
-        return tf.apply()
+    return tf.apply()
 
 
 # Starts terraform nodes creation, waits till all nodes will get ip and will move to known status
@@ -810,7 +809,7 @@ def execute_kube_api_flow():
     )
     infra_env.status()
     image_url = infra_env.get_iso_download_url()
-    utils.download_iso(image_url, image_path)
+    utils.download_iso(image_url, image_path, image_id=infra_env.get_iso_created_time())
     try:
         nodes_flow_kube_api(cluster_name, machine_net, cluster_deployment, agent_cluster_install)
     finally:
@@ -16,17 +16,27 @@ from kubernetes.config import load_kube_config
 from kubernetes.config.kube_config import Configuration as KubeConfiguration
 from logger import log
 from retry import retry
-from urllib3 import HTTPResponse
 
 from test_infra import consts, utils
+from test_infra.tools.downloader import Downloader
+from test_infra.tools.iso_cache import IsoCache, iso_cache
+from test_infra.utils.hosts_index import HostsIndex
 
 
 class InventoryClient(object):
-    def __init__(self, inventory_url: str, offline_token: Union[str, None], pull_secret: str):
+    def __init__(
+        self,
+        inventory_url: str,
+        offline_token: Union[str, None],
+        pull_secret: str,
+        connection_pool_maxsize: Optional[int] = None,
+    ):
         self.inventory_url = inventory_url
         configs = Configuration()
         configs.host = configs.host.replace("http://api.openshift.com", self.inventory_url)
         configs.verify_ssl = False
+        if connection_pool_maxsize:
+            configs.connection_pool_maxsize = connection_pool_maxsize
         self.set_config_auth(configs, offline_token)
         self._set_x_secret_key(configs, pull_secret)
 
@@ -130,18 +140,12 @@ class InventoryClient(object):
     def cluster_get(self, cluster_id: str) -> models.cluster.Cluster:
         return self.client.get_cluster(cluster_id=cluster_id)
 
-    @classmethod
-    def _download(cls, response: HTTPResponse, file_path: str, verify_file_size=False) -> None:
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(response, f)
-        if verify_file_size:
-            content_length = int(response.headers["content-length"])
-            actual_file_size = os.path.getsize(file_path)
-            if actual_file_size < content_length:
-                raise RuntimeError(
-                    f"Could not complete ISO download {file_path}. "
-                    f"Actual size: {actual_file_size}. Expected size: {content_length}"
-                )
+    def _get_auth_headers(self) -> Dict[str, str]:
+        # Calling auth_settings() also refreshes an expired API key through refresh_api_key_hook
+        auth_settings = self.api.configuration.auth_settings()
+        return {
+            auth["key"]: auth["value"] for auth in auth_settings.values() if auth["in"] == "header" and auth["value"]
+        }
 
     def generate_image(
         self,
@@ -157,12 +161,12 @@ class InventoryClient(object):
         log.info("Generating image with params %s", image_create_params.__dict__)
         return self.client.generate_cluster_iso(cluster_id=cluster_id, image_create_params=image_create_params)
 
-    @retry(exceptions=RuntimeError, tries=2, delay=3)
+    @retry(exceptions=(RuntimeError, requests.RequestException), tries=2, delay=3)
     def download_image(self, cluster_id: str, image_path: str) -> None:
         log.info("Downloading image for cluster %s to %s", cluster_id, image_path)
-        response = self.client.download_cluster_iso_with_http_info(cluster_id=cluster_id, _preload_content=False)
-        response_obj = response[0]
-        self._download(response=response_obj, file_path=image_path, verify_file_size=True)
+        url = f"{self.api.configuration.host}/clusters/{cluster_id}/downloads/image"
+        downloader = Downloader(url, headers=self._get_auth_headers(), verify_ssl=self.api.configuration.verify_ssl)
+        downloader.download(image_path)
 
     def generate_and_download_image(
         self,
@@ -172,10 +176,29 @@ class InventoryClient(object):
         image_type: str = consts.ImageType.FULL_ISO,
         static_network_config: Optional[list] = None,
     ):
-        self.generate_image(
+        cluster = self.generate_image(
             cluster_id=cluster_id, ssh_key=ssh_key, image_type=image_type, static_network_config=static_network_config
         )
-        self.download_image(cluster_id=cluster_id, image_path=image_path)
+        # The image also embeds cluster state that isn't passed here (e.g. the discovery ignition and the proxy),
+        # the service regenerates the image when it changes, which is identified by the image creation time
+        image_created_at = getattr(cluster.image_info, "created_at", None)
+        if image_created_at is None:
+            self.download_image(cluster_id=cluster_id, image_path=image_path)
+            return
+
+        download_url = getattr(cluster.image_info, "download_url", None)
+        cache_key = IsoCache.key_for(
+            image_created_at=image_created_at,
+            # The presigned query string changes between requests for the same image
+            download_url=download_url.split("?", 1)[0] if download_url else None,
+            ssh_key=ssh_key,
+            image_type=image_type,
+            static_network_config=static_network_config,
+            generator_version=getattr(cluster.image_info, "generator_version", None),
+        )
+        iso_cache.materialize(
+            cache_key, image_path, lambda path: self.download_image(cluster_id=cluster_id, image_path=path)
+        )
 
     def update_hosts(
         self, cluster_id: str, hosts_with_roles, hosts_names: Optional[models.ClusterupdateparamsHostsNames] = None
@@ -217,30 +240,26 @@ class InventoryClient(object):
         log.info(f"Deleting host {host_id} in cluster {cluster_id}")
         self.client.deregister_host(cluster_id=cluster_id, host_id=host_id)
 
+    def get_cluster_hosts_index(self, cluster_id: str) -> HostsIndex:
+        return HostsIndex(self.get_cluster_hosts(cluster_id))
+
     def get_hosts_id_with_macs(self, cluster_id: str) -> Dict[Any, List[str]]:
-        hosts = self.get_cluster_hosts(cluster_id)
-        hosts_data = {}
-        for host in hosts:
-            inventory = json.loads(host.get("inventory", '{"interfaces":[]}'))
-            hosts_data[host["id"]] = [interface["mac_address"] for interface in inventory["interfaces"]]
-        return hosts_data
+        return self.get_cluster_hosts_index(cluster_id).get_ids_with_macs()
 
     def get_host_by_mac(self, cluster_id: str, mac: str) -> Dict[str, Any]:
-        hosts = self.get_cluster_hosts(cluster_id)
+        return self.get_cluster_hosts_index(cluster_id).get_by_mac(mac)
 
-        for host in hosts:
-            inventory = json.loads(host.get("inventory", '{"interfaces":[]}'))
-            if mac.lower() in [interface["mac_address"].lower() for interface in inventory["interfaces"]]:
-                return host
+    def get_hosts_by_macs(self, cluster_id: str, macs: List[str]) -> List[Dict[str, Any]]:
+        return self.get_cluster_hosts_index(cluster_id).get_by_macs(macs)
 
     def get_host_by_name(self, cluster_id: str, host_name: str) -> Dict[str, Any]:
-        hosts = self.get_cluster_hosts(cluster_id)
+        host = self.get_cluster_hosts_index(cluster_id).get_by_name(host_name)
+        if host:
+            log.info(f"Requested host by name: {host_name}, host details: {host}")
+        return host
 
-        for host in hosts:
-            hostname = host.get("requested_hostname")
-            if hostname == host_name:
-                log.info(f"Requested host by name: {host_name}, host details: {host}")
-                return host
+    def get_host_by_id(self, cluster_id: str, host_id: str) -> Dict[str, Any]:
+        return self.get_cluster_hosts_index(cluster_id).get_by_id(host_id)
 
     def download_and_save_file(self, cluster_id: str, file_name: str, file_path: str) -> None:
         log.info("Downloading %s to %s", file_name, file_path)
@@ -298,8 +317,10 @@ class InventoryClient(object):
     def download_cluster_logs(self, cluster_id: str, output_file: str) -> None:
         log.info("Downloading cluster logs to %s", output_file)
         response = self.client.download_cluster_logs(cluster_id=cluster_id, _preload_content=False)
+        # Stream the tar to disk instead of holding multi GB archives in memory
         with open(output_file, "wb") as _file:
-            _file.write(response.data)
+            shutil.copyfileobj(response, _file)
+        response.release_conn()
 
     def get_events(self, cluster_id: str, host_id: Optional[str] = "", categories=["user"]) -> dict:
         # Get users events
@@ -413,9 +434,10 @@ class ClientFactory:
         pull_secret: Optional[str] = "",
         wait_for_api: Optional[bool] = True,
         timeout: Optional[int] = consts.WAIT_FOR_BM_API,
+        connection_pool_maxsize: Optional[int] = None,
     ):
         log.info("Creating assisted-service client for url: %s", url)
-        c = InventoryClient(url, offline_token, pull_secret)
+        c = InventoryClient(url, offline_token, pull_secret, connection_pool_maxsize)
         if wait_for_api:
             c.wait_for_api_readiness(timeout)
         return c
@@ -430,7 +452,12 @@ class ClientFactory:
 
 
 def create_client(
-    url, offline_token=utils.get_env("OFFLINE_TOKEN"), pull_secret="", wait_for_api=True, timeout=consts.WAIT_FOR_BM_API
+    url,
+    offline_token=utils.get_env("OFFLINE_TOKEN"),
+    pull_secret="",
+    wait_for_api=True,
+    timeout=consts.WAIT_FOR_BM_API,
+    connection_pool_maxsize=None,
 ):
     warnings.warn("create_client is deprecated. Use ClientFactory.create_client instead.", DeprecationWarning)
-    return ClientFactory.create_client(url, offline_token, pull_secret, wait_for_api, timeout)
+    return ClientFactory.create_client(url, offline_token, pull_secret, wait_for_api, timeout, connection_pool_maxsize)
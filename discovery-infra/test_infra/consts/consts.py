@@ -15,6 +15,18 @@ TFVARS_JSON_NAME = "terraform.tfvars.json"
 IMAGE_FOLDER = "/tmp/test_images"
 TF_MAIN_JSON_NAME = "main.tf"
 BASE_IMAGE_FOLDER = "/tmp/images"
+ISO_CACHE_FOLDER = "/tmp/iso_cache"
+# Images embed per cluster state, so they are rarely shared between tests. Caching is opt-in through the environment
+ISO_CACHE_MAX_BYTES = 0
+ISO_CACHE_LOCK_TIMEOUT = 30 * MINUTE
+LOCKS_FOLDER = "/tmp/discovery-infra-locks"
+TF_PLUGIN_CACHE_FOLDER = "/tmp/tf-plugin-cache"
+DISK_TEMPLATES_FOLDER = "/tmp/disk_templates"
+DISK_TEMPLATE_LOCK_TIMEOUT = 10 * MINUTE
+LOCK_TIMEOUT = 5 * MINUTE
+LIBVIRT_LOCK_TIMEOUT = 30 * MINUTE
+LIBVIRT_LOCK = "libvirt"
+ETC_HOSTS_LOCK = "etc-hosts"
 IMAGE_NAME = "installer-image.iso"
 STORAGE_PATH = "/var/lib/libvirt/openshift-images"
 SSH_KEY = "ssh_key/key.pub"
@@ -15,6 +15,7 @@ DEFAULT_CLUSTER_CIDR: str = "10.128.0.0/14"
 DEFAULT_HOST_PREFIX: int = 23
 DEFAULT_IMAGE_TYPE: str = consts.ImageType.FULL_ISO
 DEFAULT_TEST_TEARDOWN: bool = True
+DEFAULT_REUSE_NODES: bool = False
 DEFAULT_PLATFORM: str = consts.Platforms.BARE_METAL
 DEFAULT_USER_MANAGED_NETWORKING: bool = False
 DEFAULT_HIGH_AVAILABILITY_MODE: str = consts.HighAvailabilityMode.FULL
@@ -11,12 +11,16 @@ class LoadBalancerController:
     def __init__(self, tf: TerraformUtils):
         self._tf = tf
 
-    def set_load_balancing_config(self, load_balancer_ip: str, master_ips: List[str], worker_ips: List[str]) -> None:
+    def set_load_balancing_config(
+        self, load_balancer_ip: str, master_ips: List[str], worker_ips: List[str], wait: bool = True
+    ) -> None:
+        """ :param wait: Wait for the load balancer to be up, pass False when the change is batched and not applied yet """
         load_balancer_config_file = self._render_load_balancer_config_file(load_balancer_ip, master_ips, worker_ips)
         self._tf.change_variables(
             {"load_balancer_ip": load_balancer_ip, "load_balancer_config_file": load_balancer_config_file}
         )
-        self._wait_for_load_balancer(load_balancer_ip)
+        if wait:
+            self.wait_for_load_balancer(load_balancer_ip)
 
     @staticmethod
     def _render_socket_endpoint(ip: str, port: int) -> str:
@@ -64,7 +68,7 @@ class LoadBalancerController:
             )
             return False
 
-    def _wait_for_load_balancer(self, load_balancer_ip: str) -> None:
+    def wait_for_load_balancer(self, load_balancer_ip: str) -> None:
         log.info("Waiting for load balancer %s to be up", load_balancer_ip)
         waiting.wait(
             lambda: self._connect_to_load_balancer(load_balancer_ip),
@@ -0,0 +1,64 @@
+import copy
+from typing import List, Optional, Tuple
+from xml.etree import ElementTree
+
+# Keep the prefixes libvirt and terraform use, instead of ElementTree's generated ns0, ns1...
+ElementTree.register_namespace("qemu", "http://libvirt.org/schemas/domain/qemu/1.0")
+ElementTree.register_namespace("libosinfo", "http://libosinfo.org/xmlns/libvirt/domain/1.0")
+
+
+class DomainXml:
+    """ Parsed libvirt domain XML with accessors for the elements the controllers read and edit """
+
+    def __init__(self, root: ElementTree.Element):
+        self.root = root
+
+    @classmethod
+    def from_string(cls, xml: str) -> "DomainXml":
+        return cls(ElementTree.fromstring(xml))
+
+    def to_string(self) -> str:
+        return ElementTree.tostring(self.root, encoding="unicode")
+
+    def copy(self) -> "DomainXml":
+        return DomainXml(copy.deepcopy(self.root))
+
+    @property
+    def os(self) -> ElementTree.Element:
+        return self.root.find("os")
+
+    @property
+    def disks(self) -> List[ElementTree.Element]:
+        return self.root.findall("devices/disk")
+
+    @property
+    def network_interfaces(self) -> List[Tuple[str, str]]:
+        """ The (network name, mac address) of every interface connected to a libvirt network """
+        return [
+            (interface.find("source").get("network"), interface.find("mac").get("address"))
+            for interface in self.root.findall("devices/interface[@type='network']")
+        ]
+
+    @property
+    def vcpu(self) -> int:
+        return int(self.root.findtext("vcpu"))
+
+    @property
+    def memory_kib(self) -> int:
+        return int(self.root.findtext("memory"))
+
+    @property
+    def current_memory_kib(self) -> int:
+        return int(self.root.findtext("currentMemory"))
+
+    def set_memory_kib(self, ram_kib: int):
+        for tag in ("memory", "currentMemory"):
+            element = self.root.find(tag)
+            # The unit attribute is optional and defaults to KiB, don't leave a different unit next to the value
+            element.attrib.pop("unit", None)
+            element.text = str(ram_kib)
+
+    @staticmethod
+    def get_child_attribute(element: ElementTree.Element, tag: str, attribute: str) -> Optional[str]:
+        child = element.find(tag)
+        return child.get(attribute) if child is not None else None
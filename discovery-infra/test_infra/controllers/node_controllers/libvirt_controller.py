@@ -4,11 +4,12 @@ import re
 import secrets
 import string
 import tempfile
+import threading
 from abc import ABC
 from contextlib import contextmanager, suppress
 from pathlib import Path
-from typing import List, Callable
-from xml.dom import minidom
+from typing import Callable, Dict, Iterator, List, Tuple
+from xml.etree import ElementTree
 
 import libvirt
 import waiting
@@ -17,8 +18,11 @@ from test_infra.helper_classes.config import BaseClusterConfig
 from test_infra.helper_classes.config.controller_config import BaseNodeConfig
 from test_infra import consts, utils
 from test_infra.controllers.node_controllers.disk import Disk, DiskSourceType
+from test_infra.controllers.node_controllers.domain_xml import DomainXml
 from test_infra.controllers.node_controllers.node import Node
 from test_infra.controllers.node_controllers.node_controller import NodeController
+from test_infra.tools.disk_templates import disk_templates
+from test_infra.utils.lease_watcher import LeaseWatcher
 
 
 class LibvirtController(NodeController, ABC):
@@ -29,6 +33,11 @@ class LibvirtController(NodeController, ABC):
         self.libvirt_connection: libvirt.virConnect = libvirt.open('qemu:///system')
         self.private_ssh_key_path: Path = config.private_ssh_key_path
         self._setup_timestamp: str = utils.run_command("date +\"%Y-%m-%d %T\"")[0]
+        self._domains: Dict[str, libvirt.virDomain] = {}
+        self._domain_xmls: Dict[str, DomainXml] = {}
+        self._domains_lock = threading.Lock()
+        # Keyed by (thread id, node name), only nested edits of the same thread are batched together
+        self._pending_edits: Dict[Tuple[int, str], DomainXml] = {}
 
     def __del__(self):
         with suppress(Exception):
@@ -52,37 +61,98 @@ class LibvirtController(NodeController, ABC):
 
     def list_nodes_with_name_filter(self, name_filter) -> List[Node]:
         logging.info("Listing current hosts with name filter %s", name_filter)
-        vir_domains = list()
         nodes = list()
 
-        domains = self.libvirt_connection.listAllDomains()
-        for domain in domains:
-            domain_name = domain.name()
+        # A single listAllDomains refreshes the handles of all the domains, later calls don't look them up again
+        domains = {domain.name(): domain for domain in self.libvirt_connection.listAllDomains()}
+        with self._domains_lock:
+            self._domains = domains
+
+        for domain_name in domains:
             if name_filter and name_filter not in domain_name:
                 continue
             if (consts.NodeRoles.MASTER in domain_name) or (consts.NodeRoles.WORKER in domain_name):
                 nodes.append(
                     Node(domain_name, self, self.private_ssh_key_path)
                 )
-                vir_domains.append(domain)
 
-        logging.info("Found domains %s", vir_domains)
+        logging.info("Found domains %s", [node.name for node in nodes])
         return nodes
 
     def list_networks(self):
         return self.libvirt_connection.listAllNetworks()
 
-    @classmethod
-    def _list_disks(cls, node):
-        all_disks = minidom.parseString(node.XMLDesc()).getElementsByTagName('disk')
-        return [cls._disk_xml_to_disk_obj(disk_xml) for disk_xml in all_disks]
+    def _get_domain(self, node_name) -> libvirt.virDomain:
+        with self._domains_lock:
+            domain = self._domains.get(node_name)
+        if domain is None:
+            domain = self.libvirt_connection.lookupByName(node_name)
+            with self._domains_lock:
+                self._domains[node_name] = domain
+        return domain
+
+    def invalidate_domain_cache(self):
+        """ Drop the cached handles and XMLs of all the domains, after domains were created or deleted """
+        with self._domains_lock:
+            self._domains.clear()
+        self.invalidate_domain_xml()
+
+    def get_domain_xml(self, node_name, cached=True) -> DomainXml:
+        """
+        The parsed XML of the domain, cached until the domain is changed through this controller.
+        :param cached: Pass False to read live-only fields, e.g. the ballooned memory or the device aliases,
+                       which change without going through this controller
+        """
+        domain_xml = None
+        if cached:
+            with self._domains_lock:
+                domain_xml = self._domain_xmls.get(node_name)
+        if domain_xml is None:
+            domain_xml = DomainXml.from_string(self._get_domain(node_name).XMLDesc(0))
+            with self._domains_lock:
+                self._domain_xmls[node_name] = domain_xml
+        return domain_xml
+
+    def invalidate_domain_xml(self, node_name=None):
+        """ Drop the cached XML of the domain, or of all the domains, after they were changed """
+        with self._domains_lock:
+            if node_name is None:
+                self._domain_xmls.clear()
+            else:
+                self._domain_xmls.pop(node_name, None)
+
+    @contextmanager
+    def edit_domain_xml(self, node_name) -> Iterator[DomainXml]:
+        """
+        Edit a copy of the domain XML, defined once when the block exits without errors.
+        Edits of the same domain nested in the block are batched into it.
+        """
+        edit_key = (threading.get_ident(), node_name)
+        if edit_key in self._pending_edits:
+            yield self._pending_edits[edit_key]
+            return
+
+        domain_xml = self.get_domain_xml(node_name).copy()
+        self._pending_edits[edit_key] = domain_xml
+        try:
+            yield domain_xml
+            dom = self.libvirt_connection.defineXML(domain_xml.to_string())
+            if dom is None:
+                raise Exception(f"Failed to define domain XML for node: {node_name}")
+        finally:
+            del self._pending_edits[edit_key]
+            self.invalidate_domain_xml(node_name)
+
+    def _list_disks(self, node_name):
+        disks = self.get_domain_xml(node_name, cached=False).disks
+        return [self._disk_xml_to_disk_obj(disk_xml) for disk_xml in disks]
 
     @classmethod
     def _disk_xml_to_disk_obj(cls, disk_xml):
         return Disk(
             # device_type indicates how the disk is to be exposed to the guest OS.
             # Possible values for this attribute are "floppy", "disk", "cdrom", and "lun", defaulting to "disk".
-            type=disk_xml.getAttribute('device'),
+            type=disk_xml.get('device', ''),
             alias=cls._get_disk_alias(disk_xml),
             wwn=cls._get_disk_wwn(disk_xml),
             **cls._get_disk_source_attributes(disk_xml),
@@ -91,32 +161,31 @@ class LibvirtController(NodeController, ABC):
 
     @staticmethod
     def _get_disk_source_attributes(disk_xml):
-        source_xml = disk_xml.getElementsByTagName('source')
+        source_element = disk_xml.find('source')
 
         source_type = DiskSourceType.OTHER
         source_path = None
         source_pool = None
         source_volume = None
 
-        if source_xml:
-            disk_type = disk_xml.getAttribute('type')
-            source_element = source_xml[0]
+        if source_element is not None:
+            disk_type = disk_xml.get('type')
 
             if disk_type == 'file':
                 source_type = DiskSourceType.FILE
-                source_path = source_element.getAttribute('file')
+                source_path = source_element.get('file', '')
             elif disk_type == 'block':
                 source_type = DiskSourceType.BLOCK
-                source_path = source_element.getAttribute('dev')
+                source_path = source_element.get('dev', '')
             elif disk_type == 'dir':
                 source_type = DiskSourceType.DIR
-                source_path = source_element.getAttribute('dir')
+                source_path = source_element.get('dir', '')
             elif disk_type == 'network':
                 source_type = DiskSourceType.NETWORK
             elif disk_type == 'volume':
                 source_type = DiskSourceType.VOLUME
-                source_pool = source_element.getAttribute('pool')
-                source_volume = source_element.getAttribute('volume')
+                source_pool = source_element.get('pool', '')
+                source_volume = source_element.get('volume', '')
             elif disk_type == 'nvme':
                 source_type = DiskSourceType.NVME
 
@@ -129,37 +198,34 @@ class LibvirtController(NodeController, ABC):
 
     @staticmethod
     def _get_disk_target_data(disk_xml):
-        target_xml = disk_xml.getElementsByTagName('target')
+        target_element = disk_xml.find('target')
         return dict(
-            bus=target_xml[0].getAttribute('bus') if target_xml else None,
-            target=target_xml[0].getAttribute('dev') if target_xml else None
+            bus=target_element.get('bus', '') if target_element is not None else None,
+            target=target_element.get('dev', '') if target_element is not None else None
         )
 
     @staticmethod
     def _get_disk_wwn(disk_xml):
-        wwn_xml = disk_xml.getElementsByTagName('wwn')
-        wwn = wwn_xml[0].firstChild.data if wwn_xml else None
-        return wwn
+        return disk_xml.findtext('wwn')
 
     @staticmethod
     def _get_disk_alias(disk_xml):
-        alias_xml = disk_xml.getElementsByTagName('alias')
-        alias = alias_xml[0].getAttribute('name') if alias_xml else None
-        return alias
+        return DomainXml.get_child_attribute(disk_xml, 'alias', 'name')
 
     def list_disks(self, node_name: str):
-        node = self.libvirt_connection.lookupByName(node_name)
-        return self._list_disks(node)
+        return self._list_disks(node_name)
 
     def list_leases(self, network_name):
         return utils.get_network_leases(network_name)
 
     def shutdown_node(self, node_name):
         logging.info("Going to shutdown %s", node_name)
-        node = self.libvirt_connection.lookupByName(node_name)
+        node = self._get_domain(node_name)
 
         if node.isActive():
             node.destroy()
+            # The live XML (e.g. device aliases) differs from the inactive one
+            self.invalidate_domain_xml(node_name)
 
     def shutdown_all_nodes(self):
         logging.info("Going to shutdown all the nodes")
@@ -170,9 +236,10 @@ class LibvirtController(NodeController, ABC):
 
     def start_node(self, node_name, check_ips=True):
         logging.info("Going to power-on %s, check ips flag %s", node_name, check_ips)
-        node = self.libvirt_connection.lookupByName(node_name)
+        node = self._get_domain(node_name)
 
         if not node.isActive():
+            self.invalidate_domain_xml(node_name)
             try:
                 node.create()
                 if check_ips:
@@ -194,41 +261,25 @@ class LibvirtController(NodeController, ABC):
         return nodes
 
     @staticmethod
-    def create_disk(disk_path, disk_size):
-        command = f'qemu-img create -f qcow2 {disk_path} {disk_size}'
-        utils.run_command(command, shell=True)
+    def create_disk(disk_path, disk_size, bootable=False):
+        """ Create the disk as an overlay of a prebuilt template, bootable disks have an MBR partition table """
+        disk_templates.create_disk(disk_path, disk_size, bootable=bootable)
 
     @staticmethod
-    # LIBGUESTFS_BACKEND set to mitigate errors with running libvirt as root
-    # https://libguestfs.org/guestfs-faq.1.html#permission-denied-when-running-libguestfs-as-root
-    def add_disk_bootflag(disk_path):
-        command = f'virt-format -a {disk_path} --partition=mbr'
-        utils.run_command(command, shell=True, env={**os.environ, "LIBGUESTFS_BACKEND": "direct"})
-
-    @classmethod
-    def format_disk(cls, disk_path):
+    def format_disk(disk_path):
         logging.info("Formatting disk %s", disk_path)
         if not os.path.exists(disk_path):
             logging.info("Path to %s disk not exists. Skipping", disk_path)
             return
 
-        command = f"qemu-img info {disk_path} | grep 'virtual size'"
-        output = utils.run_command(command, shell=True)
-        image_size = output[0].split(' ')[2]
-        # Fix for libvirt 6.0.0
-        if image_size.isdigit():
-            image_size += "G"
+        disk_templates.reset_disk(disk_path)
 
-        cls.create_disk(disk_path, image_size)
+    def _get_all_scsi_disks(self, node_name):
+        return (disk for disk in self._list_disks(node_name) if disk.bus == 'scsi')
 
-    @classmethod
-    def _get_all_scsi_disks(cls, node):
-        return (disk for disk in cls._list_disks(node) if disk.bus == 'scsi')
-
-    @classmethod
-    def _get_attached_test_disks(cls, node):
-        return (disk for disk in cls._get_all_scsi_disks(node) if
-                disk.alias and disk.alias.startswith(cls.TEST_DISKS_PREFIX))
+    def _get_attached_test_disks(self, node_name):
+        return (disk for disk in self._get_all_scsi_disks(node_name) if
+                disk.alias and disk.alias.startswith(self.TEST_DISKS_PREFIX))
 
     @staticmethod
     def _get_disk_scsi_identifier(disk):
@@ -237,11 +288,11 @@ class LibvirtController(NodeController, ABC):
         """
         return re.findall(r"^sd(.*)$", disk.target)[0]
 
-    def _get_available_scsi_identifier(self, node):
+    def _get_available_scsi_identifier(self, node_name):
         """
         :return: Returns, for example, `d` if `sda`, `sdb`, `sdc`, `sde` are all already in use
         """
-        identifiers_in_use = [self._get_disk_scsi_identifier(disk) for disk in self._get_all_scsi_disks(node)]
+        identifiers_in_use = [self._get_disk_scsi_identifier(disk) for disk in self._get_all_scsi_disks(node_name)]
 
         try:
             result = next(candidate for candidate in string.ascii_lowercase if candidate not in identifiers_in_use)
@@ -255,22 +306,19 @@ class LibvirtController(NodeController, ABC):
         Attaches a disk with the given size to the given node. All tests disks can later
         be detached with detach_all_test_disks
         """
-        node = self.libvirt_connection.lookupByName(node_name)
+        node = self._get_domain(node_name)
 
         # Prefixing the disk's target element's dev attribute with `sd` makes libvirt create an SCSI disk.
         # We don't use `vd` virtio disks because libvirt overwrites our aliases if we do so, coming up with
         # its own `virtio-<num>` aliases instead. Those aliases allow us to identify disks created by this
         # function when we perform `detach_all_test_disks` for cleanup.
-        target_dev = f"sd{self._get_available_scsi_identifier(node)}"
+        target_dev = f"sd{self._get_available_scsi_identifier(node_name)}"
         disk_alias = f"{self.TEST_DISKS_PREFIX}-{target_dev}"
 
         with tempfile.NamedTemporaryFile() as f:
             tmp_disk = f.name
 
-        self.create_disk(tmp_disk, disk_size)
-
-        if bootable:
-            self.add_disk_bootflag(tmp_disk)
+        self.create_disk(tmp_disk, disk_size, bootable=bootable)
 
         attach_flags = libvirt.VIR_DOMAIN_AFFECT_LIVE
 
@@ -288,21 +336,51 @@ class LibvirtController(NodeController, ABC):
                 {wwn}
             </disk>
         """, attach_flags)
+        self.invalidate_domain_xml(node_name)
 
         return tmp_disk
 
     def detach_all_test_disks(self, node_name):
-        node = self.libvirt_connection.lookupByName(node_name)
+        node = self._get_domain(node_name)
 
-        for test_disk in self._get_attached_test_disks(node):
+        for test_disk in list(self._get_attached_test_disks(node_name)):
             assert test_disk.alias is not None, "A test disk has no alias. This should never happen"
             node.detachDeviceAlias(test_disk.alias)
+            self.invalidate_domain_xml(node_name)
 
             assert test_disk.source_path is not None, "A test disk has no source file. This should never happen"
             assert test_disk.source_path.startswith(
                 tempfile.gettempdir()), "File unexpectedly not in tmp, avoiding deletion to be on the safe side"
             os.remove(test_disk.source_path)
 
+    def create_snapshot(self, node_name: str, snapshot_name: str, description: str = "") -> None:
+        """
+        Snapshot the node, replacing its snapshot with the same name if any.
+        Snapshots of shut off nodes are internal snapshots of their disks and definition.
+        """
+        node = self._get_domain(node_name)
+        self.delete_snapshot(node_name, snapshot_name)
+
+        snapshot_xml = ElementTree.Element("domainsnapshot")
+        ElementTree.SubElement(snapshot_xml, "name").text = snapshot_name
+        ElementTree.SubElement(snapshot_xml, "description").text = description
+        node.snapshotCreateXML(ElementTree.tostring(snapshot_xml, encoding="unicode"), 0)
+
+    def revert_to_snapshot(self, node_name: str, snapshot_name: str) -> None:
+        node = self._get_domain(node_name)
+        # Forced, since the node is usually running and the snapshot was taken while it was shut off
+        node.revertToSnapshot(node.snapshotLookupByName(snapshot_name), libvirt.VIR_DOMAIN_SNAPSHOT_REVERT_FORCE)
+        self.invalidate_domain_xml(node_name)
+
+    def delete_snapshot(self, node_name: str, snapshot_name: str) -> bool:
+        """ :return: Whether the snapshot existed """
+        node = self._get_domain(node_name)
+        if snapshot_name not in node.snapshotListNames():
+            return False
+
+        node.snapshotLookupByName(snapshot_name).delete(0)
+        return True
+
     def attach_interface(self, node_name, network_xml, target_interface=consts.TEST_TARGET_INTERFACE):
         """
         Create network and Interface. New interface will be attached to a given node.
@@ -351,6 +429,7 @@ class LibvirtController(NodeController, ABC):
             mac_addresses.append(lease['mac'])
         command = f"virsh attach-interface {node_name} network {network_name} --target {target_interface} --persistent"
         utils.run_command(command)
+        self.invalidate_domain_xml(node_name)
         try:
             waiting.wait(
                 lambda: len(self.list_leases(network_name)) > len(mac_addresses),
@@ -376,6 +455,7 @@ class LibvirtController(NodeController, ABC):
         logging.info(f"Undefining an interface mac: {mac}, for node: {node_name}")
         command = f"virsh detach-interface {node_name} --type network --mac {mac}"
         utils.run_command(command, True)
+        self.invalidate_domain_xml(node_name)
         logging.info("Successfully removed interface.")
 
     def restart_node(self, node_name):
@@ -400,11 +480,11 @@ class LibvirtController(NodeController, ABC):
         self.format_all_node_disks()
 
     def is_active(self, node_name):
-        node = self.libvirt_connection.lookupByName(node_name)
+        node = self._get_domain(node_name)
         return node.isActive()
 
     def get_node_ips_and_macs(self, node_name):
-        node = self.libvirt_connection.lookupByName(node_name)
+        node = self._get_domain(node_name)
         return self._get_domain_ips_and_macs(node)
 
     @staticmethod
@@ -430,6 +510,18 @@ class LibvirtController(NodeController, ABC):
 
     def _wait_till_domain_has_ips(self, domain, timeout=360, interval=5):
         logging.info("Waiting till host %s will have ips", domain.name())
+        interfaces = self.get_domain_xml(domain.name()).network_interfaces
+        if interfaces:
+            # Leases are pushed by the watcher, wait for an address of any of the domain's interfaces
+            macs = {mac.lower() for _, mac in interfaces}
+            LeaseWatcher.get().wait_for_networks(
+                [network for network, _ in interfaces],
+                lambda leases: any(lease["mac"].lower() in macs for lease in leases),
+                timeout=timeout,
+                waiting_for="Waiting for Ips",
+            )
+            return
+
         waiting.wait(
             lambda: len(self._get_domain_ips(domain)) > 0,
             timeout_seconds=timeout,
@@ -439,38 +531,29 @@ class LibvirtController(NodeController, ABC):
         )
 
     @staticmethod
-    def _clean_domain_os_boot_data(node_xml):
-        os_element = node_xml.getElementsByTagName('os')[0]
+    def _clean_domain_os_boot_data(domain_xml: DomainXml):
+        os_element = domain_xml.os
 
-        for el in os_element.getElementsByTagName('boot'):
-            dev = el.getAttribute('dev')
+        for el in os_element.findall('boot'):
+            dev = el.get('dev', '')
             if dev in ['cdrom', 'hd']:
-                os_element.removeChild(el)
+                os_element.remove(el)
             else:
                 raise ValueError(f'Found unexpected boot device: \'{dev}\'')
 
-        for disk in node_xml.getElementsByTagName('disk'):
-            for boot in disk.getElementsByTagName('boot'):
-                disk.removeChild(boot)
+        for disk in domain_xml.disks:
+            for boot in disk.findall('boot'):
+                disk.remove(boot)
 
     def set_per_device_boot_order(self, node_name, key: Callable[[Disk], int]):
         logging.info(f"Changing boot order for node: {node_name}")
-        node = self.libvirt_connection.lookupByName(node_name)
-        current_xml = node.XMLDesc(0)
-        xml = minidom.parseString(current_xml.encode('utf-8'))
-        self._clean_domain_os_boot_data(xml)
-        disks_xmls = xml.getElementsByTagName('disk')
-        disks_xmls.sort(key=lambda disk: key(self._disk_xml_to_disk_obj(disk)))
-
-        for index, disk_xml in enumerate(disks_xmls):
-            boot_element = xml.createElement('boot')
-            boot_element.setAttribute("order", str(index + 1))
-            disk_xml.appendChild(boot_element)
-
-        # Apply new machine xml
-        dom = self.libvirt_connection.defineXML(xml.toprettyxml())
-        if dom is None:
-            raise Exception(f"Failed to set boot order for node: {node_name}")
+        with self.edit_domain_xml(node_name) as domain_xml:
+            self._clean_domain_os_boot_data(domain_xml)
+            disks_xmls = sorted(domain_xml.disks, key=lambda disk: key(self._disk_xml_to_disk_obj(disk)))
+
+            for index, disk_xml in enumerate(disks_xmls):
+                ElementTree.SubElement(disk_xml, 'boot', order=str(index + 1))
+
         logging.info(f"Boot order set successfully: for node: {node_name}")
         # After setting per-device boot order, we have to shutdown the guest(reboot isn't enough)
         logging.info(f"Restarting node {node_name} to allow boot changes to take effect")
@@ -480,63 +563,38 @@ class LibvirtController(NodeController, ABC):
     def set_boot_order(self, node_name, cd_first=False):
         logging.info(f"Going to set the following boot order: cd_first: {cd_first}, "
                      f"for node: {node_name}")
-        node = self.libvirt_connection.lookupByName(node_name)
-        current_xml = node.XMLDesc(0)
-        xml = minidom.parseString(current_xml.encode('utf-8'))
-        self._clean_domain_os_boot_data(xml)
-        os_element = xml.getElementsByTagName('os')[0]
-        # Set boot elements for hd and cdrom
-        first = xml.createElement('boot')
-        first.setAttribute('dev', 'cdrom' if cd_first else 'hd')
-        os_element.appendChild(first)
-        second = xml.createElement('boot')
-        second.setAttribute('dev', 'hd' if cd_first else 'cdrom')
-        os_element.appendChild(second)
-        # Apply new machine xml
-        dom = self.libvirt_connection.defineXML(xml.toprettyxml())
-        if dom is None:
-            raise Exception(f"Failed to set boot order cdrom first: {cd_first}, "
-                            f"for node: {node_name}")
+        with self.edit_domain_xml(node_name) as domain_xml:
+            self._clean_domain_os_boot_data(domain_xml)
+            # Set boot elements for hd and cdrom
+            ElementTree.SubElement(domain_xml.os, 'boot', dev='cdrom' if cd_first else 'hd')
+            ElementTree.SubElement(domain_xml.os, 'boot', dev='hd' if cd_first else 'cdrom')
+
         logging.info(f"Boot order set successfully: cdrom first: {cd_first}, "
                      f"for node: {node_name}")
 
     def get_host_id(self, node_name):
-        dom = self.libvirt_connection.lookupByName(node_name)
+        dom = self._get_domain(node_name)
         return dom.UUIDString()
 
     def get_cpu_cores(self, node_name):
-        xml = self._get_xml(node_name)
-        vcpu_element = xml.getElementsByTagName('vcpu')[0]
-        return int(vcpu_element.firstChild.nodeValue)
+        return self.get_domain_xml(node_name).vcpu
 
     def set_cpu_cores(self, node_name, core_count):
         logging.info(f"Going to set vcpus to {core_count} for node: {node_name}")
-        dom = self.libvirt_connection.lookupByName(node_name)
+        dom = self._get_domain(node_name)
         dom.setVcpusFlags(core_count)
+        self.invalidate_domain_xml(node_name)
         logging.info(f"Successfully set vcpus to {core_count} for node: {node_name}")
 
     def get_ram_kib(self, node_name):
-        xml = self._get_xml(node_name)
-        memory_element = xml.getElementsByTagName('currentMemory')[0]
-        return int(memory_element.firstChild.nodeValue)
+        return self.get_domain_xml(node_name, cached=False).current_memory_kib
 
     def set_ram_kib(self, node_name, ram_kib):
         logging.info(f"Going to set memory to {ram_kib} for node: {node_name}")
-        xml = self._get_xml(node_name)
-        memory_element = xml.getElementsByTagName('memory')[0]
-        memory_element.firstChild.replaceWholeText(ram_kib)
-        current_memory_element = xml.getElementsByTagName('currentMemory')[0]
-        current_memory_element.firstChild.replaceWholeText(ram_kib)
-        dom = self.libvirt_connection.defineXML(xml.toprettyxml())
-        if dom is None:
-            raise Exception(f"Failed to set memory for node: {node_name}")
+        with self.edit_domain_xml(node_name) as domain_xml:
+            domain_xml.set_memory_kib(ram_kib)
         logging.info(f"Successfully set memory to {ram_kib} for node: {node_name}")
 
-    def _get_xml(self, node_name):
-        dom = self.libvirt_connection.lookupByName(node_name)
-        current_xml = dom.XMLDesc(0)
-        return minidom.parseString(current_xml.encode('utf-8'))
-
     def format_node_disk(self, node_name: str, disk_index: int = 0) -> None:
         raise NotImplementedError
 
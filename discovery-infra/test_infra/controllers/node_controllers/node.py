@@ -1,6 +1,6 @@
 import logging
 from pathlib import Path
-from typing import Callable, Optional
+from typing import Callable, List, Optional, TypeVar
 
 from scp import SCPException
 
@@ -8,6 +8,8 @@ from test_infra import consts
 from test_infra.controllers.node_controllers import ssh
 from test_infra.controllers.node_controllers.disk import Disk
 
+T = TypeVar("T")
+
 
 class Node:
     def __init__(self, name, node_controller, private_ssh_key_path: Optional[Path] = None, username="core"):
@@ -15,8 +17,9 @@ class Node:
         self.private_ssh_key_path = private_ssh_key_path
         self.username = username
         self.node_controller = node_controller
-        self.original_vcpu_count = self.get_cpu_cores()
-        self.original_ram_kib = self.get_ram_kib()
+        # Captured right before the resources are first changed, see reset_cpu_cores and reset_ram_kib
+        self._original_vcpu_count: Optional[int] = None
+        self._original_ram_kib: Optional[int] = None
         self._ips = []
         self._macs = []
 
@@ -73,24 +76,60 @@ class Node:
         if exception is not None:
             raise exception
 
+    def run_on_ssh_connection(self, func: Callable[[ssh.SshConnection], T]) -> T:
+        """ Call func with the node's pooled SSH connection, connecting through the first reachable IP """
+        if not self.ips:
+            raise RuntimeError(f"No available IPs for node {self.name}")
+
+        exception = None
+        for ip in self.ips:
+            with ssh.SshConnectionPool.get(
+                ip, private_ssh_key_path=self.private_ssh_key_path, username=self.username
+            ) as pooled_connection:
+                try:
+                    pooled_connection.connect()
+                except (TimeoutError, SCPException) as e:
+                    logging.warning("Could not SSH through IP %s: %s", ip, str(e))
+                    exception = e
+                    continue
+
+                return pooled_connection.run(func)
+
+        raise exception
+
     def upload_file(self, local_source_path, remote_target_path):
-        with self.ssh_connection as _ssh:
-            return _ssh.upload_file(local_source_path, remote_target_path)
+        return self.run_on_ssh_connection(lambda _ssh: _ssh.upload_file(local_source_path, remote_target_path))
 
     def download_file(self, remote_source_path, local_target_path):
-        with self.ssh_connection as _ssh:
-            return _ssh.download_file(remote_source_path, local_target_path)
+        return self.run_on_ssh_connection(lambda _ssh: _ssh.download_file(remote_source_path, local_target_path))
 
     def run_command(self, bash_command, background=False):
-        output = ""
         if not self.node_controller.is_active(self.name):
             raise RuntimeError("%s is not active, can't run given command")
-        with self.ssh_connection as _ssh:
-            if background:
-                _ssh.background_script(bash_command)
-            else:
-                output = _ssh.script(bash_command, verbose=False)
-        return output
+        if background:
+            self.run_on_ssh_connection(lambda _ssh: _ssh.background_script(bash_command))
+            return ""
+        return self.run_on_ssh_connection(lambda _ssh: _ssh.script(bash_command, verbose=False))
+
+    def run_command_streaming(
+        self,
+        bash_command,
+        stdout_handler: ssh.OutputHandler,
+        stderr_handler: Optional[ssh.OutputHandler] = None,
+        timeout: Optional[float] = None,
+    ) -> int:
+        """ Run the command passing its output to the handlers as it arrives, returns its exit status """
+        if not self.node_controller.is_active(self.name):
+            raise RuntimeError("%s is not active, can't run given command")
+        return self.run_on_ssh_connection(
+            lambda _ssh: _ssh.execute_streaming(bash_command, stdout_handler, stderr_handler, timeout=timeout)
+        )
+
+    def run_commands(self, bash_commands: List[str]) -> List[str]:
+        """ Run the commands in order in a single SSH session, returns the output of each command """
+        if not self.node_controller.is_active(self.name):
+            raise RuntimeError("%s is not active, can't run given commands")
+        return self.run_on_ssh_connection(lambda _ssh: _ssh.run_commands(bash_commands, verbose=False))
 
     def shutdown(self):
         return self.node_controller.shutdown_node(self.name)
@@ -152,20 +191,41 @@ class Node:
     def get_cpu_cores(self):
         return self.node_controller.get_cpu_cores(self.name)
 
+    @property
+    def original_vcpu_count(self) -> int:
+        if self._original_vcpu_count is None:
+            self._original_vcpu_count = self.get_cpu_cores()
+        return self._original_vcpu_count
+
     def set_cpu_cores(self, core_count):
+        _ = self.original_vcpu_count  # Captures the count before it is first changed
         self.node_controller.set_cpu_cores(self.name, core_count)
 
     def reset_cpu_cores(self):
-        self.set_cpu_cores(self.original_vcpu_count)
+        if self._original_vcpu_count is not None:
+            self.set_cpu_cores(self._original_vcpu_count)
 
     def get_ram_kib(self):
         return self.node_controller.get_ram_kib(self.name)
 
+    @property
+    def original_ram_kib(self) -> int:
+        if self._original_ram_kib is None:
+            self._original_ram_kib = self.get_ram_kib()
+        return self._original_ram_kib
+
     def set_ram_kib(self, ram_kib):
+        _ = self.original_ram_kib  # Captures the memory before it is first changed
         self.node_controller.set_ram_kib(self.name, ram_kib)
 
     def reset_ram_kib(self):
-        self.set_ram_kib(self.original_ram_kib)
+        if self._original_ram_kib is not None:
+            self.set_ram_kib(self._original_ram_kib)
+
+    def inherit_original_resources(self, node: "Node"):
+        """ Keep the original resources captured by a previous handle of the same node """
+        self._original_vcpu_count = node._original_vcpu_count
+        self._original_ram_kib = node._original_ram_kib
 
     def get_disks(self):
         self.node_controller.list_disks(self.name)
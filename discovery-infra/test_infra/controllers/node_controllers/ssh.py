@@ -1,15 +1,23 @@
+import atexit
 import logging
+import select
 import socket
+import threading
 import time
+import uuid
+from contextlib import contextmanager
 from ipaddress import IPv4Address, ip_address
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
 
 import paramiko
 import scp
 
 logging.getLogger('paramiko').setLevel(logging.CRITICAL)
 
+T = TypeVar("T")
+OutputHandler = Callable[[bytes], None]
+
 
 class SshConnection:
 
@@ -19,6 +27,8 @@ class SshConnection:
         self._key_path = private_ssh_key_path
         self._port = port
         self._ssh_client = None
+        # Set once closed, so that a caller still holding a closed pooled connection doesn't silently reopen it
+        self.closed = False
         self._logger = logging.getLogger('ssh')
 
     def __enter__(self):
@@ -29,13 +39,26 @@ class SshConnection:
         self.close()
 
     def close(self):
+        self.closed = True
         if self._ssh_client:
             self._ssh_client.close()
             self._ssh_client = None
 
+    def _ensure_connected(self):
+        if self.closed:
+            raise ConnectionError(f"SSH connection to {self._ip} was closed")
+        if not self._ssh_client:
+            self.connect()
+
+    @property
+    def is_active(self) -> bool:
+        transport = self._ssh_client.get_transport() if self._ssh_client else None
+        return transport is not None and transport.is_active()
+
     def connect(self, timeout=60):
         logging.info("Going to connect to ip %s", self._ip)
         self.wait_for_tcp_server()
+        self.closed = False
         self._ssh_client = paramiko.SSHClient()
         self._ssh_client.known_hosts = None
         self._ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -75,34 +98,116 @@ class SshConnection:
         finally:
             s.close()
 
-    def script(self, bash_script, verbose=True, timeout=60):
+    def script(self, bash_script, verbose=True, timeout=60, idle_timeout: Optional[float] = None):
         try:
             logging.info("Executing %s on %s", bash_script, self._ip)
-            return self.execute(bash_script, timeout, verbose)
+            return self.execute(bash_script, timeout, verbose, idle_timeout=idle_timeout)
         except RuntimeError as e:
             e.args += ('When running bash script "%s"' % bash_script),
             raise
 
-    def execute(self, command, timeout=60, verbose=True):
-        if not self._ssh_client:
-            self.connect()
+    def execute(self, command, timeout=60, verbose=True, idle_timeout: Optional[float] = None):
+        """
+        :param timeout: Unused, the command was never limited by it since waiting for its exit status doesn't time out
+        :param idle_timeout: Time limit without any output from the command, no limit by default
+        """
+        self._ensure_connected()
         if verbose:
             name = getattr(self._ssh_client, 'name', '')
             self._logger.debug("Running bash script: %(cmd)s %(name)s" % dict(cmd=command.strip(),
                                                                               name='on ' + name if name else name))
-        stdin, stdout, stderr = self._ssh_client.exec_command(command, timeout=timeout)
-        status = stdout.channel.recv_exit_status()
-        output = stdout.readlines()
-        output = "".join(output)
+        # Drain both streams while the command runs, waiting for the exit status first could block the
+        # command forever once its output fills the channel window
+        stdout, stderr = [], []
+        status = self.execute_streaming(command, stdout.append, stderr.append, idle_timeout=idle_timeout)
+        output = b"".join(stdout).decode(errors="replace")
         if verbose and output:
             self._logger.debug("SSH Execution output: %(output)s" % dict(output="\n" + output))
         if status != 0:
             e = RuntimeError("Failed executing, status '%s', output was:\n%s stderr \n%s" %
-                             (status, output, stderr.readlines()))
+                             (status, output, b"".join(stderr).decode(errors="replace")))
             e.output = output
             raise e
         return output
 
+    def execute_streaming(
+        self,
+        command,
+        stdout_handler: OutputHandler,
+        stderr_handler: Optional[OutputHandler] = None,
+        timeout: Optional[float] = None,
+        idle_timeout: Optional[float] = None,
+        chunk_size=32 * 1024,
+    ) -> int:
+        """
+        Run the command and pass its stdout and stderr to the handlers as they arrive, instead of buffering them.
+        :param timeout: Overall time limit of the command, no limit by default
+        :param idle_timeout: Time limit without any output from the command, no limit by default
+        :return: The exit status of the command
+        :raises TimeoutError: If the command exceeded one of the time limits
+        """
+        self._ensure_connected()
+
+        deadline = time.time() + timeout if timeout else None
+        idle_deadline = time.time() + idle_timeout if idle_timeout else None
+        channel = self._ssh_client.get_transport().open_session()
+        try:
+            channel.exec_command(command)
+            while True:
+                if channel.recv_ready():
+                    stdout_handler(channel.recv(chunk_size))
+                elif channel.recv_stderr_ready():
+                    data = channel.recv_stderr(chunk_size)
+                    if stderr_handler:
+                        stderr_handler(data)
+                elif channel.exit_status_ready():
+                    return channel.recv_exit_status()
+                else:
+                    now = time.time()
+                    if deadline and now > deadline:
+                        raise TimeoutError("Command '%s' on %s did not finish within %s seconds" %
+                                           (command, self._ip, timeout))
+                    if idle_deadline and now > idle_deadline:
+                        raise TimeoutError("Command '%s' on %s produced no output for %s seconds" %
+                                           (command, self._ip, idle_timeout))
+                    wait = min([1] + [limit - now for limit in (deadline, idle_deadline) if limit])
+                    # The channel's file descriptor becomes readable on stdout, stderr and exit status
+                    select.select([channel], [], [], max(0, wait))
+                    continue
+
+                if idle_timeout:
+                    idle_deadline = time.time() + idle_timeout
+        finally:
+            channel.close()
+
+    def run_commands(
+        self, commands: List[str], timeout=60, verbose=True, idle_timeout: Optional[float] = None
+    ) -> List[str]:
+        """ Run the commands one after the other in a single shell session and return the output of each of them.
+            Stops at the first failing command and raises RuntimeError like execute """
+        marker = f"__RUN_COMMANDS_{uuid.uuid4().hex}__"
+        script = "".join(
+            f"{{\n{command}\n}}\n__rc=$?; printf '\\n{marker} %d\\n' $__rc; [ $__rc -eq 0 ] || exit 0\n"
+            for command in commands
+        )
+        pieces = self.execute(script, timeout, verbose, idle_timeout=idle_timeout).split(f"\n{marker} ")
+
+        outputs = []
+        output = pieces[0]
+        for piece in pieces[1:]:
+            status, _, next_output = piece.partition("\n")
+            if int(status) != 0:
+                e = RuntimeError("Failed executing '%s', status '%s', output was:\n%s" %
+                                 (commands[len(outputs)], status, output))
+                e.output = output
+                raise e
+            outputs.append(output)
+            output = next_output
+
+        if len(outputs) != len(commands):
+            raise RuntimeError("Only %d of %d commands were run, output was:\n%s" % (len(outputs), len(commands), output))
+        return outputs
+
     def upload_file(self, local_source_path, remote_target_path):
         with scp.SCPClient(self._ssh_client.get_transport()) as scp_client:
             scp_client.put(local_source_path, remote_target_path)
@@ -125,3 +230,150 @@ class SshConnection:
                 raise RuntimeError("Failed running '%s', status '%s'" % (bash_script, status))
         finally:
             chan.close()
+
+
+class PooledSshConnection:
+    """ A single SSH connection shared by all the threads working with a node. Commands and file transfers run
+        on their own channels over its transport, and it reconnects once the transport dies, e.g. on reboot """
+
+    def __init__(self, ip, private_ssh_key_path: Optional[Path] = None, username="core", port=22):
+        self._ip = ip
+        self._key_path = private_ssh_key_path
+        self._username = username
+        self._port = port
+        self._connection: Optional[SshConnection] = None
+        # Guards the state below and is never held while connecting, which may take minutes
+        self._lock = threading.Lock()
+        # Serialises the connection attempts to this node only
+        self._connect_lock = threading.Lock()
+        self._users = 0
+        self._last_used = time.time()
+
+    def _get_active_connection(self) -> Optional[SshConnection]:
+        """ Must be called while holding the lock """
+        if self._connection is not None and self._connection.is_active:
+            return self._connection
+        return None
+
+    def connect(self) -> SshConnection:
+        """ Return a live connection, (re)connecting if needed """
+        with self._lock:
+            connection = self._get_active_connection()
+        if connection is not None:
+            return connection
+
+        with self._connect_lock:
+            with self._lock:
+                connection = self._get_active_connection()
+                if connection is not None:
+                    # Connected by another thread meanwhile
+                    return connection
+                stale_connection, self._connection = self._connection, None
+
+            if stale_connection is not None:
+                logging.info("SSH connection to %s is no longer active, reconnecting", self._ip)
+                stale_connection.close()
+
+            connection = SshConnection(self._ip, private_ssh_key_path=self._key_path, username=self._username,
+                                       port=self._port)
+            connection.connect()
+            with self._lock:
+                self._connection = connection
+            return connection
+
+    def pin(self):
+        """ Keep the connection from being closed as idle until unpin is called """
+        with self._lock:
+            self._users += 1
+
+    def unpin(self):
+        with self._lock:
+            self._users -= 1
+            self._last_used = time.time()
+
+    @contextmanager
+    def acquire(self):
+        self.pin()
+        try:
+            yield self.connect()
+        finally:
+            self.unpin()
+
+    def run(self, func: Callable[[SshConnection], T]) -> T:
+        """ Call func with a live connection. func is called once, it isn't repeated if the transport dies meanwhile
+            since commands such as reboot aren't idempotent """
+        with self.acquire() as connection:
+            return func(connection)
+
+    def close_if_idle(self, idle_since: float) -> bool:
+        with self._lock:
+            if self._users or self._last_used > idle_since:
+                return False
+            self._close()
+            return True
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class SshConnectionPool:
+    """ Process wide pool of PooledSshConnection, connections idle for longer than IDLE_TIMEOUT are closed """
+
+    IDLE_TIMEOUT = 5 * 60
+    EVICTION_INTERVAL = 60
+
+    _connections: Dict[Tuple, PooledSshConnection] = dict()
+    _lock = threading.Lock()
+    _last_eviction = time.time()
+
+    @classmethod
+    @contextmanager
+    def get(cls, ip, private_ssh_key_path: Optional[Path] = None, username="core", port=22):
+        """ The pooled connection to the given address, which isn't closed as idle until the block exits """
+        cls._evict_idle()
+        key = (ip, port, username, str(private_ssh_key_path))
+        with cls._lock:
+            pooled = cls._connections.get(key)
+            if pooled is None:
+                pooled = cls._connections[key] = PooledSshConnection(ip, private_ssh_key_path, username, port)
+            pooled.pin()
+
+        try:
+            yield pooled
+        finally:
+            pooled.unpin()
+
+    @classmethod
+    def _evict_idle(cls):
+        now = time.time()
+        with cls._lock:
+            if now - cls._last_eviction < cls.EVICTION_INTERVAL:
+                return
+            cls._last_eviction = now
+            connections = list(cls._connections.items())
+
+        # Outside of the pool lock, closing a connection mustn't block getting the other ones
+        idle_since = now - cls.IDLE_TIMEOUT
+        for key, pooled in connections:
+            if pooled.close_if_idle(idle_since):
+                with cls._lock:
+                    # A closed connection is still usable, it reconnects if pinned meanwhile
+                    if cls._connections.get(key) is pooled:
+                        del cls._connections[key]
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            connections = list(cls._connections.values())
+            cls._connections.clear()
+        for pooled in connections:
+            pooled.close()
+
+
+atexit.register(SshConnectionPool.close_all)
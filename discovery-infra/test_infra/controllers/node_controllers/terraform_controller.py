@@ -1,11 +1,15 @@
+import hashlib
 import ipaddress
 import json
 import logging
 import os
 import shutil
+import threading
 import warnings
+from contextlib import suppress
 from typing import List
 
+import libvirt
 from munch import Munch
 from test_infra import consts, utils, virsh_cleanup
 from test_infra.consts import resources
@@ -13,24 +17,34 @@ from test_infra.controllers.node_controllers.libvirt_controller import LibvirtCo
 from test_infra.controllers.node_controllers.node import Node
 from test_infra.helper_classes.config import BaseTerraformConfig, BaseClusterConfig
 from test_infra.tools import static_network, terraform_utils
+from test_infra.tools.concurrently import ConcurrentExecutionError, run_concurrently
 from test_infra.utils.cluster_name import get_cluster_name_suffix
 
 
 class TerraformController(LibvirtController):
+    PRISTINE_SNAPSHOT = "pristine"
+    PRISTINE_NODES_FILE = "pristine_nodes.json"
 
     def __init__(self, config: BaseTerraformConfig, cluster_config: BaseClusterConfig):
         super().__init__(config, cluster_config)
         self.cluster_name = cluster_config.cluster_name.get()
         self._suffix = cluster_config.cluster_name.suffix or get_cluster_name_suffix()
         self.network_name = config.network_name + self._suffix
-        self.tf_folder = config.tf_folder or self._create_tf_folder(self.cluster_name, config.platform)
+        self.tf_folder = config.tf_folder or self._create_tf_folder(
+            self.cluster_name, config.platform, reuse_nodes=config.reuse_nodes
+        )
         self.params = self._terraform_params(**config.get_all())
         self.tf = terraform_utils.TerraformUtils(working_dir=self.tf_folder)
         self.master_ips = None
+        self._pristine_nodes_lock = threading.Lock()
 
     @classmethod
-    def _create_tf_folder(cls, cluster_name: str, platform: str):
+    def _create_tf_folder(cls, cluster_name: str, platform: str, reuse_nodes: bool = False):
         tf_folder = utils.get_tf_folder(cluster_name)
+        if reuse_nodes and os.path.isfile(os.path.join(tf_folder, cls.PRISTINE_NODES_FILE)):
+            logging.info("Reusing %s as terraform folder", tf_folder)
+            return tf_folder
+
         logging.info("Creating %s as terraform folder", tf_folder)
         utils.recreate_folder(tf_folder)
         utils.copy_template_tree(tf_folder, none_platform_mode=platform == consts.Platforms.NONE)
@@ -85,6 +99,7 @@ class TerraformController(LibvirtController):
         self._fill_tfvars(running)
         logging.info('Start running terraform')
         self.tf.apply()
+        self.invalidate_domain_cache()
         if self.params.running:
             utils.wait_till_nodes_are_ready(
                 nodes_count=self.params.worker_count + self.params.master_count,
@@ -177,6 +192,10 @@ class TerraformController(LibvirtController):
 
     def format_node_disk(self, node_name: str, disk_index: int = 0):
         logging.info("Formating disk for %s", node_name)
+        # Formatting recreates the disk along with its internal snapshots, delete them while they are consistent
+        if self._delete_pristine_snapshots():
+            logging.info("Formatting the disks of the nodes invalidated their pristine snapshots, "
+                         "the nodes will be recreated by the next test")
         self.format_disk(f'{self.params.libvirt_storage_pool_path}/{self.cluster_name}/{node_name}-disk-{disk_index}')
 
     def get_ingress_and_api_vips(self):
@@ -215,6 +234,8 @@ class TerraformController(LibvirtController):
         """
 
         logging.info("Deleting all nodes")
+        # libvirt refuses to undefine domains that have snapshots
+        self._delete_pristine_snapshots()
         if os.path.exists(self.tf_folder):
             self._try_to_delete_nodes()
 
@@ -223,6 +244,7 @@ class TerraformController(LibvirtController):
             self.params.libvirt_network_name,
             self.params.libvirt_secondary_network_name
         )
+        self.invalidate_domain_cache()
         if delete_tf_folder:
             logging.info('Deleting %s', self.tf_folder)
             shutil.rmtree(self.tf_folder)
@@ -230,8 +252,7 @@ class TerraformController(LibvirtController):
     @classmethod
     def _delete_virsh_resources(cls, *filters):
         logging.info('Deleting virsh resources (filters: %s)', filters)
-        skip_list = virsh_cleanup.DEFAULT_SKIP_LIST
-        skip_list.extend(["minikube", "minikube-net"])
+        skip_list = [*virsh_cleanup.DEFAULT_SKIP_LIST, "minikube", "minikube-net"]
         virsh_cleanup.clean_virsh_resources(
             skip_list=skip_list,
             resource_filter=filters
@@ -239,20 +260,104 @@ class TerraformController(LibvirtController):
 
     def prepare_nodes(self):
         logging.info("Preparing nodes")
+        pristine_nodes_path = os.path.join(self.tf_folder, self.PRISTINE_NODES_FILE)
+        kept_tf_folder = self._config.reuse_nodes and not self._config.tf_folder and os.path.isfile(pristine_nodes_path)
+        if self._config.reuse_nodes and self._revert_to_pristine_nodes():
+            return
+
         self.destroy_all_nodes()
+        if kept_tf_folder:
+            # It holds the variables set by the previous test and maybe the templates of another platform
+            self._create_tf_folder(self.cluster_name, self._config.platform)
+            self.tf = terraform_utils.TerraformUtils(working_dir=self.tf_folder)
         if not os.path.exists(self._cluster_config.iso_download_path):
             utils.recreate_folder(os.path.dirname(self._cluster_config.iso_download_path), force_recreate=False)
             # if file not exist lets create dummy
             utils.touch(self._cluster_config.iso_download_path)
         self.params.running = False
         self._create_nodes()
+        if self._config.reuse_nodes:
+            self._snapshot_pristine_nodes()
+
+    def _get_topology(self) -> str:
+        """ Fingerprint of everything the created nodes and networks depend on """
+        topology = {key: value for key, value in self.params.items() if key != "running"}
+        topology.update(
+            platform=self._config.platform,
+            is_ipv6=self._config.is_ipv6,
+            bootstrap_in_place=self._config.bootstrap_in_place,
+            image_path=self._cluster_config.iso_download_path,
+        )
+        return hashlib.sha256(json.dumps(topology, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _snapshot_pristine_nodes(self):
+        """ Snapshot the nodes before their first boot, so the next tests with the same topology can reuse them """
+        node_names = sorted(node.name() for node in self.list_nodes())
+        logging.info("Taking pristine snapshots of nodes %s", node_names)
+        try:
+            run_concurrently([(self.create_snapshot, name, self.PRISTINE_SNAPSHOT, "Before first boot")
+                              for name in node_names])
+        except (libvirt.libvirtError, ConcurrentExecutionError):
+            logging.warning("Failed to snapshot the nodes, they won't be reused", exc_info=True)
+            self._delete_pristine_snapshots(node_names)
+            return
+
+        with open(os.path.join(self.tf_folder, consts.TFVARS_JSON_NAME)) as _file:
+            tfvars = json.load(_file)
+        with open(os.path.join(self.tf_folder, self.PRISTINE_NODES_FILE), "w") as _file:
+            json.dump({"topology": self._get_topology(), "nodes": node_names, "tfvars": tfvars}, _file)
+
+    def _revert_to_pristine_nodes(self) -> bool:
+        """ :return: Whether the nodes were reverted, otherwise they have to be recreated """
+        pristine_nodes_path = os.path.join(self.tf_folder, self.PRISTINE_NODES_FILE)
+        if not os.path.isfile(pristine_nodes_path):
+            return False
+
+        with open(pristine_nodes_path) as _file:
+            pristine_nodes = json.load(_file)
+        node_names = sorted(node.name() for node in self.list_nodes())
+        if pristine_nodes["topology"] != self._get_topology() or pristine_nodes["nodes"] != node_names:
+            logging.info("Nodes topology changed, recreating them")
+            return False
+
+        logging.info("Reverting nodes %s to their pristine snapshots", node_names)
+        try:
+            run_concurrently([(self.revert_to_snapshot, name, self.PRISTINE_SNAPSHOT) for name in node_names])
+        except (libvirt.libvirtError, ConcurrentExecutionError):
+            logging.warning("Failed to revert the nodes to their pristine snapshots, recreating them", exc_info=True)
+            return False
+        finally:
+            self.invalidate_domain_cache()
+
+        self.params.running = False
+        self.master_ips = pristine_nodes["tfvars"]["libvirt_master_ips"]
+        # Undo the changes of the previous test, e.g. its DNS entries and load balancer configuration
+        self.tf.change_variables(pristine_nodes["tfvars"])
+        return True
+
+    def _delete_pristine_snapshots(self, node_names: List[str] = None) -> bool:
+        """ :return: Whether there were pristine snapshots """
+        pristine_nodes_path = os.path.join(self.tf_folder, self.PRISTINE_NODES_FILE)
+        with self._pristine_nodes_lock:
+            if node_names is None:
+                if not os.path.isfile(pristine_nodes_path):
+                    return False
+                node_names = [node.name() for node in self.list_nodes()]
+
+            for node_name in node_names:
+                with suppress(libvirt.libvirtError):
+                    self.delete_snapshot(node_name, self.PRISTINE_SNAPSHOT)
+            with suppress(FileNotFoundError):
+                os.remove(pristine_nodes_path)
+            return True
 
     def get_cluster_network(self):
         logging.info(f'Cluster network name: {self.network_name}')
         return self.network_name
 
     def set_single_node_ip(self, ip):
-        self.tf.change_variables({"single_node_ip": ip})
+        # Only the network's DNS entries change, which nothing but terraform modifies since it created them
+        self.tf.change_variables({"single_node_ip": ip}, refresh=False)
 
     @property
     def network_conf(self):
@@ -1,6 +1,5 @@
 import contextlib
 import ipaddress
-import json
 import os
 import random
 import re
@@ -21,9 +20,10 @@ from test_infra.assisted_service_api import InventoryClient
 from test_infra.controllers.load_balancer_controller import LoadBalancerController
 from test_infra.helper_classes.config import BaseClusterConfig
 from test_infra.helper_classes.nodes import Nodes
-from test_infra.tools import static_network, terraform_utils
+from test_infra.tools import static_network
 from test_infra.utils import operators_utils, logs_utils, log
 from test_infra.utils.cluster_name import ClusterName
+from test_infra.utils.inventory_cache import get_host_inventory
 
 
 class Cluster:
@@ -95,6 +95,7 @@ class Cluster:
 
     def delete(self):
         self.api_client.delete_cluster(self.id)
+        utils.ClusterStateWatcher.release(self.api_client, self.id)
 
     def get_details(self):
         return self.api_client.cluster_get(self.id)
@@ -662,7 +663,7 @@ class Cluster:
             address=/.apps.{cluster_name}.{base_domain}/{ingress_vip}
             """)
         self.nodes.controller.tf.change_variables(
-            {"dns_forwarding_file": contents, "dns_forwarding_file_name": fname}
+            {"dns_forwarding_file": contents, "dns_forwarding_file_name": fname}, refresh=False
         )
 
     def _set_hostnames_and_roles(self):
@@ -688,7 +689,7 @@ class Cluster:
 
         for host in hosts:
             host_id = host["id"]
-            inventory = json.loads(host["inventory"])
+            inventory = get_host_inventory(host)
 
             if has_host_name(host, inventory):
                 continue
@@ -748,8 +749,12 @@ class Cluster:
         self.wait_for_ready_to_install()
 
         if self._config.platform == consts.Platforms.NONE:
-            self._configure_load_balancer()
-            self._set_none_platform_dns()
+            tf = self.nodes.controller.tf
+            # Only the network's DNS entries and local files change, which nothing but terraform modifies
+            with tf.batch_variables(refresh=False):
+                load_balancer_ip = self._configure_load_balancer()
+                self._set_none_platform_dns()
+            LoadBalancerController(tf).wait_for_load_balancer(load_balancer_ip)
         elif self._config.masters_count != 1:
             vips_info = self.__class__.get_vips_from_cluster(self.api_client, self.id)
             self._set_dns(api_vip=vips_info["api_vip"], ingress_vip=vips_info["ingress_vip"])
@@ -918,7 +923,8 @@ class Cluster:
     def get_events(self, host_id=""):
         return self.api_client.get_events(cluster_id=self.id, host_id=host_id)
 
-    def _configure_load_balancer(self):
+    def _configure_load_balancer(self) -> str:
+        """ Set the load balancer configuration without waiting for it to be up, returns the load balancer IP """
         main_cidr = self.nodes.controller.get_machine_cidr()
         secondary_cidr = self.nodes.controller.get_provisioning_cidr()
 
@@ -929,9 +935,9 @@ class Cluster:
 
         load_balancer_ip = str(IPNetwork(main_cidr).ip + 1)
 
-        tf = terraform_utils.TerraformUtils(working_dir=self.nodes.controller.tf_folder)
-        lb_controller = LoadBalancerController(tf)
-        lb_controller.set_load_balancing_config(load_balancer_ip, master_ips, worker_ips)
+        lb_controller = LoadBalancerController(self.nodes.controller.tf)
+        lb_controller.set_load_balancing_config(load_balancer_ip, master_ips, worker_ips, wait=False)
+        return load_balancer_ip
 
     @classmethod
     def _get_namespace_index(cls, libvirt_network_if):
@@ -977,7 +983,7 @@ class Cluster:
             )
             return addresses[0].split("/")[0] if len(addresses) > 0 else None
 
-        inventory = models.Inventory(**json.loads(host["inventory"]))
+        inventory = models.Inventory(**get_host_inventory(host))
         interfaces_list = [models.Interface(**interface) for interface in inventory.interfaces]
         return [
             {
@@ -1036,7 +1042,7 @@ class Cluster:
     def get_host_disks(self, host, filter=None):
         hosts = self.get_hosts()
         selected_host = [h for h in hosts if h["id"] == host["id"]]
-        disks = json.loads(selected_host[0]["inventory"])["disks"]
+        disks = get_host_inventory(selected_host[0])["disks"]
         if not filter:
             return [disk for disk in disks]
         else:
@@ -232,6 +232,10 @@ class InfraEnv(BaseCustomResource):
             expected_exceptions=KeyError,
         )
 
+    def get_iso_created_time(self) -> Optional[str]:
+        """ The time the current image was generated, it changes whenever the image is regenerated """
+        return self.get()["status"].get("createdTime")
+
     def get_cluster_id(self):
         iso_download_url = self.get_iso_download_url()
         return ISO_URL_PATTERN.match(iso_download_url).group("cluster_id")
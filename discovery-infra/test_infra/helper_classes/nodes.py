@@ -1,4 +1,3 @@
-import json
 import logging
 import random
 from typing import Dict, Iterator, List
@@ -7,7 +6,9 @@ from munch import Munch
 
 from test_infra.controllers.node_controllers.node import Node
 from test_infra.controllers.node_controllers.node_controller import NodeController
+from test_infra.tools import ssh_fanout
 from test_infra.tools.concurrently import run_concurrently
+from test_infra.utils.inventory_cache import get_host_inventory
 
 
 class NodeMapping:
@@ -24,11 +25,19 @@ class Nodes:
         self.controller = node_controller
         self._nodes = None
         self._nodes_as_dict = None
+        # Handles dropped from the cache, whose original resources the new handles should keep
+        self._previous_nodes = None
 
     @property
     def nodes(self) -> List[Node]:
         if not self._nodes:
             self._nodes = self.controller.list_nodes()
+            if self._previous_nodes:
+                previous_nodes = {node.name: node for node in self._previous_nodes}
+                for node in self._nodes:
+                    if node.name in previous_nodes:
+                        node.inherit_original_resources(previous_nodes[node.name])
+                self._previous_nodes = None
         return self._nodes
 
     def __getitem__(self, i):
@@ -42,6 +51,7 @@ class Nodes:
             yield n
 
     def drop_cache(self):
+        self._previous_nodes = self._nodes or self._previous_nodes
         self._nodes = None
         self._nodes_as_dict = None
 
@@ -128,8 +138,15 @@ class Nodes:
                                          host in cluster_hosts], func_name, *args)
 
     @staticmethod
-    def run_ssh_command_on_given_nodes(nodes, command) -> Dict:
-        return run_concurrently({node.name: (node.run_command, command) for node in nodes})
+    def run_ssh_command_on_given_nodes(nodes, command, timeout=ssh_fanout.DEFAULT_NODE_TIMEOUT) -> Dict:
+        results = ssh_fanout.run_ssh_command_on_nodes(nodes, command, timeout=timeout)
+        for result in results.values():
+            if result.error:
+                raise result.error
+            if not result.succeeded:
+                raise RuntimeError("Failed running '%s' on %s, status '%s', output was:\n%s stderr \n%s" %
+                                   (command, result.node_name, result.exit_code, result.stdout, result.stderr))
+        return {name: result.stdout for name, result in results.items()}
 
     def set_wrong_boot_order(self, nodes=None, start_nodes=True):
         nodes = nodes or self.nodes
@@ -164,8 +181,7 @@ class Nodes:
 
     @staticmethod
     def get_cluster_hostname(cluster_host_object):
-        inventory = json.loads(cluster_host_object["inventory"])
-        return inventory["hostname"]
+        return get_host_inventory(cluster_host_object)["hostname"]
 
     def set_single_node_ip(self, ip):
         self.controller.set_single_node_ip(ip)
@@ -1,33 +1,117 @@
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from typing import Callable, Dict, List, Tuple, Union, Any
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
+MAX_WORKERS = 32
 
-def _safe_run(job, job_id: int, done_handler: Callable[[int], None]):
-    call = None
-    try:
-        call, call_args = job[0], job[1:]
-        return call(*call_args)
-    except BaseException:
-        logging.debug("When concurrently running '%(call)s'", dict(call=str(call)))
-        raise
-    finally:
-        if done_handler:
-            done_handler(job_id)
+
+class ConcurrentExecutionError(RuntimeError):
+    """ Raised when more than one job failed. errors holds the exception of each failed job by its id """
+
+    def __init__(self, errors: Dict[Any, BaseException]):
+        self.errors = errors
+        super().__init__(
+            "%d jobs failed: %s" % (len(errors), ", ".join(f"{job_id}: {e!r}" for job_id, e in errors.items()))
+        )
+
+
+class ConcurrentExecutor:
+    """ Runs jobs, each a tuple of a callable and its arguments, on a thread pool sized to the number of jobs.
+
+        Results are collected as jobs complete. With fail_fast, the first failure cancels the jobs that
+        didn't start yet. The wall time of every job that ran is kept in durations. """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        timeout: float = 2 ** 31,
+        fail_fast: bool = True,
+        done_handler: Callable[[Any], None] = None,
+    ):
+        self.max_workers = max_workers or MAX_WORKERS
+        self.timeout = timeout
+        self.fail_fast = fail_fast
+        self.done_handler = done_handler
+        self.durations: Dict[Any, float] = {}
+
+    def run(self, jobs: Union[List, Dict, Tuple]) -> Dict[Any, Any]:
+        """
+        :return: The result of each job by its id, which is its index when jobs is a list
+        :raises: The exception of the failed job, or ConcurrentExecutionError if several jobs failed
+        """
+        if isinstance(jobs, (list, tuple)):
+            jobs = dict(enumerate(jobs))
+        if not jobs:
+            return {}
+
+        results, errors = {}, {}
+        started_at = time.time()
+        # Not used as a context manager, which waits for the running jobs even after a failure or a timeout
+        executor = ThreadPoolExecutor(max_workers=min(len(jobs), self.max_workers))
+        futures = {executor.submit(self._run_job, job, job_id): job_id for job_id, job in jobs.items()}
+        try:
+            for future in as_completed(futures, timeout=self.timeout):
+                job_id = futures[future]
+                if future.exception():
+                    errors[job_id] = future.exception()
+                    if self.fail_fast:
+                        break
+                else:
+                    results[job_id] = future.result()
+        except TimeoutError:
+            errors["timeout"] = TimeoutError(
+                f"{len(jobs) - len(results) - len(errors)} jobs didn't complete within {self.timeout} seconds"
+            )
+        finally:
+            cancelled = sum(future.cancel() for future in futures)
+            if cancelled:
+                logging.info("Cancelled %d jobs that didn't start", cancelled)
+            # Jobs that are still running are left to finish in the background
+            executor.shutdown(wait=False)
+
+        self._log_durations(time.time() - started_at)
+        if len(errors) == 1:
+            raise next(iter(errors.values()))
+        if errors:
+            raise ConcurrentExecutionError(errors) from next(iter(errors.values()))
+        return results
+
+    def _run_job(self, job, job_id):
+        call = None
+        started_at = time.time()
+        try:
+            call, call_args = job[0], job[1:]
+            return call(*call_args)
+        except BaseException:
+            logging.debug("When concurrently running '%(call)s'", dict(call=str(call)))
+            raise
+        finally:
+            self.durations[job_id] = time.time() - started_at
+            if self.done_handler:
+                self.done_handler(job_id)
+
+    def _log_durations(self, total_duration: float):
+        if not self.durations:
+            return
+        slowest_job_id = max(self.durations, key=self.durations.get)
+        logging.debug(
+            "Ran %d jobs in %.1fs, total jobs time %.1fs, slowest job %s took %.1fs",
+            len(self.durations),
+            total_duration,
+            sum(self.durations.values()),
+            slowest_job_id,
+            self.durations[slowest_job_id],
+        )
 
 
 def run_concurrently(
     jobs: Union[List, Dict, Tuple],
     done_handler: Callable[[int], None] = None,
-    max_workers: int = 5,
+    max_workers: Optional[int] = None,
     timeout: float = 2 ** 31,
+    fail_fast: bool = True,
 ) -> Dict[int, Any]:
-    result = {}
-    if isinstance(jobs, (list, tuple)):
-        jobs = dict(enumerate(jobs))
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [(job_id, executor.submit(_safe_run, *(job, job_id, done_handler))) for job_id, job in jobs.items()]
-        for job_id, future in futures:
-            result[job_id] = future.result(timeout=timeout)
-
-    return result
+    return ConcurrentExecutor(
+        max_workers=max_workers, timeout=timeout, fail_fast=fail_fast, done_handler=done_handler
+    ).run(jobs)
@@ -0,0 +1,106 @@
+import os
+import re
+import shlex
+import struct
+from pathlib import Path
+from typing import Union
+
+from logger import log
+
+from test_infra import consts, utils
+from test_infra.utils.lock_manager import lock_manager
+
+DiskSize = Union[int, str]
+
+QCOW2_MAGIC = b"QFI\xfb"
+# Big endian virtual size in bytes, at offset 24 of the qcow2 header
+QCOW2_SIZE_FORMAT = ">Q"
+QCOW2_SIZE_OFFSET = 24
+
+_SIZE_SUFFIXES = {"": 1, "b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+
+def parse_disk_size(size: DiskSize) -> int:
+    """ Size in bytes of a qemu-img style size, e.g. 10737418240, "20G" or "512M" """
+    if isinstance(size, int):
+        return size
+
+    match = re.fullmatch(r"\s*(\d+)\s*([bkmgt]?)(?:i?b)?\s*", size.lower())
+    if match is None:
+        raise ValueError(f"Invalid disk size {size}")
+    return int(match.group(1)) * _SIZE_SUFFIXES[match.group(2)]
+
+
+def get_virtual_size(disk_path: str) -> int:
+    """ Virtual size of a qcow2 disk read from its header, or the file size of a raw disk """
+    with open(disk_path, "rb") as f:
+        header = f.read(QCOW2_SIZE_OFFSET + struct.calcsize(QCOW2_SIZE_FORMAT))
+
+    if header.startswith(QCOW2_MAGIC):
+        return struct.unpack_from(QCOW2_SIZE_FORMAT, header, QCOW2_SIZE_OFFSET)[0]
+    return os.path.getsize(disk_path)
+
+
+class DiskTemplates:
+    """ Read-only qcow2 base images shared by all the disks created on the host, one per size and kind.
+
+        Disks are created as copy-on-write overlays backed by a template, which takes a few milliseconds,
+        and reset by recreating their overlay, which drops everything that was written to them. Bootflagged
+        templates are formatted with virt-format once, instead of booting a libguestfs appliance per disk. """
+
+    BLANK = "blank"
+    BOOTFLAGGED = "mbr"
+    TEMPLATE_SUFFIX = ".qcow2"
+    PARTIAL_SUFFIX = ".partial"
+
+    def __init__(self, templates_dir: str = consts.DISK_TEMPLATES_FOLDER):
+        self.templates_dir = Path(templates_dir)
+
+    def get_template(self, size: DiskSize, bootable: bool = False) -> Path:
+        """ Path of the template of the given size, built on first use """
+        kind = self.BOOTFLAGGED if bootable else self.BLANK
+        template_path = self.templates_dir.joinpath(f"{kind}-{parse_disk_size(size)}{self.TEMPLATE_SUFFIX}")
+        if template_path.is_file():
+            return template_path
+
+        self.templates_dir.mkdir(parents=True, exist_ok=True)
+        # Qemu runs as an unprivileged user and must be able to read the backing files
+        self.templates_dir.chmod(0o755)
+        with lock_manager.lock(f"disk-template-{template_path.stem}", timeout=consts.DISK_TEMPLATE_LOCK_TIMEOUT):
+            if not template_path.is_file():
+                self._build_template(template_path, size, bootable)
+        return template_path
+
+    def _build_template(self, template_path: Path, size: DiskSize, bootable: bool):
+        log.info("Building disk template %s", template_path)
+        partial_path = str(template_path) + self.PARTIAL_SUFFIX
+        try:
+            utils.run_command(f"qemu-img create -f qcow2 {shlex.quote(partial_path)} {parse_disk_size(size)}")
+            if bootable:
+                # LIBGUESTFS_BACKEND set to mitigate errors with running libvirt as root
+                # https://libguestfs.org/guestfs-faq.1.html#permission-denied-when-running-libguestfs-as-root
+                utils.run_command(
+                    f"virt-format -a {shlex.quote(partial_path)} --partition=mbr",
+                    env={**os.environ, "LIBGUESTFS_BACKEND": "direct"},
+                )
+            # Overlays must never write to their template
+            os.chmod(partial_path, 0o444)
+            os.replace(partial_path, template_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+
+    def create_disk(self, disk_path: str, size: DiskSize, bootable: bool = False):
+        """ Create, or reset if it exists, disk_path as an empty overlay of the template of the given size """
+        template_path = self.get_template(size, bootable)
+        utils.run_command(
+            f"qemu-img create -f qcow2 -F qcow2 -b {shlex.quote(str(template_path))} {shlex.quote(disk_path)}"
+        )
+
+    def reset_disk(self, disk_path: str):
+        """ Drop everything written to the disk, keeping its size """
+        self.create_disk(disk_path, get_virtual_size(disk_path))
+
+
+disk_templates = DiskTemplates(templates_dir=os.environ.get("DISK_TEMPLATES_DIR") or consts.DISK_TEMPLATES_FOLDER)
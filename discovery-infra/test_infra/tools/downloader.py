@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import suppress
+from typing import Dict, Optional
+
+import requests
+from logger import log
+from requests.adapters import HTTPAdapter
+from retry import retry
+
+CONTENT_RANGE_REGEX = re.compile(r"^bytes\s+\d+-\d+/(?P<size>\d+)$")
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+class Downloader:
+    """ Downloads a file as concurrent HTTP Range segments written in place into a preallocated file.
+
+        Completed segments are recorded in a sidecar state file next to the target, so an interrupted
+        download resumes from where it stopped. Servers that don't support ranges fall back to a single
+        streamed request. """
+
+    STATE_FILE_SUFFIX = ".download-state"
+    DEFAULT_WORKERS = 8
+    DEFAULT_SEGMENT_SIZE = 32 * 1024 ** 2
+    CHUNK_SIZE = 1024 ** 2
+    TIMEOUT = 60
+
+    def __init__(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        workers: int = DEFAULT_WORKERS,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        verify_ssl: bool = False,
+    ):
+        self.url = url
+        self.headers = headers or {}
+        self.workers = max(1, workers)
+        self.segment_size = segment_size
+        self.verify_ssl = verify_ssl
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._state_lock = threading.Lock()
+
+    def __del__(self):
+        with suppress(Exception):
+            self.close()
+
+    def close(self):
+        self._session.close()
+
+    def download(self, file_path: str, sha256: Optional[str] = None) -> str:
+        log.info("Downloading %s to %s", self._loggable_url, file_path)
+        if os.path.isfile(file_path) and os.stat(file_path).st_nlink > 1:
+            # Never write through a hardlink, the other names (e.g. cached images) must stay intact
+            os.remove(file_path)
+
+        size, validator = self._probe()
+        if size is None:
+            log.info("Server doesn't support range requests, downloading %s in a single stream", file_path)
+            size = self._download_stream(file_path)
+        else:
+            self._download_segments(file_path, size, validator)
+
+        self._verify(file_path, size, sha256)
+        log.info("Successfully downloaded %s (%d bytes)", file_path, size)
+        return file_path
+
+    @property
+    def _loggable_url(self) -> str:
+        # Presigned URLs carry credentials in their query string
+        return self.url.split("?", 1)[0]
+
+    def _get(self, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        response = self._session.get(
+            self.url,
+            headers={**self.headers, **(headers or {})},
+            stream=True,
+            verify=self.verify_ssl,
+            timeout=self.TIMEOUT,
+        )
+        response.raise_for_status()
+        return response
+
+    def _probe(self):
+        """ :return: (size, validator) when byte ranges are supported, (None, None) otherwise """
+        with self._get(headers={"Range": "bytes=0-0"}) as response:
+            match = CONTENT_RANGE_REGEX.match(response.headers.get("Content-Range", ""))
+            if response.status_code != requests.codes.partial_content or not match:
+                return None, None
+            validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+            return int(match.group("size")), validator
+
+    def _download_stream(self, file_path: str) -> int:
+        """ :return: The size announced by the server, or the downloaded size when the server didn't announce it """
+        with self._get() as response, open(file_path, "wb") as f:
+            # The content is decoded while streamed, the length of encoded content doesn't match the file size
+            encoded = bool(response.headers.get("Content-Encoding"))
+            content_length = None if encoded else response.headers.get("Content-Length")
+            for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                f.write(chunk)
+            return int(content_length) if content_length else f.tell()
+
+    def _download_segments(self, file_path: str, size: int, validator: Optional[str]):
+        segments = [(offset, min(offset + self.segment_size, size) - 1) for offset in range(0, size, self.segment_size)]
+        state = self._load_state(file_path, size, validator)
+        pending = [segment for segment in segments if segment[0] not in state["done"]]
+        log.info(
+            "Downloading %d/%d segments of %s with %d workers", len(pending), len(segments), file_path, self.workers
+        )
+
+        fd = os.open(file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+
+            errors = []
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(self._download_segment, fd, start, end) for start, end in pending]
+                # Record every finished segment, even after a failure, so that the next attempt can resume
+                for future in as_completed(futures):
+                    if future.exception():
+                        errors.append(future.exception())
+                        continue
+                    with self._state_lock:
+                        state["done"].append(future.result())
+                        self._save_state(file_path, state)
+
+            if errors:
+                raise DownloadError(f"Failed to download {len(errors)} segments of {file_path}") from errors[0]
+
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        self._remove_state(file_path)
+
+    @retry(exceptions=(requests.RequestException, DownloadError), tries=5, delay=2, backoff=2)
+    def _download_segment(self, fd: int, start: int, end: int) -> int:
+        offset = start
+        with self._get(headers={"Range": f"bytes={start}-{end}"}) as response:
+            if response.status_code != requests.codes.partial_content:
+                raise DownloadError(f"Expected partial content for bytes {start}-{end}, got {response.status_code}")
+            for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+
+        if offset != end + 1:
+            raise DownloadError(f"Segment {start}-{end} is incomplete, got {offset - start} bytes")
+        return start
+
+    @classmethod
+    def _state_path(cls, file_path: str) -> str:
+        return file_path + cls.STATE_FILE_SUFFIX
+
+    def _load_state(self, file_path: str, size: int, validator: Optional[str]) -> dict:
+        fresh_state = dict(size=size, validator=validator, segment_size=self.segment_size, done=[])
+        if not os.path.isfile(file_path):
+            return fresh_state
+
+        try:
+            with open(self._state_path(file_path)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return fresh_state
+
+        if any(state.get(key) != fresh_state[key] for key in ("size", "validator", "segment_size")):
+            log.info("Remote file changed since %s was partially downloaded, starting over", file_path)
+            return fresh_state
+
+        log.info("Resuming download of %s, %d segments already downloaded", file_path, len(state["done"]))
+        return state
+
+    def _save_state(self, file_path: str, state: dict):
+        tmp_path = self._state_path(file_path) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._state_path(file_path))
+
+    def _remove_state(self, file_path: str):
+        try:
+            os.remove(self._state_path(file_path))
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def _verify(cls, file_path: str, size: int, sha256: Optional[str]):
+        actual_size = os.path.getsize(file_path)
+        if actual_size != size:
+            raise DownloadError(
+                f"Could not complete download {file_path}. Actual size: {actual_size}. Expected size: {size}"
+            )
+
+        if sha256:
+            digest = cls.sha256sum(file_path)
+            if digest != sha256.lower():
+                os.remove(file_path)
+                raise DownloadError(f"Checksum mismatch for {file_path}. Actual: {digest}. Expected: {sha256}")
+
+    @classmethod
+    def sha256sum(cls, file_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(cls.CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+def download_file(
+    url: str, file_path: str, headers: Optional[Dict[str, str]] = None, sha256: Optional[str] = None, **kwargs
+) -> str:
+    return Downloader(url, headers=headers, **kwargs).download(file_path, sha256=sha256)
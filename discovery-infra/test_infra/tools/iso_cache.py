@@ -0,0 +1,136 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Callable, Optional
+
+import filelock
+from logger import log
+
+from test_infra import consts
+
+
+class IsoCache:
+    """ Content addressed on-disk cache of discovery images shared by all test runs on the host.
+
+        Entries are keyed by a hash of everything that determines the image content, materialised
+        into the requested path as hardlinks (or reflinks / copies across filesystems) and evicted
+        least recently used first once the cache grows beyond max_bytes. Each key is guarded by its
+        own file lock, so parallel workers asking for the same image download it only once.
+        Disabled unless max_bytes is set, e.g. through the ISO_CACHE_MAX_BYTES environment variable. """
+
+    ENTRY_SUFFIX = ".iso"
+    PARTIAL_SUFFIX = ".partial"
+    LOCK_SUFFIX = ".lock"
+    EVICTION_LOCK = ".eviction.lock"
+    LOCK_TIMEOUT = consts.ISO_CACHE_LOCK_TIMEOUT
+
+    def __init__(self, cache_dir: str = consts.ISO_CACHE_FOLDER, max_bytes: int = consts.ISO_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key_for(**params) -> str:
+        serialized = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir.joinpath(key + self.ENTRY_SUFFIX)
+
+    def _lock(self, key: str, timeout: float = LOCK_TIMEOUT) -> filelock.FileLock:
+        logging.getLogger("filelock").setLevel(logging.ERROR)
+        return filelock.FileLock(str(self.cache_dir.joinpath(key + self.LOCK_SUFFIX)), timeout)
+
+    def materialize(self, key: str, image_path: str, download: Callable[[str], None]) -> str:
+        """
+        Place the image identified by key at image_path, calling download(path) only on a cache miss.
+        :param download: Downloads the image into the given path. Must raise on failure.
+        """
+        if not self.enabled:
+            download(image_path)
+            return image_path
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entry_path = self._entry_path(key)
+
+        with self._lock(key):
+            if entry_path.is_file():
+                log.info("Found image %s in cache at %s", key, entry_path)
+                os.utime(entry_path)
+            else:
+                log.info("Image %s is not cached, downloading it", key)
+                partial_path = str(entry_path) + self.PARTIAL_SUFFIX
+                download(partial_path)
+                os.replace(partial_path, entry_path)
+
+            self._link(entry_path, image_path)
+
+        self.evict(keep=key)
+        return image_path
+
+    @staticmethod
+    def _link(source: Path, destination: str):
+        if os.path.lexists(destination):
+            os.remove(destination)
+
+        try:
+            os.link(source, destination)
+            return
+        except OSError as e:
+            log.debug("Failed to hardlink %s to %s: %s", source, destination, e)
+
+        try:
+            subprocess.run(
+                ["cp", "--reflink=always", str(source), destination],
+                check=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except (OSError, subprocess.CalledProcessError):
+            log.debug("Failed to reflink %s to %s, copying it", source, destination)
+            shutil.copyfile(source, destination)
+
+    def evict(self, keep: Optional[str] = None):
+        """ Remove least recently used entries until the cache fits in max_bytes. Entries in use are skipped """
+        if not self.cache_dir.is_dir():
+            return
+
+        with filelock.FileLock(str(self.cache_dir.joinpath(self.EVICTION_LOCK)), self.LOCK_TIMEOUT):
+            entries = []
+            for path in self.cache_dir.glob("*" + self.ENTRY_SUFFIX):
+                try:
+                    entries.append((path, path.stat()))
+                except FileNotFoundError:
+                    continue
+
+            total_size = sum(stat.st_size for _, stat in entries)
+            for path, stat in sorted(entries, key=lambda entry: entry[1].st_mtime):
+                if total_size <= self.max_bytes:
+                    break
+                key = path.name[: -len(self.ENTRY_SUFFIX)]
+                if key == keep:
+                    continue
+
+                try:
+                    with self._lock(key, timeout=0):
+                        path.unlink()
+                except filelock.Timeout:
+                    continue
+                except FileNotFoundError:
+                    pass
+
+                log.info("Evicted image %s from cache (%d bytes)", key, stat.st_size)
+                total_size -= stat.st_size
+
+
+iso_cache = IsoCache(
+    cache_dir=os.environ.get("ISO_CACHE_DIR") or consts.ISO_CACHE_FOLDER,
+    max_bytes=int(os.environ.get("ISO_CACHE_MAX_BYTES") or consts.ISO_CACHE_MAX_BYTES),
+)
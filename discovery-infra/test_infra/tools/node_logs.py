@@ -0,0 +1,106 @@
+import os
+import shlex
+from contextlib import ExitStack
+from typing import Callable, Dict, Iterable, Optional
+
+from logger import log
+
+from test_infra.consts import MINUTE
+from test_infra.tools import ssh_fanout
+
+JOURNAL_TIMEOUT = 10 * MINUTE
+SOSREPORT_TIMEOUT = 20 * MINUTE
+PARTIAL_SUFFIX = ".partial"
+
+# Compress on the guest with zstd when it's available, gzip otherwise. The local file suffix is picked
+# from the magic bytes of the stream, so a single command works on every node.
+COMPRESS_COMMAND = "if command -v zstd > /dev/null; then zstd -q -c; else gzip -c; fi"
+COMPRESSION_SUFFIXES = {b"\x28\xb5\x2f\xfd": ".zst", b"\x1f\x8b": ".gz"}
+
+
+def collect_journals(
+    nodes: Iterable, output_dir: str, since: Optional[str] = None, timeout: float = JOURNAL_TIMEOUT
+) -> Dict[str, ssh_fanout.NodeCommandResult]:
+    """
+    Stream the compressed journal of all the nodes into <output_dir>/<node name>.journal.zst (or .gz).
+    Nothing is written on the guests.
+    :param since: Only collect entries since this time, e.g. nodes.setup_time
+    """
+    nodes = list(nodes)
+    journalctl = "sudo journalctl --no-pager"
+    if since:
+        journalctl += f" --since {shlex.quote(since)}"
+    command = f"set -o pipefail; {journalctl} | {{ {COMPRESS_COMMAND}; }}"
+
+    log.info("Collecting journal of %d nodes into %s", len(nodes), output_dir)
+    return stream_to_files(
+        nodes, command, lambda node_name: os.path.join(output_dir, f"{node_name}.journal"), timeout, _compressed_path
+    )
+
+
+def collect_sosreports(
+    nodes: Iterable, script_path: str, output_dir: str, timeout: float = SOSREPORT_TIMEOUT
+) -> Dict[str, ssh_fanout.NodeCommandResult]:
+    """ Run the sosreport script on all the nodes, streaming the archives into <output_dir>/sosreport-<node>.tar.gz """
+    nodes = list(nodes)
+    with open(script_path) as f:
+        script = f.read()
+    # The script is passed inline and told to write its archive to stdout, so no file is copied to or from the guests
+    command = f"sudo bash -c {shlex.quote(script)} sosreport -"
+
+    log.info("Collecting sosreport of %d nodes into %s", len(nodes), output_dir)
+    return stream_to_files(
+        nodes, command, lambda node_name: os.path.join(output_dir, f"sosreport-{node_name}.tar.gz"), timeout
+    )
+
+
+def stream_to_files(
+    nodes: Iterable,
+    command: str,
+    get_path: Callable[[str], str],
+    timeout: float,
+    finalize_path: Optional[Callable[[str, bytes], str]] = None,
+) -> Dict[str, ssh_fanout.NodeCommandResult]:
+    """
+    Run the command on all the nodes concurrently, writing the stdout of each node into its own file.
+    Output of failed nodes is removed, so only complete files are left behind.
+    :param get_path: Returns the output path of a node by its name
+    :param finalize_path: Returns the final path of a successful node's output, given its path and first bytes
+    """
+    nodes = list(nodes)
+    paths = {node.name: get_path(node.name) for node in nodes}
+    for path in paths.values():
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    with ExitStack() as stack:
+        files = {name: stack.enter_context(open(path + PARTIAL_SUFFIX, "wb")) for name, path in paths.items()}
+        results = ssh_fanout.run_ssh_command_on_nodes(
+            nodes,
+            command,
+            timeout=timeout,
+            on_stdout=lambda node_name, data: files[node_name].write(data),
+            on_stderr=lambda node_name, data: log.debug("%s: %s", node_name, data.decode(errors="replace").rstrip()),
+        )
+
+    for name, result in results.items():
+        partial_path = paths[name] + PARTIAL_SUFFIX
+        if not result.succeeded:
+            log.warning("Could not collect %s from %s", os.path.basename(paths[name]), name)
+            os.remove(partial_path)
+            continue
+
+        path = paths[name]
+        if finalize_path:
+            with open(partial_path, "rb") as f:
+                path = finalize_path(path, f.read(4))
+        os.replace(partial_path, path)
+        log.info("Collected %s from %s (%d bytes)", path, name, os.path.getsize(path))
+
+    return results
+
+
+def _compressed_path(path: str, magic: bytes) -> str:
+    for prefix, suffix in COMPRESSION_SUFFIXES.items():
+        if magic.startswith(prefix):
+            return path + suffix
+    return path
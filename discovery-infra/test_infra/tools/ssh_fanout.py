@@ -0,0 +1,115 @@
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Optional
+
+from test_infra.consts import MINUTE
+
+DEFAULT_NODE_TIMEOUT = 30 * MINUTE
+
+NodeOutputHandler = Callable[[str, bytes], None]
+
+
+@dataclass
+class NodeCommandResult:
+    node_name: str
+    exit_code: Optional[int] = None
+    duration: float = 0
+    # Only set when the output isn't streamed to files or handlers
+    stdout: Optional[str] = None
+    stderr: Optional[str] = None
+    error: Optional[BaseException] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None and self.exit_code == 0
+
+
+def run_ssh_command_on_nodes(
+    nodes: Iterable,
+    command: str,
+    timeout: Optional[float] = DEFAULT_NODE_TIMEOUT,
+    max_workers: Optional[int] = None,
+    output_dir: Optional[str] = None,
+    on_stdout: Optional[NodeOutputHandler] = None,
+    on_stderr: Optional[NodeOutputHandler] = None,
+) -> Dict[str, NodeCommandResult]:
+    """
+    Run a command on all the nodes concurrently, streaming each node's output as it arrives.
+    Failures don't stop the other nodes, they are reported in the node's result.
+    :param timeout: Per node timeout in seconds
+    :param max_workers: Number of nodes handled concurrently, all of them by default
+    :param output_dir: Write each node's output to <output_dir>/<node name>.stdout and .stderr
+    :param on_stdout: Called with the node name and every stdout chunk
+    :param on_stderr: Called with the node name and every stderr chunk
+    :return: Result by node name
+    """
+    nodes = list(nodes)
+    if not nodes:
+        return {}
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(nodes)) as executor:
+        futures = [
+            executor.submit(_run_on_node, node, command, timeout, output_dir, on_stdout, on_stderr) for node in nodes
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.node_name] = result
+            if result.succeeded:
+                logging.info("Command finished on %s in %.1fs", result.node_name, result.duration)
+            else:
+                logging.warning(
+                    "Command failed on %s after %.1fs, exit code: %s, error: %s",
+                    result.node_name,
+                    result.duration,
+                    result.exit_code,
+                    result.error,
+                )
+    return results
+
+
+def _run_on_node(node, command, timeout, output_dir, on_stdout, on_stderr) -> NodeCommandResult:
+    result = NodeCommandResult(node_name=node.name)
+    capture = not (output_dir or on_stdout or on_stderr)
+    started_at = time.time()
+
+    with ExitStack() as stack:
+        stdout_handlers, stderr_handlers = [], []
+        if output_dir:
+            stdout_file = stack.enter_context(open(os.path.join(output_dir, f"{node.name}.stdout"), "wb"))
+            stderr_file = stack.enter_context(open(os.path.join(output_dir, f"{node.name}.stderr"), "wb"))
+            stdout_handlers.append(stdout_file.write)
+            stderr_handlers.append(stderr_file.write)
+        if on_stdout:
+            stdout_handlers.append(lambda data: on_stdout(node.name, data))
+        if on_stderr:
+            stderr_handlers.append(lambda data: on_stderr(node.name, data))
+        if capture:
+            stdout_buffer, stderr_buffer = io.BytesIO(), io.BytesIO()
+            stdout_handlers.append(stdout_buffer.write)
+            stderr_handlers.append(stderr_buffer.write)
+
+        try:
+            result.exit_code = node.run_command_streaming(
+                command,
+                lambda data: [handler(data) for handler in stdout_handlers],
+                lambda data: [handler(data) for handler in stderr_handlers],
+                timeout=timeout,
+            )
+        except Exception as e:
+            result.error = e
+        finally:
+            result.duration = time.time() - started_at
+
+    if capture:
+        result.stdout = stdout_buffer.getvalue().decode(errors="replace")
+        result.stderr = stderr_buffer.getvalue().decode(errors="replace")
+    return result
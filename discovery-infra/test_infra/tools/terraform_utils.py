@@ -1,27 +1,73 @@
+import hashlib
 import json
 import logging
 import os
 import pathlib
 from builtins import list
-from typing import Dict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
 
 import hcl2
 from python_terraform import IsFlagged, Terraform, Tfstate
 
+from test_infra import consts, utils
+from test_infra.utils.lock_manager import lock_manager
+
 
 class TerraformUtils:
     VAR_FILE = "terraform.tfvars.json"
     STATE_FILE = "terraform.tfstate"
+    LOCK_FILE = ".terraform.lock.hcl"
+    INIT_FINGERPRINT_FILE = os.path.join(".terraform", "init.sha256")
+    PROVIDERS_DIRS = (os.path.join(".terraform", "providers"), os.path.join(".terraform", "plugins"))
+    PLUGIN_CACHE_LOCK = "terraform-plugin-cache"
 
     def __init__(self, working_dir: str):
         logging.info("TF FOLDER %s ", working_dir)
         self.working_dir = working_dir
         self.var_file_path = os.path.join(working_dir, self.VAR_FILE)
         self.tf = Terraform(working_dir=working_dir, state=self.STATE_FILE, var_file=self.VAR_FILE)
+        self._batched_variables: Optional[Dict[str, Any]] = None
         self.init_tf()
 
     def init_tf(self) -> None:
-        self.tf.cmd("init", raise_on_error=True)
+        """ Run terraform init, unless the folder was already initialized with the same configuration and lock file """
+        fingerprint_path = os.path.join(self.working_dir, self.INIT_FINGERPRINT_FILE)
+        if (
+            os.path.isfile(fingerprint_path)
+            and pathlib.Path(fingerprint_path).read_text() == self._init_fingerprint()
+            and self._are_providers_installed()
+        ):
+            logging.info("Terraform folder %s is already initialized, skipping init", self.working_dir)
+            return
+
+        # Providers are downloaded once to a cache shared by all the terraform folders and linked from there
+        plugin_cache_dir = os.environ.setdefault("TF_PLUGIN_CACHE_DIR", consts.TF_PLUGIN_CACHE_FOLDER)
+        os.makedirs(plugin_cache_dir, exist_ok=True)
+        # Terraform doesn't support concurrent inits sharing a plugin cache
+        with lock_manager.lock(self.PLUGIN_CACHE_LOCK):
+            self.tf.cmd("init", raise_on_error=True)
+
+        # Fingerprinted after init, which creates the lock file on the first run
+        pathlib.Path(fingerprint_path).write_text(self._init_fingerprint())
+
+    def _are_providers_installed(self) -> bool:
+        """ Whether the providers are in place, they are links into the plugin cache which may have been cleaned """
+        for providers_dir in self.PROVIDERS_DIRS:
+            providers_path = pathlib.Path(self.working_dir, providers_dir)
+            if providers_path.is_dir():
+                providers = list(providers_path.rglob("*"))
+                return bool(providers) and all(provider.exists() for provider in providers)
+        return False
+
+    def _init_fingerprint(self) -> str:
+        digest = hashlib.sha256()
+        paths = sorted(pathlib.Path(self.working_dir).glob("*.tf")) + [pathlib.Path(self.working_dir, self.LOCK_FILE)]
+        for path in paths:
+            if path.is_file():
+                digest.update(path.name.encode())
+                digest.update(path.read_bytes())
+        return digest.hexdigest()
 
     def select_defined_variables(self, **kwargs):
         supported_variables = self.get_variable_list()
@@ -38,8 +84,9 @@ class TerraformUtils:
         return list(map(lambda d: next(iter(d)), results))
 
     def apply(self, refresh: bool = True) -> None:
-        return_value, output, err = self.tf.apply(no_color=IsFlagged, refresh=refresh,
-                                                  input=False, skip_plan=True)
+        with utils.terraform_lock(self.working_dir):
+            return_value, output, err = self.tf.apply(no_color=IsFlagged, refresh=refresh,
+                                                      input=False, skip_plan=True)
         if return_value != 0:
             message = f"Terraform apply failed with return value {return_value}, output {output} , error {err}"
             logging.error(message)
@@ -47,17 +94,76 @@ class TerraformUtils:
 
     def set_and_apply(self, refresh: bool = True, **kwargs) -> None:
         defined_variables = self.select_defined_variables(**kwargs)
-        self.change_variables(defined_variables)
-        self.apply(refresh=refresh)
-
-    def change_variables(self, variables: Dict[str, str], refresh: bool = True) -> None:
-        with open(self.var_file_path, "r+") as _file:
-            tfvars = json.load(_file)
-            tfvars.update(variables)
-            _file.seek(0)
-            _file.truncate()
+        self.change_variables(defined_variables, refresh=refresh)
+
+    def change_variables(self, variables: Dict[str, Any], refresh: bool = True) -> None:
+        """
+        Update the tfvars and apply them. Nothing is applied when none of the variables changed.
+        The tfvars are restored if the apply fails, so a retry with the same variables is applied.
+        """
+        original_tfvars = self._read_var_file()
+        changed_variables = self._update_var_file(variables)
+        if not changed_variables:
+            logging.info("Terraform variables %s are unchanged, skipping apply", list(variables))
+            return
+
+        if self._batched_variables is not None:
+            self._batched_variables.update(changed_variables)
+            return
+
+        with self._restore_var_file_on_error(original_tfvars):
+            self.apply(refresh=refresh)
+
+    def _read_var_file(self) -> Dict[str, Any]:
+        with open(self.var_file_path) as _file:
+            return json.load(_file)
+
+    def _write_var_file(self, tfvars: Dict[str, Any]):
+        with open(self.var_file_path, "w") as _file:
             json.dump(tfvars, _file)
-        self.apply(refresh=refresh)
+
+    def _update_var_file(self, variables: Dict[str, Any]) -> Dict[str, Any]:
+        tfvars = self._read_var_file()
+        changed_variables = {k: v for k, v in variables.items() if k not in tfvars or tfvars[k] != v}
+        if changed_variables:
+            tfvars.update(changed_variables)
+            self._write_var_file(tfvars)
+        return changed_variables
+
+    @contextmanager
+    def _restore_var_file_on_error(self, original_tfvars: Dict[str, Any]) -> Iterator[None]:
+        try:
+            yield
+        except BaseException:
+            logging.info("Restoring the terraform variables that weren't applied")
+            self._write_var_file(original_tfvars)
+            raise
+
+    @contextmanager
+    def batch_variables(self, refresh: bool = True) -> Iterator[None]:
+        """
+        Coalesce the change_variables calls made in the block into a single apply when it exits.
+        :param refresh: Whether that apply refreshes the state, the refresh of the coalesced calls is ignored.
+                        Pass False when the state is known to be fresh, e.g. when only resources that are managed
+                        solely by terraform change since its last apply.
+        """
+        if self._batched_variables is not None:
+            # Nested batches are applied by the outermost one
+            yield
+            return
+
+        original_tfvars = self._read_var_file()
+        self._batched_variables = {}
+        with self._restore_var_file_on_error(original_tfvars):
+            try:
+                yield
+                batched_variables = self._batched_variables
+            finally:
+                self._batched_variables = None
+
+            if batched_variables:
+                logging.info("Applying batched terraform variables %s", list(batched_variables))
+                self.apply(refresh=refresh)
 
     def get_state(self) -> Tfstate:
         self.tf.read_state_file(self.STATE_FILE)
@@ -68,8 +174,9 @@ class TerraformUtils:
         return [resource for resource in state.resources
                 if resource_type is None or resource["type"] == resource_type]
 
-    def set_new_vips(self, api_vip: str, ingress_vip: str) -> None:
-        self.change_variables(variables={"api_vip": api_vip, "ingress_vip": ingress_vip}, refresh=True)
+    def set_new_vips(self, api_vip: str, ingress_vip: str, refresh: bool = True) -> None:
+        self.change_variables(variables={"api_vip": api_vip, "ingress_vip": ingress_vip}, refresh=refresh)
 
     def destroy(self) -> None:
-        self.tf.destroy(force=True, input=False, auto_approve=True)
+        with utils.terraform_lock(self.working_dir):
+            self.tf.destroy(force=True, input=False, auto_approve=True)
@@ -1,3 +1,4 @@
+import hashlib
 import uuid
 
 from test_infra import consts
@@ -8,6 +9,12 @@ def get_cluster_name_suffix(length: str = consts.SUFFIX_LENGTH):
     return str(uuid.uuid4())[: length]
 
 
+def get_reusable_cluster_name_suffix(length: str = consts.SUFFIX_LENGTH):
+    """ Suffix that is the same for all the tests run by a pytest worker, so they can reuse each other's nodes """
+    worker = f"{get_env('NAMESPACE', consts.DEFAULT_NAMESPACE)}-{get_env('PYTEST_XDIST_WORKER', 'main')}"
+    return hashlib.sha256(worker.encode()).hexdigest()[: length]
+
+
 class ClusterName:
     def __init__(self, prefix: str = None, suffix: str = None):
         self.prefix = prefix if prefix is not None else get_env("CLUSTER_NAME", f"{consts.CLUSTER_PREFIX}")
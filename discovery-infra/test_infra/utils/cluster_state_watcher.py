@@ -0,0 +1,204 @@
+import threading
+import time
+from collections import namedtuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import waiting
+from logger import log
+
+ClusterState = namedtuple("ClusterState", ["cluster", "hosts", "fetched_at"])
+
+
+class _Subscription:
+    def __init__(self, interval: float, cluster: bool, hosts: bool):
+        self.interval = interval
+        self.cluster = cluster
+        self.hosts = hosts
+
+
+class ClusterStateWatcher:
+    """ Polls a single cluster on behalf of any number of waiters.
+
+        A background thread fetches the cluster and/or its hosts once per interval
+        while there is at least one waiter, and backs off while nothing changes.
+        Waiters block on a condition variable and evaluate their predicate against
+        the latest snapshot instead of querying assisted-service themselves. A watcher
+        is registered while it has waiters, which keeps its client alive. """
+
+    DEFAULT_INTERVAL = 5
+    MAX_INTERVAL = 30
+    BACKOFF_FACTOR = 1.5
+
+    _watchers: Dict[Tuple[int, str], "ClusterStateWatcher"] = dict()
+    _watchers_lock = threading.Lock()
+
+    def __init__(self, client, cluster_id: str, max_interval: float = MAX_INTERVAL):
+        self._client = client
+        self._cluster_id = cluster_id
+        self._key = (id(client), cluster_id)
+        self._max_interval = max_interval
+
+        self._cond = threading.Condition()
+        self._subscriptions: List[_Subscription] = []
+        self._state = ClusterState(cluster=None, hosts=None, fetched_at=0)
+        self._version = 0
+        self._interval = None
+        self._refresh_requested = False
+        self._thread: Optional[threading.Thread] = None
+        self.api_calls = 0
+
+    @classmethod
+    def get(cls, client, cluster_id: str) -> "ClusterStateWatcher":
+        key = (id(client), cluster_id)
+        with cls._watchers_lock:
+            watcher = cls._watchers.get(key)
+            if watcher is None:
+                watcher = cls._watchers[key] = cls(client, cluster_id)
+            return watcher
+
+    @classmethod
+    def release(cls, client, cluster_id: str) -> None:
+        with cls._watchers_lock:
+            cls._watchers.pop((id(client), cluster_id), None)
+
+    @property
+    def state(self) -> ClusterState:
+        return self._state
+
+    def wait_for(
+        self,
+        predicate: Callable[[ClusterState], Any],
+        timeout: float,
+        waiting_for: str,
+        interval: float = DEFAULT_INTERVAL,
+        cluster: bool = False,
+        hosts: bool = True,
+    ) -> Any:
+        """
+        Block until predicate(state) returns a truthy value and return it.
+        Exceptions raised by the predicate are propagated to the caller.
+        :param interval: The initial polling interval. The first evaluated snapshot is always fetched after the call
+        :param cluster: Whether the predicate needs the cluster object (cluster_get)
+        :param hosts: Whether the predicate needs the cluster hosts (get_cluster_hosts)
+        :raises waiting.exceptions.TimeoutExpired: if the predicate wasn't satisfied within timeout
+        """
+        subscribed_at = time.time()
+        deadline = subscribed_at + timeout
+        subscription = _Subscription(interval, cluster, hosts)
+        seen_version = None
+
+        self._subscribe(subscription)
+        try:
+            while True:
+                with self._cond:
+                    while (
+                        seen_version == self._version
+                        or self._state.fetched_at < subscribed_at
+                        or not self._is_usable(self._state, subscription)
+                    ):
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise waiting.exceptions.TimeoutExpired(timeout, waiting_for)
+                        self._cond.wait(remaining)
+                    seen_version, state = self._version, self._state
+
+                result = predicate(state)
+                if result:
+                    return result
+        finally:
+            self._unsubscribe(subscription)
+
+    def refresh(self) -> ClusterState:
+        """ Synchronously fetch a fresh snapshot of both cluster and hosts """
+        state = self._fetch(cluster=True, hosts=True)
+        with self._cond:
+            self._publish(state)
+        return state
+
+    @staticmethod
+    def _is_usable(state: ClusterState, subscription: _Subscription) -> bool:
+        return not ((subscription.cluster and state.cluster is None) or (subscription.hosts and state.hosts is None))
+
+    def _subscribe(self, subscription: _Subscription):
+        with self._watchers_lock:
+            # The last waiter may have unregistered the watcher after get() returned it
+            self._watchers.setdefault(self._key, self)
+
+        with self._cond:
+            self._subscriptions.append(subscription)
+            self._interval = min(self._interval or subscription.interval, subscription.interval)
+            # Waiters subscribing together share a single refresh
+            self._refresh_requested = True
+            self._cond.notify_all()
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"cluster-state-watcher-{self._cluster_id}", daemon=True
+                )
+                self._thread.start()
+
+    def _unsubscribe(self, subscription: _Subscription):
+        with self._cond:
+            self._subscriptions.remove(subscription)
+            self._cond.notify_all()
+            if self._subscriptions:
+                return
+
+            with self._watchers_lock:
+                if self._watchers.get(self._key) is self:
+                    del self._watchers[self._key]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._subscriptions:
+                    self._thread = None
+                    self._interval = None
+                    return
+                self._refresh_requested = False
+                fetch_cluster = any(s.cluster for s in self._subscriptions)
+                fetch_hosts = any(s.hosts for s in self._subscriptions)
+
+            try:
+                state = self._fetch(cluster=fetch_cluster, hosts=fetch_hosts)
+            except BaseException:
+                log.exception("Failed to get cluster %s state", self._cluster_id)
+                state = None
+
+            with self._cond:
+                changed = state is not None and self._publish(state)
+                self._interval = self._next_interval(changed)
+                self._cond.wait_for(lambda: self._refresh_requested or not self._subscriptions, self._interval)
+
+    def _fetch(self, cluster: bool, hosts: bool) -> ClusterState:
+        # Stamped with the time the fetch started, so a snapshot is never newer than what it contains
+        started_at = time.time()
+        cluster_obj = hosts_list = None
+        if cluster:
+            self.api_calls += 1
+            cluster_obj = self._client.cluster_get(self._cluster_id)
+        if hosts:
+            self.api_calls += 1
+            hosts_list = self._client.get_cluster_hosts(self._cluster_id)
+        return ClusterState(cluster=cluster_obj, hosts=hosts_list, fetched_at=started_at)
+
+    def _publish(self, state: ClusterState) -> bool:
+        """ Must be called while holding the condition. Returns whether the snapshot changed """
+        previous = self._state
+        changed = (state.cluster is not None and state.cluster != previous.cluster) or (
+            state.hosts is not None and state.hosts != previous.hosts
+        )
+        self._state = ClusterState(
+            cluster=state.cluster if state.cluster is not None else previous.cluster,
+            hosts=state.hosts if state.hosts is not None else previous.hosts,
+            fetched_at=state.fetched_at,
+        )
+        self._version += 1
+        self._cond.notify_all()
+        return changed
+
+    def _next_interval(self, changed: bool) -> float:
+        base = min((s.interval for s in self._subscriptions), default=self.DEFAULT_INTERVAL)
+        if changed or self._interval is None:
+            return base
+        return min(self._interval * self.BACKOFF_FACTOR, max(self._max_interval, base))
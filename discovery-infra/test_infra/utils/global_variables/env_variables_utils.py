@@ -42,6 +42,7 @@ class _EnvVariablesUtils(ABC):
     worker_vcpu: str = get_env("WORKER_CPU", resources.DEFAULT_WORKER_CPU)
     master_vcpu: str = get_env("MASTER_CPU", resources.DEFAULT_MASTER_CPU)
     test_teardown: bool = bool(strtobool(get_env("TEST_TEARDOWN", str(env_defaults.DEFAULT_TEST_TEARDOWN))))
+    reuse_nodes: bool = bool(strtobool(get_env("REUSE_NODES", str(env_defaults.DEFAULT_REUSE_NODES))))
     namespace: str = get_env("NAMESPACE", consts.DEFAULT_NAMESPACE)
     olm_operators: List[str] = field(default_factory=list)
     platform: str = get_env("PLATFORM", env_defaults.DEFAULT_PLATFORM)
@@ -0,0 +1,52 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+from test_infra.utils.inventory_cache import get_host_inventory
+
+
+class HostsIndex:
+    """ Lookup tables over a single cluster hosts listing, built with one inventory parse per host """
+
+    def __init__(self, hosts: List[Dict[str, Any]]):
+        self.hosts = hosts
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        self._by_mac: Dict[str, Dict[str, Any]] = {}
+        self._by_name: Dict[str, Dict[str, Any]] = {}
+        self._macs_by_id: Dict[str, List[str]] = {}
+
+        for host in hosts:
+            self._by_id[host["id"]] = host
+            # First host wins, same as iterating over the hosts list
+            hostname = host.get("requested_hostname")
+            if hostname:
+                self._by_name.setdefault(hostname, host)
+            self._macs_by_id[host["id"]] = self.get_host_macs(host)
+            for mac in self._macs_by_id[host["id"]]:
+                self._by_mac.setdefault(mac.lower(), host)
+
+    def __len__(self):
+        return len(self.hosts)
+
+    @staticmethod
+    def get_host_macs(host: Dict[str, Any]) -> List[str]:
+        if "inventory" not in host:
+            return []
+        inventory = get_host_inventory(host)
+        return [interface["mac_address"] for interface in inventory["interfaces"]]
+
+    def get_by_id(self, host_id: str) -> Optional[Dict[str, Any]]:
+        return self._by_id.get(host_id)
+
+    def get_by_mac(self, mac: str) -> Optional[Dict[str, Any]]:
+        return self._by_mac.get(mac.lower())
+
+    def get_by_name(self, host_name: str) -> Optional[Dict[str, Any]]:
+        return self._by_name.get(host_name)
+
+    def get_by_macs(self, macs: Iterable[str]) -> List[Optional[Dict[str, Any]]]:
+        return [self.get_by_mac(mac) for mac in macs]
+
+    def has_macs(self, macs: Iterable[str]) -> bool:
+        return all(mac.lower() in self._by_mac for mac in macs)
+
+    def get_ids_with_macs(self) -> Dict[str, List[str]]:
+        return dict(self._macs_by_id)
@@ -0,0 +1,64 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict
+
+
+class InventoryCache:
+    """ Bounded LRU cache of parsed host inventories keyed by (host id, updated_at).
+
+        Parsed inventories are shared between callers and must be treated as read-only. """
+
+    DEFAULT_MAX_SIZE = 1024
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, host: Dict[str, Any]) -> Dict[str, Any]:
+        """ Return the parsed host["inventory"]. Raises KeyError if the host has no inventory """
+        raw = host["inventory"]
+        key = (host.get("id"), host.get("updated_at"))
+        if key[0] is None or key[1] is None:
+            with self._lock:
+                self.misses += 1
+            return json.loads(raw)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            # Comparing the raw document is much cheaper than parsing it and guards against stale timestamps
+            if entry is not None and entry[0] == raw:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        inventory = json.loads(raw)
+        with self._lock:
+            self._entries[key] = (raw, inventory)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return inventory
+
+    def stats(self) -> Dict[str, int]:
+        return dict(hits=self.hits, misses=self.misses, size=len(self._entries), max_size=self.max_size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+inventory_cache = InventoryCache()
+
+
+def get_host_inventory(host: Dict[str, Any]) -> Dict[str, Any]:
+    return inventory_cache.get(host)
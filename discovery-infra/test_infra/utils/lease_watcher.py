@@ -0,0 +1,192 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import libvirt
+import waiting
+from logger import log
+
+LIBVIRT_URI = "qemu:///system"
+
+Leases = List[Dict[str, Any]]
+
+
+class _NetworkState:
+    def __init__(self):
+        self.leases: Optional[Leases] = None
+        self.version = 0
+        self.fetched_at = 0
+        self.waiters = 0
+        self.refresh_requested = False
+        self.thread: Optional[threading.Thread] = None
+
+
+class LeaseWatcher:
+    """ Keeps the DHCP leases of libvirt networks in memory on behalf of any number of waiters.
+
+        libvirt doesn't emit events for DHCP leases, so a background thread per watched network fetches
+        them while the network has waiters. Domain and network lifecycle events, delivered by the libvirt
+        default event loop, trigger an immediate fetch and frequent fetches for a while after them, since
+        that is when leases change. Otherwise the fetch interval backs off. Waiters block on a condition
+        variable and evaluate their predicate against the latest leases instead of querying libvirt. """
+
+    FAST_INTERVAL = 1
+    MAX_INTERVAL = 10
+    BACKOFF_FACTOR = 1.5
+    EVENT_BURST_DURATION = 60
+
+    _instance: Optional["LeaseWatcher"] = None
+    _instance_lock = threading.Lock()
+    _event_loop_registered = False
+
+    def __init__(self, uri: str = LIBVIRT_URI):
+        self._conn = libvirt.open(uri)
+        self._cond = threading.Condition()
+        self._networks: Dict[str, _NetworkState] = {}
+        self._last_event_at = 0
+        self.events_enabled = self._register_events(uri)
+
+    @classmethod
+    def get(cls) -> "LeaseWatcher":
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def _register_events(self, uri: str) -> bool:
+        try:
+            if not LeaseWatcher._event_loop_registered:
+                # Must precede opening the connection whose events are delivered by the loop
+                libvirt.virEventRegisterDefaultImpl()
+                LeaseWatcher._event_loop_registered = True
+                threading.Thread(target=self._run_event_loop, name="libvirt-event-loop", daemon=True).start()
+
+            self._events_conn = libvirt.open(uri)
+            self._events_conn.domainEventRegisterAny(
+                None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._on_domain_event, None
+            )
+            self._events_conn.networkEventRegisterAny(
+                None, libvirt.VIR_NETWORK_EVENT_ID_LIFECYCLE, self._on_network_event, None
+            )
+            return True
+        except libvirt.libvirtError:
+            log.warning("Failed to subscribe to libvirt events, falling back to polling DHCP leases", exc_info=True)
+            return False
+
+    @staticmethod
+    def _run_event_loop():
+        while True:
+            libvirt.virEventRunDefaultImpl()
+
+    def _on_domain_event(self, _conn, domain, event, _detail, _opaque):
+        log.debug("Domain %s lifecycle event %s", domain.name(), event)
+        with self._cond:
+            self._last_event_at = time.time()
+            for state in self._networks.values():
+                state.refresh_requested = True
+            self._cond.notify_all()
+
+    def _on_network_event(self, _conn, network, event, _detail, _opaque):
+        log.debug("Network %s lifecycle event %s", network.name(), event)
+        with self._cond:
+            self._last_event_at = time.time()
+            state = self._networks.get(network.name())
+            if state is not None:
+                state.refresh_requested = True
+                self._cond.notify_all()
+
+    def get_leases(self, network_name: str) -> Leases:
+        return self._conn.networkLookupByName(network_name).DHCPLeases()
+
+    def wait_for(self, network_name: str, predicate: Callable[[Leases], Any], timeout: float, waiting_for: str) -> Any:
+        """
+        Block until predicate(leases) returns a truthy value and return it.
+        Exceptions raised by the predicate are propagated to the caller.
+        :raises waiting.exceptions.TimeoutExpired: if the predicate wasn't satisfied within timeout
+        """
+        return self.wait_for_networks([network_name], predicate, timeout, waiting_for)
+
+    def wait_for_networks(
+        self, network_names: Iterable[str], predicate: Callable[[Leases], Any], timeout: float, waiting_for: str
+    ) -> Any:
+        """
+        Same as wait_for, with the leases of all the given networks passed to the predicate.
+        The predicate is first evaluated against leases fetched after the call, never against older ones.
+        """
+        deadline = time.time() + timeout
+        seen_versions = None
+        subscribed_at = time.time()
+        states = [self._subscribe(network_name) for network_name in dict.fromkeys(network_names)]
+        try:
+            while True:
+                with self._cond:
+                    while not self._has_new_leases(states, seen_versions, subscribed_at):
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise waiting.exceptions.TimeoutExpired(timeout, waiting_for)
+                        self._cond.wait(remaining)
+                    seen_versions = [state.version for state in states]
+                    leases = [lease for state in states for lease in state.leases]
+
+                result = predicate(leases)
+                if result:
+                    return result
+        finally:
+            for state in states:
+                self._unsubscribe(state)
+
+    @staticmethod
+    def _has_new_leases(states: List[_NetworkState], seen_versions: Optional[List[int]], subscribed_at: float) -> bool:
+        return [state.version for state in states] != seen_versions and all(
+            state.leases is not None and state.fetched_at >= subscribed_at for state in states
+        )
+
+    def _subscribe(self, network_name: str) -> _NetworkState:
+        with self._cond:
+            state = self._networks.setdefault(network_name, _NetworkState())
+            state.waiters += 1
+            # Leases fetched before the waiter subscribed may predate the change it waits for
+            state.refresh_requested = True
+            self._cond.notify_all()
+
+            if state.thread is None:
+                state.thread = threading.Thread(
+                    target=self._run, args=(network_name, state), name=f"lease-watcher-{network_name}", daemon=True
+                )
+                state.thread.start()
+            return state
+
+    def _unsubscribe(self, state: _NetworkState):
+        with self._cond:
+            state.waiters -= 1
+            self._cond.notify_all()
+
+    def _run(self, network_name: str, state: _NetworkState):
+        interval = self.FAST_INTERVAL
+        while True:
+            with self._cond:
+                if not state.waiters:
+                    state.thread = None
+                    return
+                state.refresh_requested = False
+
+            started_at = time.time()
+            try:
+                leases = self.get_leases(network_name)
+            except libvirt.libvirtError:
+                log.exception("Failed to get DHCP leases of network %s", network_name)
+                leases = None
+
+            with self._cond:
+                changed = leases is not None and leases != state.leases
+                if leases is not None:
+                    state.leases, state.fetched_at = leases, started_at
+                    state.version += 1
+                    self._cond.notify_all()
+
+                in_event_burst = time.time() - self._last_event_at < self.EVENT_BURST_DURATION
+                if changed or in_event_burst:
+                    interval = self.FAST_INTERVAL
+                else:
+                    interval = min(interval * self.BACKOFF_FACTOR, self.MAX_INTERVAL)
+                self._cond.wait_for(lambda: state.refresh_requested or not state.waiters, interval)
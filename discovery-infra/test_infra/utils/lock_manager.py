@@ -0,0 +1,205 @@
+import fcntl
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from logger import log
+
+from test_infra import consts
+
+
+class LockTimeout(TimeoutError):
+    pass
+
+
+@dataclass
+class LockMetrics:
+    acquisitions: int = 0
+    contended: int = 0
+    timeouts: int = 0
+    total_wait: float = 0
+    max_wait: float = 0
+    total_hold: float = 0
+
+
+class _HeldLock:
+    def __init__(self, fd: int, shared: bool):
+        self.fd = fd
+        self.shared = shared
+        self.count = 1
+
+
+class LockManager:
+    """ Named, cross-process reader/writer locks built on flock(2).
+
+        Each name maps to a lock file in locks_dir. Shared holders may hold a lock together, an exclusive holder
+        holds it alone. Waiters pass through a per-lock turnstile first, so a waiting exclusive holder blocks
+        newer shared ones instead of starving behind them. The kernel releases the locks of dead processes, so
+        lock files are never deleted; the PIDs of the holders are recorded next to the lock to report who holds
+        it on timeout and to drop the records of holders that died. Locks are reentrant per thread. """
+
+    POLL_INTERVAL = 0.05
+    MAX_POLL_INTERVAL = 1
+    CONTENTION_LOG_THRESHOLD = 1
+
+    def __init__(self, locks_dir: str = consts.LOCKS_FOLDER):
+        self.locks_dir = Path(locks_dir)
+        self._held = threading.local()
+        self._metrics: Dict[str, LockMetrics] = defaultdict(LockMetrics)
+        self._metrics_lock = threading.Lock()
+
+    def _lock_path(self, name: str) -> Path:
+        return self.locks_dir.joinpath(re.sub(r"[^\w.-]", "_", name) + ".lock")
+
+    def _held_locks(self) -> Dict[str, _HeldLock]:
+        if not hasattr(self._held, "locks"):
+            self._held.locks = {}
+        return self._held.locks
+
+    @contextmanager
+    def lock(self, name: str, shared: bool = False, timeout: float = consts.LOCK_TIMEOUT) -> Iterator[None]:
+        """
+        Hold the named lock for the duration of the block.
+        :param shared: Hold it together with other shared holders, e.g. for operations scoped to one namespace
+        :raises LockTimeout: if the lock wasn't acquired within timeout seconds
+        """
+        held = self._held_locks().get(name)
+        if held is not None:
+            if held.shared and not shared:
+                raise RuntimeError(f"Lock {name} is held shared by this thread, it can't be upgraded to exclusive")
+            held.count += 1
+            try:
+                yield
+            finally:
+                held.count -= 1
+            return
+
+        path = self._lock_path(name)
+        fd = self._acquire(name, path, shared, timeout)
+        self._held_locks()[name] = _HeldLock(fd, shared)
+        owner_path = self._record_owner(path, shared)
+        acquired_at = time.time()
+        try:
+            yield
+        finally:
+            del self._held_locks()[name]
+            with self._update_metrics(name) as metrics:
+                metrics.total_hold += time.time() - acquired_at
+            self._remove_owner(owner_path)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _acquire(self, name: str, path: Path, shared: bool, timeout: float) -> int:
+        self.locks_dir.mkdir(parents=True, exist_ok=True)
+        started_at = time.time()
+        deadline = started_at + timeout
+        fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o666)
+        turnstile_fd = os.open(str(path) + ".queue", os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            passed_turnstile = self._flock(turnstile_fd, fcntl.LOCK_EX, deadline)
+            if passed_turnstile is None:
+                raise self._timeout(name, path, timeout)
+            acquired = self._flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX, deadline)
+            if acquired is None:
+                raise self._timeout(name, path, timeout)
+            contended = not (passed_turnstile and acquired)
+        except BaseException:
+            os.close(fd)
+            raise
+        finally:
+            # Closing the turnstile releases it
+            os.close(turnstile_fd)
+
+        wait = time.time() - started_at
+        with self._update_metrics(name) as metrics:
+            metrics.acquisitions += 1
+            metrics.contended += int(contended)
+            metrics.total_wait += wait
+            metrics.max_wait = max(metrics.max_wait, wait)
+        if wait > self.CONTENTION_LOG_THRESHOLD:
+            log.info("Waited %.1fs for %s lock %s", wait, "shared" if shared else "exclusive", name)
+        return fd
+
+    def _flock(self, fd: int, mode: int, deadline: float):
+        """ :return: True if acquired right away, False if acquired after waiting, None on timeout """
+        interval = self.POLL_INTERVAL
+        first_attempt = True
+        while True:
+            try:
+                fcntl.flock(fd, mode | fcntl.LOCK_NB)
+                return first_attempt
+            except BlockingIOError:
+                first_attempt = False
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                time.sleep(min(interval, remaining))
+                interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+
+    def _timeout(self, name: str, path: Path, timeout: float) -> LockTimeout:
+        with self._update_metrics(name) as metrics:
+            metrics.timeouts += 1
+        return LockTimeout(f"Failed to acquire lock {name} within {timeout} seconds, held by {self.get_owners(name)}")
+
+    @staticmethod
+    def _owners_dir(path: Path) -> Path:
+        return path.with_name(path.name + ".owners")
+
+    def _record_owner(self, path: Path, shared: bool) -> Path:
+        owners_dir = self._owners_dir(path)
+        owners_dir.mkdir(exist_ok=True)
+        owner_path = owners_dir.joinpath(f"{os.getpid()}-{threading.get_ident()}")
+        owner_path.write_text(f"{'shared' if shared else 'exclusive'} {time.time()}\n")
+        return owner_path
+
+    @staticmethod
+    def _remove_owner(owner_path: Path):
+        try:
+            owner_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def get_owners(self, name: str) -> List[str]:
+        """ PIDs holding the lock and their modes. Records left behind by processes that died are removed """
+        owners = []
+        owners_dir = self._owners_dir(self._lock_path(name))
+        for owner_path in owners_dir.glob("*") if owners_dir.is_dir() else []:
+            pid = int(owner_path.name.split("-")[0])
+            if not self._is_alive(pid):
+                log.info("Removing stale owner record of dead process %d from lock %s", pid, name)
+                self._remove_owner(owner_path)
+                continue
+            try:
+                owners.append(f"{pid} ({owner_path.read_text().split()[0]})")
+            except FileNotFoundError:
+                continue
+        return owners
+
+    @staticmethod
+    def _is_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @contextmanager
+    def _update_metrics(self, name: str) -> Iterator[LockMetrics]:
+        with self._metrics_lock:
+            yield self._metrics[name]
+
+    def get_metrics(self) -> Dict[str, LockMetrics]:
+        """ Contention metrics of the locks acquired by this process, by lock name """
+        with self._metrics_lock:
+            return {name: LockMetrics(**vars(metrics)) for name, metrics in self._metrics.items()}
+
+
+lock_manager = LockManager(locks_dir=os.environ.get("LOCKS_DIR") or consts.LOCKS_FOLDER)
@@ -2,7 +2,7 @@ import logging
 import os
 import tarfile
 import time
-from tempfile import TemporaryDirectory
+from typing import IO, Callable, Dict, List, Optional, Tuple, Union
 
 import waiting
 from logger import log
@@ -18,22 +18,23 @@ def verify_logs_uploaded(
 ):
     assert os.path.exists(cluster_tar_path), f"{cluster_tar_path} doesn't exist"
 
-    with TemporaryDirectory() as tempdir:
-        with tarfile.open(cluster_tar_path) as tar:
-            logging.info(f"downloaded logs: {tar.getnames()}")
-            assert len(tar.getnames()) >= expected_min_log_num, (
-                f"{tar.getnames()} " f"logs are less than minimum of {expected_min_log_num}"
-            )
-            tar.extractall(tempdir)
-            for gz in os.listdir(tempdir):
-                if "bootstrap" in gz:
-                    _verify_node_logs_uploaded(tempdir, gz)
-                    _verify_bootstrap_logs_uploaded(tempdir, gz, installation_success, verify_control_plane)
-                elif "master" in gz or "worker" in gz:
-                    _verify_node_logs_uploaded(tempdir, gz)
-                elif "controller" in gz:
-                    if check_oc:
-                        _verify_oc_logs_uploaded(os.path.join(tempdir, gz))
+    # The cluster tar is read in random access mode (headers only), the nested node archives are streamed
+    # from their members, nothing is extracted to disk
+    with tarfile.open(cluster_tar_path) as tar:
+        names = tar.getnames()
+        logging.info(f"downloaded logs: {names}")
+        assert len(names) >= expected_min_log_num, f"{names} " f"logs are less than minimum of {expected_min_log_num}"
+        for member in tar.getmembers():
+            gz = member.name
+            if not member.isfile() or "/" in gz:
+                continue
+            if "bootstrap" in gz:
+                _verify_bootstrap_logs_uploaded(tar.extractfile(member), installation_success, verify_control_plane)
+            elif "master" in gz or "worker" in gz:
+                _verify_node_logs_uploaded(_get_tar_names(tar.extractfile(member))[0])
+            elif "controller" in gz:
+                if check_oc:
+                    _verify_oc_logs_uploaded(tar.extractfile(member))
 
 
 def wait_and_verify_oc_logs_uploaded(cluster, cluster_tar_path):
@@ -61,11 +62,9 @@ def verify_logs_are_current(started_cluster_install_at, logs_collected_at):
 def verify_logs_not_uploaded(cluster_tar_path, category):
     assert os.path.exists(cluster_tar_path), f"{cluster_tar_path} doesn't exist"
 
-    with TemporaryDirectory() as tempdir:
-        with tarfile.open(cluster_tar_path) as tar:
-            logging.info(f"downloaded logs: {tar.getnames()}")
-            tar.extractall(tempdir)
-            assert category not in os.listdir(tempdir), f"{category} logs were found in uploaded logs"
+    names, _ = _get_tar_names(cluster_tar_path)
+    logging.info(f"downloaded logs: {names}")
+    assert category not in _get_top_level_names(names), f"{category} logs were found in uploaded logs"
 
 
 def to_utc(timestr):
@@ -112,63 +111,100 @@ def wait_for_logs_complete(client, cluster_id, timeout, interval=60, check_host_
         raise
 
 
-def _check_entry_from_extracted_tar(component, tarpath, verify):
-    with TemporaryDirectory() as tempdir:
-        logging.info(f"open tar file {tarpath}")
-        with tarfile.open(tarpath) as tar:
-            logging.info(f"verifying downloaded logs: {tar.getnames()}")
-            tar.extractall(tempdir)
-            extractedfiles = os.listdir(tempdir)
-            assert any(component in logfile for logfile in extractedfiles), f"can not find {component} in logs"
-            component_tars = [
-                logfile for logfile in extractedfiles if (component in logfile and logfile.endswith(".gz"))
-            ]
-            if component_tars:
-                verify(os.path.join(tempdir, component_tars[0]))
+TarFile = Union[str, IO[bytes]]
+
+
+def _open_tar_stream(tar_file: TarFile) -> tarfile.TarFile:
+    if isinstance(tar_file, str):
+        return tarfile.open(tar_file, mode="r|*")
+    return tarfile.open(fileobj=tar_file, mode="r|*")
+
+
+def _get_tar_names(
+    tar_file: TarFile, is_nested: Optional[Callable[[str], bool]] = None
+) -> Tuple[List[str], Dict[str, List[str]]]:
+    """
+    Read the member names of a (possibly compressed) tar in a single streaming pass.
+    :param is_nested: Members for which it returns True are read as tars themselves
+    :return: The member names, and the member names of each nested tar
+    """
+    names, nested_names = [], {}
+    with _open_tar_stream(tar_file) as tar:
+        for member in tar:
+            names.append(member.name)
+            if is_nested and member.isfile() and is_nested(member.name):
+                nested_names[member.name], _ = _get_tar_names(tar.extractfile(member))
+    return names, nested_names
+
+
+def _get_top_level_names(names: List[str]) -> List[str]:
+    return sorted({name.split("/")[0] for name in names})
+
 
+def _list_tar_dir(names: List[str], dir_path: str) -> List[str]:
+    prefix = dir_path.rstrip("/") + "/"
+    return sorted({name[len(prefix) :].split("/")[0] for name in names if name.startswith(prefix) and name != prefix})
 
-def _verify_oc_logs_uploaded(cluster_tar_path):
-    _check_entry_from_extracted_tar(
+
+def _check_entry_in_tar(component: str, tar_file: TarFile, verify: Callable[[IO[bytes]], None]):
+    logging.info(f"open tar file {tar_file}")
+    names = []
+    verified = False
+    with _open_tar_stream(tar_file) as tar:
+        for member in tar:
+            names.append(member.name)
+            # Stream mode allows reading a member only while it is the current one
+            is_top_level_gz = member.isfile() and "/" not in member.name and member.name.endswith(".gz")
+            if not verified and is_top_level_gz and component in member.name:
+                verify(tar.extractfile(member))
+                verified = True
+
+    logging.info(f"verifying downloaded logs: {names}")
+    assert any(component in logfile for logfile in _get_top_level_names(names)), f"can not find {component} in logs"
+
+
+def _verify_oc_logs_uploaded(cluster_tar: TarFile):
+    _check_entry_in_tar(
         "controller",
-        cluster_tar_path,
-        lambda path: _check_entry_from_extracted_tar("must-gather", path, lambda inner: None),
+        cluster_tar,
+        lambda controller_tar: _check_entry_in_tar("must-gather", controller_tar, lambda inner: None),
     )
 
 
-def _verify_node_logs_uploaded(dir_path, file_path):
-    gz = tarfile.open(os.path.join(dir_path, file_path))
-    logs = gz.getnames()
+def _verify_node_logs_uploaded(logs: List[str]):
     for logs_type in ["agent.logs", "installer.logs", "mount.logs"]:
         assert any(logs_type in s for s in logs), f"{logs_type} isn't found in {logs}"
-    gz.close()
 
 
-def _verify_bootstrap_logs_uploaded(dir_path, file_path, installation_success, verify_control_plane=False):
-    gz = tarfile.open(os.path.join(dir_path, file_path))
-    logs = gz.getnames()
+def _verify_bootstrap_logs_uploaded(gz: IO[bytes], installation_success, verify_control_plane=False):
+    log_bundles = []
+
+    def _is_first_log_bundle(name: str) -> bool:
+        if "log-bundle" in name and not log_bundles:
+            log_bundles.append(name)
+            return True
+        return False
+
+    logs, nested_logs = _get_tar_names(gz, is_nested=None if installation_success else _is_first_log_bundle)
+    _verify_node_logs_uploaded(logs)
     assert any("bootkube.logs" in s for s in logs), f"bootkube.logs isn't found in {logs}"
     if not installation_success:
         for logs_type in ["dmesg.logs", "log-bundle"]:
             assert any(logs_type in s for s in logs), f"{logs_type} isn't found in {logs}"
         # test that installer-gather gathered logs from all masters
-        lb_path = [s for s in logs if "log-bundle" in s][0]
-        gz.extract(lb_path, dir_path)
-        lb = tarfile.open(os.path.join(dir_path, lb_path))
-        lb.extractall(dir_path)
-        cp_path = [s for s in lb.getnames() if "control-plane" in s][0]
+        lb_names = nested_logs[log_bundles[0]]
+        cp_path = [s for s in lb_names if "control-plane" in s][0]
         # if bootstrap able to ssh to other masters, test that control-plane directory is not empty
         if verify_control_plane:
-            cp_full_path = os.path.join(dir_path, cp_path)
-            master_dirs = os.listdir(cp_full_path)
+            master_dirs = _list_tar_dir(lb_names, cp_path)
             assert len(master_dirs) == NUMBER_OF_MASTERS - 1, (
-                f"expecting {cp_full_path} to have " f"{NUMBER_OF_MASTERS - 1} values"
+                f"expecting {cp_path} to have " f"{NUMBER_OF_MASTERS - 1} values"
             )
             logging.info(f"control-plane directory has sub-directory for each master: {master_dirs}")
             for ip_dir in master_dirs:
-                logging.info(f"{ip_dir} content: {os.listdir(os.path.join(cp_full_path, ip_dir))}")
-                assert len(os.listdir(os.path.join(cp_full_path, ip_dir))) > 0, f"{cp_path}/{ip_dir} is empty"
-        lb.close()
-    gz.close()
+                ip_dir_content = _list_tar_dir(lb_names, f"{cp_path.rstrip('/')}/{ip_dir}")
+                logging.info(f"{ip_dir} content: {ip_dir_content}")
+                assert len(ip_dir_content) > 0, f"{cp_path}/{ip_dir} is empty"
 
 
 def _are_logs_in_status(client, cluster_id, statuses, check_host_logs_only=False):
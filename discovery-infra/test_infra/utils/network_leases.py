@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import namedtuple
+from typing import Any, Dict, List
+from xml.etree import ElementTree
+
+import libvirt
+
+LEASES_TTL = 2
+NETWORK_HOSTS_TTL = 60
+
+_CachedLeases = namedtuple("_CachedLeases", ["leases", "fetched_at"])
+_CachedHosts = namedtuple("_CachedHosts", ["uuid", "hosts", "fetched_at"])
+
+
+def parse_network_hosts(network_xml: str) -> List[Dict[str, Any]]:
+    """ The static DHCP <host> entries of the first <ip> element of a network XML """
+    ip = ElementTree.fromstring(network_xml).find("ip")
+    dhcp = ip.find("dhcp") if ip is not None else None
+    hosts = dhcp.findall("host") if dhcp is not None else []
+    return [
+        {"mac": host.get("mac", ""), "ipaddr": host.get("ip", ""), "hostname": host.get("name", "")} for host in hosts
+    ]
+
+
+class NetworkLeasesCache:
+    """ DHCP leases and static DHCP hosts of libvirt networks, cached for a short time.
+
+        Each network has its own lock, so concurrent callers of the same network share a single lookup
+        while callers of other networks are not blocked. The static hosts only change when the network
+        is redefined, they are kept for longer and refetched when the network's UUID changes. """
+
+    def __init__(self, conn: libvirt.virConnect, leases_ttl: float = LEASES_TTL, hosts_ttl: float = NETWORK_HOSTS_TTL):
+        self._conn = conn
+        self.leases_ttl = leases_ttl
+        self.hosts_ttl = hosts_ttl
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self._leases: Dict[str, _CachedLeases] = {}
+        self._hosts: Dict[str, _CachedHosts] = {}
+
+    def _lock(self, network_name: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(network_name, threading.Lock())
+
+    def get_leases(self, network_name: str) -> List[Dict[str, Any]]:
+        """ The DHCP leases of the network, merged with its static hosts that have no lease """
+        with self._lock(network_name):
+            cached = self._leases.get(network_name)
+            if cached is None or time.time() - cached.fetched_at > self.leases_ttl:
+                net = self._conn.networkLookupByName(network_name)
+                # TODO: getting the information from the XML dump until dhcp-leases bug is fixed
+                leases = self.merge(net.DHCPLeases(), self._get_hosts(network_name, net))
+                cached = self._leases[network_name] = _CachedLeases(leases, time.time())
+        return [dict(lease) for lease in cached.leases]
+
+    def get_hosts(self, network_name: str) -> List[Dict[str, Any]]:
+        with self._lock(network_name):
+            hosts = self._get_hosts(network_name, self._conn.networkLookupByName(network_name))
+        return [dict(host) for host in hosts]
+
+    def _get_hosts(self, network_name: str, net: libvirt.virNetwork) -> List[Dict[str, Any]]:
+        """ Must be called while holding the network's lock """
+        uuid = net.UUIDString()
+        cached = self._hosts.get(network_name)
+        if cached is None or cached.uuid != uuid or time.time() - cached.fetched_at > self.hosts_ttl:
+            cached = self._hosts[network_name] = _CachedHosts(uuid, parse_network_hosts(net.XMLDesc()), time.time())
+        return cached.hosts
+
+    def invalidate(self, network_name: str):
+        with self._lock(network_name):
+            self._leases.pop(network_name, None)
+            self._hosts.pop(network_name, None)
+
+    @staticmethod
+    def merge(leases, hosts):
+        lips = [ls["ipaddr"] for ls in leases]
+        return leases + [h for h in hosts if h["ipaddr"] not in lips]
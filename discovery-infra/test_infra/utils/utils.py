@@ -2,7 +2,6 @@
 import datetime
 import errno
 import ipaddress
-import itertools
 import json
 import logging
 import os
@@ -14,7 +13,6 @@ import subprocess
 import tempfile
 import time
 import warnings
-import xml.dom.minidom as md
 from contextlib import contextmanager
 from distutils.dir_util import copy_tree
 from functools import wraps
@@ -22,7 +20,6 @@ from pathlib import Path
 from string import ascii_lowercase
 from typing import List, Tuple, Union
 
-import filelock
 import libvirt
 import oc_utils
 import requests
@@ -35,9 +32,17 @@ from requests.models import HTTPError
 from retry import retry
 
 import test_infra.consts as consts
+from test_infra.tools.downloader import Downloader
+from test_infra.tools.iso_cache import IsoCache, iso_cache
 from test_infra.utils import logs_utils
+from test_infra.utils.cluster_state_watcher import ClusterStateWatcher
+from test_infra.utils.hosts_index import HostsIndex
+from test_infra.utils.lease_watcher import LeaseWatcher
+from test_infra.utils.lock_manager import lock_manager
+from test_infra.utils.network_leases import NetworkLeasesCache
 
 conn = libvirt.open("qemu:///system")
+network_leases_cache = NetworkLeasesCache(conn)
 
 
 def scan_for_free_port(starting_port: int, step: int = 200):
@@ -95,10 +100,11 @@ def run_command_with_output(command, env=None):
 def wait_till_nodes_are_ready(nodes_count, network_name):
     log.info("Wait till %s nodes will be ready and have ips", nodes_count)
     try:
-        waiting.wait(
-            lambda: len(get_network_leases(network_name)) >= nodes_count,
-            timeout_seconds=consts.NODES_REGISTERED_TIMEOUT * nodes_count,
-            sleep_seconds=10,
+        hosts = network_leases_cache.get_hosts(network_name)
+        LeaseWatcher.get().wait_for(
+            network_name,
+            lambda leases: len(NetworkLeasesCache.merge(leases, hosts)) >= nodes_count,
+            timeout=consts.NODES_REGISTERED_TIMEOUT * nodes_count,
             waiting_for="Nodes to have ips",
         )
         log.info("All nodes have booted and got ips")
@@ -137,11 +143,7 @@ def get_libvirt_nodes_macs(network_name):
 
 
 def are_all_libvirt_nodes_in_cluster_hosts(client, cluster_id, network_name):
-    hosts_macs = client.get_hosts_id_with_macs(cluster_id)
-    return all(
-        mac.lower() in map(str.lower, itertools.chain(*hosts_macs.values()))
-        for mac in get_libvirt_nodes_macs(network_name)
-    )
+    return client.get_cluster_hosts_index(cluster_id).has_macs(get_libvirt_nodes_macs(network_name))
 
 
 def are_libvirt_nodes_in_cluster_hosts(client, cluster_id, num_nodes):
@@ -151,7 +153,7 @@ def are_libvirt_nodes_in_cluster_hosts(client, cluster_id, num_nodes):
 
 
 def get_cluster_hosts_with_mac(client, cluster_id, macs):
-    return [client.get_host_by_mac(cluster_id, mac) for mac in macs]
+    return client.get_hosts_by_macs(cluster_id, macs)
 
 
 def to_utc(timestr):
@@ -206,15 +208,15 @@ def wait_till_hosts_with_macs_are_in_status(
 ):
     log.info("Wait till %s nodes are in one of the statuses %s", len(macs), statuses)
 
-    waiting.wait(
-        lambda: are_hosts_in_status(
-            get_cluster_hosts_with_mac(client, cluster_id, macs),
+    ClusterStateWatcher.get(client, cluster_id).wait_for(
+        lambda state: are_hosts_in_status(
+            HostsIndex(state.hosts).get_by_macs(macs),
             len(macs),
             statuses,
             fall_on_error_status,
         ),
-        timeout_seconds=timeout,
-        sleep_seconds=interval,
+        timeout=timeout,
+        interval=interval,
         waiting_for="Nodes to be in of the statuses %s" % statuses,
     )
 
@@ -230,15 +232,15 @@ def wait_till_all_hosts_are_in_status(
 ):
     log.info("Wait till %s nodes are in one of the statuses %s", nodes_count, statuses)
 
-    waiting.wait(
-        lambda: are_hosts_in_status(
-            client.get_cluster_hosts(cluster_id),
+    ClusterStateWatcher.get(client, cluster_id).wait_for(
+        lambda state: are_hosts_in_status(
+            state.hosts,
             nodes_count,
             statuses,
             fall_on_error_status,
         ),
-        timeout_seconds=timeout,
-        sleep_seconds=interval,
+        timeout=timeout,
+        interval=interval,
         waiting_for="Nodes to be in of the statuses %s" % statuses,
     )
 
@@ -254,15 +256,15 @@ def wait_till_at_least_one_host_is_in_status(
 ):
     log.info("Wait till 1 node is in one of the statuses %s", statuses)
 
-    waiting.wait(
-        lambda: are_hosts_in_status(
-            client.get_cluster_hosts(cluster_id),
+    ClusterStateWatcher.get(client, cluster_id).wait_for(
+        lambda state: are_hosts_in_status(
+            state.hosts,
             nodes_count,
             statuses,
             fall_on_error_status,
         ),
-        timeout_seconds=timeout,
-        sleep_seconds=interval,
+        timeout=timeout,
+        interval=interval,
         waiting_for="Node to be in of the statuses %s" % statuses,
     )
 
@@ -279,15 +281,15 @@ def wait_till_specific_host_is_in_status(
 ):
     log.info(f"Wait till {nodes_count} host is in one of the statuses: {statuses}")
 
-    waiting.wait(
-        lambda: are_hosts_in_status(
-            [client.get_host_by_name(cluster_id, host_name)],
+    ClusterStateWatcher.get(client, cluster_id).wait_for(
+        lambda state: are_hosts_in_status(
+            [host for host in state.hosts if host.get("requested_hostname") == host_name][:1],
             nodes_count,
             statuses,
             fall_on_error_status,
         ),
-        timeout_seconds=timeout,
-        sleep_seconds=interval,
+        timeout=timeout,
+        interval=interval,
         waiting_for="Node to be in of the statuses %s" % statuses,
     )
 
@@ -301,19 +303,20 @@ def wait_till_at_least_one_host_is_in_stage(
     interval=5,
 ):
     log.info(f"Wait till {nodes_count} node is in stage {stages}")
+    watcher = ClusterStateWatcher.get(client, cluster_id)
     try:
-        waiting.wait(
-            lambda: are_host_progress_in_stage(
-                client.get_cluster_hosts(cluster_id),
+        watcher.wait_for(
+            lambda state: are_host_progress_in_stage(
+                state.hosts,
                 stages,
                 nodes_count,
             ),
-            timeout_seconds=timeout,
-            sleep_seconds=interval,
+            timeout=timeout,
+            interval=interval,
             waiting_for="Node to be in of the stage %s" % stages,
         )
     except BaseException:
-        hosts = client.get_cluster_hosts(cluster_id)
+        hosts = watcher.state.hosts or client.get_cluster_hosts(cluster_id)
         log.error(
             f"All nodes stages: "
             f"{[host['progress']['current_stage'] for host in hosts]} "
@@ -344,24 +347,35 @@ def wait_till_cluster_is_in_status(
     break_statuses: List[str] = None,
 ):
     log.info("Wait till cluster %s is in status %s", cluster_id, statuses)
+    watcher = ClusterStateWatcher.get(client, cluster_id)
     try:
         if break_statuses:
             statuses += break_statuses
-        waiting.wait(
-            lambda: is_cluster_in_status(client=client, cluster_id=cluster_id, statuses=statuses),
-            timeout_seconds=timeout,
-            sleep_seconds=interval,
+        cluster_status = watcher.wait_for(
+            lambda state: _get_cluster_status_if_in(state.cluster, cluster_id, statuses),
+            timeout=timeout,
+            interval=interval,
             waiting_for="Cluster to be in status %s" % statuses,
+            cluster=True,
+            hosts=False,
         )
-        if break_statuses and is_cluster_in_status(client, cluster_id, break_statuses):
-            raise BaseException(
-                f"Stop installation process, " f"cluster is in status {client.cluster_get(cluster_id).status}"
-            )
+        if break_statuses and cluster_status in break_statuses:
+            raise BaseException(f"Stop installation process, " f"cluster is in status {cluster_status}")
     except BaseException:
-        log.error("Cluster status is: %s", client.cluster_get(cluster_id).status)
+        cluster = watcher.state.cluster or client.cluster_get(cluster_id)
+        log.error("Cluster status is: %s", cluster.status)
         raise
 
 
+def _get_cluster_status_if_in(cluster, cluster_id, statuses):
+    log.info("Is cluster %s in status %s", cluster_id, statuses)
+    if cluster.status in statuses:
+        return cluster.status
+
+    log.info(f"Cluster not yet in its required status. " f"Current status: {cluster.status}")
+    return None
+
+
 def is_cluster_in_status(client, cluster_id, statuses):
     log.info("Is cluster %s in status %s", cluster_id, statuses)
     try:
@@ -535,58 +549,26 @@ def on_exception(*, message=None, callback=None, silent=False, errors=(Exception
 
 
 @contextmanager
-def file_lock_context(filepath="/tmp/discovery-infra.lock", timeout=300):
-    logging.getLogger("filelock").setLevel(logging.ERROR)
-
-    lock = filelock.FileLock(filepath, timeout)
-    try:
-        lock.acquire()
-    except filelock.Timeout:
-        log.info("Deleting lock file: %s " "since it exceeded timeout of: %d seconds", filepath, timeout)
-        os.unlink(filepath)
-        lock.acquire()
-
-    try:
+def file_lock_context(filepath="/tmp/discovery-infra.lock", timeout=consts.LOCK_TIMEOUT):
+    """ Exclusive lock named after the file. Prefer the finer grained locks of lock_manager """
+    with lock_manager.lock(Path(filepath).stem, timeout=timeout):
         yield
-    finally:
-        lock.release()
 
 
-def _get_hosts_from_network(net):
-    desc = md.parseString(net.XMLDesc())
-    try:
-        hosts = (
-            desc.getElementsByTagName("network")[0]
-            .getElementsByTagName("ip")[0]
-            .getElementsByTagName("dhcp")[0]
-            .getElementsByTagName("host")
-        )
-        return list(
-            map(
-                lambda host: {
-                    "mac": host.getAttribute("mac"),
-                    "ipaddr": host.getAttribute("ip"),
-                    "hostname": host.getAttribute("name"),
-                },
-                hosts,
-            )
-        )
-    except IndexError:
-        return []
-
-
-def _merge(leases, hosts):
-    lips = [ls["ipaddr"] for ls in leases]
-    ret = leases + [h for h in hosts if h["ipaddr"] not in lips]
-    return ret
+@contextmanager
+def terraform_lock(tf_folder: str, timeout=consts.LIBVIRT_LOCK_TIMEOUT):
+    """
+    Lock for running terraform in tf_folder. Terraform runs of different namespaces share the libvirt lock
+    and run concurrently, runs in the same folder are serialised.
+    """
+    namespace = os.path.basename(os.path.normpath(tf_folder))
+    with lock_manager.lock(consts.LIBVIRT_LOCK, shared=True, timeout=timeout):
+        with lock_manager.lock(f"terraform-{namespace}", timeout=timeout):
+            yield
 
 
 def get_network_leases(network_name):
-    with file_lock_context():
-        net = conn.networkLookupByName(network_name)
-        leases = net.DHCPLeases()  # TODO: getting the information from the XML dump until dhcp-leases bug is fixed
-        hosts = _get_hosts_from_network(net)
-        return _merge(leases, hosts)
+    return network_leases_cache.get_leases(network_name)
 
 
 def create_ip_address_list(node_count, starting_ip_addr):
@@ -634,9 +616,8 @@ def touch(path):
 
 
 def config_etc_hosts(cluster_name: str, base_dns_domain: str, api_vip: str):
-    lock_file = "/tmp/test_etc_hosts.lock"
     api_vip_dnsname = "api." + cluster_name + "." + base_dns_domain
-    with file_lock_context(lock_file):
+    with lock_manager.lock(consts.ETC_HOSTS_LOCK):
         with open("/etc/hosts", "r") as f:
             hosts_lines = f.readlines()
         for i, line in enumerate(hosts_lines):
@@ -763,18 +744,13 @@ def update_hosts(client, cluster_id, libvirt_nodes, update_hostnames=False, upda
 
     roles = []
     hostnames = []
-    inventory_hosts = client.get_cluster_hosts(cluster_id)
+    hosts_index = client.get_cluster_hosts_index(cluster_id)
 
     for libvirt_mac, libvirt_metadata in libvirt_nodes.items():
-        for host in inventory_hosts:
-            inventory = json.loads(host["inventory"])
-
-            if libvirt_mac.lower() in map(
-                lambda interface: interface["mac_address"].lower(),
-                inventory["interfaces"],
-            ):
-                roles.append({"id": host["id"], "role": libvirt_metadata["role"]})
-                hostnames.append({"id": host["id"], "hostname": libvirt_metadata["name"]})
+        host = hosts_index.get_by_mac(libvirt_mac)
+        if host:
+            roles.append({"id": host["id"], "role": libvirt_metadata["role"]})
+            hostnames.append({"id": host["id"], "hostname": libvirt_metadata["name"]})
 
     if not update_hostnames:
         hostnames = None
@@ -800,10 +776,15 @@ def get_assisted_controller_status(kubeconfig):
     return response.stdout
 
 
-def download_iso(image_url, image_path):
-    with requests.get(image_url, stream=True, verify=False) as image, open(image_path, "wb") as out:
-        for chunk in image.iter_content(chunk_size=1024):
-            out.write(chunk)
+def download_iso(image_url, image_path, image_id=None):
+    """ image_id identifies the image content (e.g. its creation time), images with an image_id are cached """
+    if image_id is None:
+        Downloader(image_url).download(image_path)
+        return
+
+    # The presigned query string changes between requests for the same image
+    cache_key = IsoCache.key_for(url=image_url.split("?", 1)[0], image_id=image_id)
+    iso_cache.materialize(cache_key, image_path, lambda path: Downloader(image_url).download(path))
 
 
 def fetch_url(url, timeout=60, max_retries=5):
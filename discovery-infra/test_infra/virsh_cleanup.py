@@ -1,79 +1,140 @@
-import subprocess
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Optional
 
+import libvirt
 from logger import log
-from test_infra import utils
+from test_infra import consts
+from test_infra.tools.concurrently import run_concurrently
+from test_infra.utils.lock_manager import lock_manager
 
 DEFAULT_SKIP_LIST = ["default"]
+LIBVIRT_URI = "qemu:///system"
+DOMAIN_UNDEFINE_FLAGS = (
+    libvirt.VIR_DOMAIN_UNDEFINE_MANAGED_SAVE
+    | libvirt.VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA
+    | libvirt.VIR_DOMAIN_UNDEFINE_NVRAM
+)
 
 
-def _run_command(command, check=False, resource_filter=None):
-    if resource_filter:
-        command += '| grep -E "%s"' % "|".join(resource_filter)
-    process = subprocess.run(
-        command,
-        shell=True,
-        check=check,
-        stdout=subprocess.PIPE,
-        universal_newlines=True,
-    )
-    output = process.stdout.strip()
-    return output
-
-
-def _clean_domains(skip_list, resource_filter):
-    domains = _run_command(
-        "virsh -c qemu:///system list --all --name", resource_filter=resource_filter
-    )
-    domains = domains.splitlines()
-    for domain in domains:
-        log.info("Deleting domain %s", domain)
-        if domain and domain not in skip_list:
-            _run_command("virsh -c qemu:///system destroy %s" % domain, check=False)
-            _run_command("virsh -c qemu:///system undefine %s" % domain, check=False)
-
-
-def _clean_volumes(pool):
-    volumes_with_path = _run_command(
-        "virsh -c qemu:///system vol-list %s | tail -n +3" % pool
-    ).splitlines()
-    for volume_with_path in volumes_with_path:
-        volume, _ = volume_with_path.split()
-        if volume:
-            log.info("Deleting volume %s in pool %s", volume, pool)
-            _run_command(
-                "virsh -c qemu:///system vol-delete --pool %s %s" % (pool, volume),
-                check=False,
-            )
-
-
-def _clean_pools(skip_list, resource_filter):
-    pools = _run_command(
-        "virsh -c qemu:///system pool-list --all --name",
-        resource_filter=resource_filter,
-    )
-    pools = pools.splitlines()
-    for pool in pools:
-        if pool and pool not in skip_list:
-            _clean_volumes(pool)
-            log.info("Deleting pool %s", pool)
-            _run_command("virsh -c qemu:///system pool-destroy %s" % pool, check=False)
-            _run_command("virsh -c qemu:///system pool-undefine %s" % pool, check=False)
-
-
-def _clean_networks(skip_list, resource_filter):
-    networks = _run_command(
-        "virsh -c qemu:///system net-list --all --name", resource_filter=resource_filter
-    )
-    networks = networks.splitlines()
-    for net in networks:
-        if net and net not in skip_list:
-            log.info("Deleting network %s", net)
-            _run_command("virsh -c qemu:///system net-destroy %s" % net, check=False)
-            _run_command("virsh -c qemu:///system net-undefine %s" % net, check=False)
-
-
-def clean_virsh_resources(skip_list, resource_filter):
-    with utils.file_lock_context():
-        _clean_domains(skip_list, resource_filter)
-        _clean_pools(skip_list, resource_filter)
-        _clean_networks(skip_list, resource_filter)
+@dataclass
+class CleanupReport:
+    domains: List[str] = field(default_factory=list)
+    volumes: List[str] = field(default_factory=list)
+    pools: List[str] = field(default_factory=list)
+    networks: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        return (
+            f"{len(self.domains)} domains, {len(self.volumes)} volumes, {len(self.pools)} pools "
+            f"and {len(self.networks)} networks"
+        )
+
+
+def _get_name_matcher(skip_list: Iterable[str], resource_filter: Optional[Iterable[str]]) -> Callable[[str], bool]:
+    skip_list = set(skip_list)
+    # Same semantics as the former `grep -E` filtering: a name matches if any of the patterns is found in it
+    pattern = re.compile("|".join(resource_filter)) if resource_filter else None
+    return lambda name: bool(name) and name not in skip_list and (pattern is None or bool(pattern.search(name)))
+
+
+def _suppress_libvirt_error(action: str, name: str, call: Callable[[], None]) -> bool:
+    try:
+        call()
+        return True
+    except libvirt.libvirtError as e:
+        log.warning("Failed to %s %s: %s", action, name, e)
+        return False
+
+
+def _is_active(kind: str, name: str, resource) -> bool:
+    """ Whether the domain, pool or network is active, resources deleted concurrently are considered inactive """
+    try:
+        return bool(resource.isActive())
+    except libvirt.libvirtError as e:
+        log.warning("Failed to get the state of %s %s: %s", kind, name, e)
+        return False
+
+
+def _delete_domain(domain: libvirt.virDomain) -> bool:
+    name = domain.name()
+    log.info("Deleting domain %s", name)
+    if _is_active("domain", name, domain):
+        _suppress_libvirt_error("destroy domain", name, domain.destroy)
+
+    try:
+        domain.undefineFlags(DOMAIN_UNDEFINE_FLAGS)
+        return True
+    except libvirt.libvirtError:
+        # Not every flag is supported by every hypervisor
+        return _suppress_libvirt_error("undefine domain", name, domain.undefine)
+
+
+def _clean_domains(conn: libvirt.virConnect, matches: Callable[[str], bool], report: CleanupReport):
+    domains = [domain for domain in conn.listAllDomains() if matches(domain.name())]
+    deleted = run_concurrently([(_delete_domain, domain) for domain in domains], fail_fast=False)
+    report.domains += [domains[i].name() for i, is_deleted in sorted(deleted.items()) if is_deleted]
+
+
+def _delete_volume(pool_name: str, volume: libvirt.virStorageVol) -> bool:
+    log.info("Deleting volume %s in pool %s", volume.name(), pool_name)
+    return _suppress_libvirt_error("delete volume", volume.path(), lambda: volume.delete(0))
+
+
+def _clean_pool(pool: libvirt.virStoragePool, report: CleanupReport):
+    name = pool.name()
+    if _is_active("pool", name, pool):
+        try:
+            volumes = pool.listAllVolumes()
+        except libvirt.libvirtError as e:
+            log.warning("Failed to list the volumes of pool %s: %s", name, e)
+            volumes = []
+        deleted = run_concurrently([(_delete_volume, name, volume) for volume in volumes], fail_fast=False)
+        report.volumes += [volumes[i].path() for i, is_deleted in sorted(deleted.items()) if is_deleted]
+        _suppress_libvirt_error("destroy pool", name, pool.destroy)
+
+    log.info("Deleting pool %s", name)
+    if _suppress_libvirt_error("undefine pool", name, pool.undefine):
+        report.pools.append(name)
+
+
+def _clean_pools(conn: libvirt.virConnect, matches: Callable[[str], bool], report: CleanupReport):
+    for pool in conn.listAllStoragePools():
+        if matches(pool.name()):
+            _clean_pool(pool, report)
+
+
+def _clean_networks(conn: libvirt.virConnect, matches: Callable[[str], bool], report: CleanupReport):
+    for network in conn.listAllNetworks():
+        name = network.name()
+        if not matches(name):
+            continue
+
+        log.info("Deleting network %s", name)
+        if _is_active("network", name, network):
+            _suppress_libvirt_error("destroy network", name, network.destroy)
+        if _suppress_libvirt_error("undefine network", name, network.undefine):
+            report.networks.append(name)
+
+
+def clean_virsh_resources(skip_list, resource_filter, uri=LIBVIRT_URI) -> CleanupReport:
+    """
+    Delete the domains, storage pools with their volumes and networks whose name matches any of the
+    resource_filter patterns (all of them when there is no filter), except the ones in skip_list.
+    Everything is done on a single libvirt connection, domains and volumes are deleted concurrently.
+    :return: What was deleted
+    """
+    matches = _get_name_matcher(skip_list, resource_filter)
+    report = CleanupReport()
+    # Filtered cleanups only touch their own namespace's resources, cleaning everything excludes all the others
+    with lock_manager.lock(consts.LIBVIRT_LOCK, shared=bool(resource_filter), timeout=consts.LIBVIRT_LOCK_TIMEOUT):
+        conn = libvirt.open(uri)
+        try:
+            _clean_domains(conn, matches, report)
+            _clean_pools(conn, matches, report)
+            _clean_networks(conn, matches, report)
+        finally:
+            conn.close()
+
+    log.info("Deleted %s", report)
+    return report
@@ -13,7 +13,6 @@ from _pytest.fixtures import FixtureRequest
 from assisted_service_client.rest import ApiException
 from junit_report import JunitFixtureTestCase, JunitTestCase
 from netaddr import IPNetwork
-from paramiko import SSHException
 
 import test_infra.utils as infra_utils
 from download_logs import download_logs
@@ -31,6 +30,7 @@ from test_infra.helper_classes.config.controller_config import BaseNodeConfig, g
 from test_infra.helper_classes.kube_helpers import create_kube_api_client, KubeAPIContext
 from test_infra.helper_classes.nodes import Nodes
 from test_infra.tools.assets import LibvirtNetworkAssets
+from test_infra.tools.node_logs import collect_journals
 from test_infra.utils.operators_utils import parse_olm_operators_from_env, resource_param
 from tests.config import ClusterConfig
 from tests.config import TerraformConfig
@@ -86,7 +86,11 @@ class BaseTest:
         finally:
             if global_variables.test_teardown:
                 logging.info('--- TEARDOWN --- node controller\n')
-                nodes.destroy_all_nodes()
+                if global_variables.reuse_nodes:
+                    # Kept for the next test, which reverts them to their pristine snapshot
+                    nodes.destroy_all()
+                else:
+                    nodes.destroy_all_nodes()
                 logging.info(f'--- TEARDOWN --- deleting iso file from: {cluster_configuration.iso_download_path}\n')
                 infra_utils.run_command(f"rm -f {cluster_configuration.iso_download_path}", shell=True)
 
@@ -416,13 +420,7 @@ class BaseTest:
         infra_utils.recreate_folder(log_dir_name, with_chmod=False, force_recreate=False)
         journal_ctl_path = Path(log_dir_name) / 'nodes_journalctl'
         infra_utils.recreate_folder(journal_ctl_path, with_chmod=False)
-        for node in nodes:
-            try:
-                node.run_command(f'sudo journalctl >> /tmp/{node.name}-journalctl')
-                journal_path = journal_ctl_path / node.name
-                node.download_file(f'/tmp/{node.name}-journalctl', str(journal_path))
-            except (RuntimeError, TimeoutError, SSHException):
-                logging.info(f'Could not collect journalctl for {node.name}')
+        collect_journals(nodes, str(journal_ctl_path))
 
     @staticmethod
     def verify_no_logs_uploaded(cluster, cluster_tar_path):
@@ -7,7 +7,7 @@ from dataclasses import dataclass
 from test_infra.assisted_service_api import InventoryClient, ClientFactory
 from test_infra.consts import env_defaults
 from test_infra.utils import get_kubeconfig_path, utils
-from test_infra.utils.cluster_name import ClusterName
+from test_infra.utils.cluster_name import ClusterName, get_reusable_cluster_name_suffix
 from test_infra.utils.global_variables import GlobalVariables
 from test_infra.helper_classes.config import BaseClusterConfig, BaseTerraformConfig
 
@@ -37,7 +37,10 @@ class ClusterConfig(BaseClusterConfig):
     def __post_init__(self):
         super().__post_init__()
         if self.cluster_name is None or isinstance(self.cluster_name, str):
-            self.cluster_name = ClusterName()
+            # Reused nodes are looked up by the cluster name
+            self.cluster_name = ClusterName(
+                suffix=get_reusable_cluster_name_suffix() if global_variables.reuse_nodes else None
+            )
         if self.kubeconfig_path is None:
             self.kubeconfig_path = get_kubeconfig_path(self.cluster_name.get())
         if self.iso_download_path is None:
@@ -192,7 +192,7 @@ def download_iso_from_infra_env(infra_env, cluster_config):
     logger.info('getting iso download url')
     iso_download_url = infra_env.get_iso_download_url()
     logger.info('downloading iso from url=%s', iso_download_url)
-    download_iso(iso_download_url, cluster_config.iso_download_path)
+    download_iso(iso_download_url, cluster_config.iso_download_path, image_id=infra_env.get_iso_created_time())
     assert os.path.isfile(cluster_config.iso_download_path)
 
 